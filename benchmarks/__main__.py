@@ -0,0 +1,161 @@
+"""Catalog, search, cart and checkout benchmarks.
+
+    python -m benchmarks run --products 10000 --users 50 --requests 500 --output before.json
+    python -m benchmarks run --mode server,asgi --concurrency 32 --scenarios browse,search
+    python -m benchmarks compare before.json after.json
+    python -m benchmarks autocomplete --products 1000000
+
+Runs against a freshly created test database, the configured database is never touched.
+Modes: client (in-process, counts queries), server (threaded WSGI server) and asgi (uvicorn).
+The autocomplete benchmark measures the in-memory prefix index alone and needs no database.
+"""
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SCENARIO_NAMES = ('browse', 'facets', 'api', 'search', 'cart', 'checkout')
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(options):
+    import django
+    from django.test.utils import setup_databases, setup_test_environment, teardown_databases
+
+    django.setup()
+    from django.db import connection
+
+    setup_test_environment()
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    if connection.vendor == 'sqlite' and not test_settings.get('NAME'):
+        # A shared in-memory database fails concurrent writers instead of waiting for the lock,
+        # a file keeps the server mode close to a real deployment
+        test_settings['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    databases = setup_databases(verbosity=0, interactive=False)
+    try:
+        from .runner import environment, run_asgi, run_client, run_server
+        from .scenarios import SCENARIOS, Context
+        from .seed import seed_catalog, seed_users
+
+        started = time.perf_counter()
+        seed_catalog(options.products)
+        users = seed_users(options.users, cart_size=options.cart_size)
+        print('Seeded {} products and {} users in {:.1f}s'.format(
+            options.products, options.users, time.perf_counter() - started), file=sys.stderr)
+
+        results = {}
+        for name in options.scenarios:
+            for mode in options.mode:
+                context = Context(users, seed=options.seed)
+                if mode == 'client':
+                    result = run_client(SCENARIOS[name], context, options.requests)
+                else:
+                    run = run_asgi if mode == 'asgi' else run_server
+                    result = run(SCENARIOS[name], context, options.requests, options.concurrency)
+                results['{}/{}'.format(name, mode)] = result
+                print('{:<20} {}'.format('{}/{}'.format(name, mode), format_result(result)), file=sys.stderr)
+        report = {
+            'revision': git_revision(),
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'environment': environment(),
+            'options': vars(options),
+            'results': results,
+        }
+    finally:
+        teardown_databases(databases, verbosity=0)
+    output = json.dumps(report, indent=2, default=str)
+    if options.output:
+        with open(options.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+def format_result(result):
+    line = '{requests_per_second:8.1f} req/s  p50 {p50_ms:7.1f} ms  p95 {p95_ms:7.1f} ms  p99 {p99_ms:7.1f} ms'
+    if 'queries_per_request' in result:
+        line += '  {queries_per_request:5.1f} queries'
+    if result['errors']:
+        line += '  {errors} errors'
+    return line.format(**result)
+
+
+def compare(options):
+    with open(options.before) as before_file, open(options.after) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+    print('{:<20} {:>12} {:>12} {:>8}'.format('benchmark', 'p95 before', 'p95 after', 'change'))
+    for name, result in after['results'].items():
+        if name in before['results']:
+            old, new = before['results'][name]['p95_ms'], result['p95_ms']
+            print('{:<20} {:>9.1f} ms {:>9.1f} ms {:>+7.0f}%'.format(name, old, new, (new - old) / old * 100))
+
+
+def autocomplete(options):
+    import django
+
+    django.setup()
+    from .autocomplete import run_autocomplete
+
+    result = run_autocomplete(options.products, options.queries, options.limit, options.seed)
+    print('Built {products} products in {build_seconds:.1f}s, estimated {estimated_memory_mb:.0f} MB '
+          '(process grew by {peak_memory_mb:.0f} MB)\n'
+          '{queries} lookups  p50 {p50_us:.1f} us  p95 {p95_us:.1f} us  p99 {p99_us:.1f} us  max {max_us:.1f} us'
+          .format(**result), file=sys.stderr)
+    print(json.dumps({'revision': git_revision(), 'options': vars(options), 'result': result}, indent=2))
+
+
+def modes(value):
+    selected = value.split(',')
+    unknown = set(selected) - {'client', 'server', 'asgi'}
+    if unknown:
+        raise argparse.ArgumentTypeError('unknown mode(s): {}'.format(', '.join(sorted(unknown))))
+    return selected
+
+
+def main(argv=None):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shop.settings')
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='Seed a catalog and run the benchmarks.')
+    run_parser.add_argument('--products', type=int, default=10000)
+    run_parser.add_argument('--users', type=int, default=50)
+    run_parser.add_argument('--cart-size', type=int, default=3)
+    run_parser.add_argument('--requests', type=int, default=500, help='Requests per scenario and mode.')
+    run_parser.add_argument('--concurrency', type=int, default=8, help='Parallel connections in server mode.')
+    run_parser.add_argument('--mode', type=modes, default=['client', 'server'],
+                            help='Comma separated: client, server, asgi.')
+    run_parser.add_argument('--scenarios', type=lambda value: value.split(','),
+                            default=list(SCENARIO_NAMES))
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+    compare_parser = commands.add_parser('compare', help='Compare p95 latency of two JSON reports.')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    autocomplete_parser = commands.add_parser('autocomplete', help='Build the autocomplete index and time lookups.')
+    autocomplete_parser.add_argument('--products', type=int, default=1000000)
+    autocomplete_parser.add_argument('--queries', type=int, default=10000)
+    autocomplete_parser.add_argument('--limit', type=int, default=10)
+    autocomplete_parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args(argv)
+    if options.command == 'run':
+        run(options)
+    elif options.command == 'autocomplete':
+        autocomplete(options)
+    else:
+        compare(options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import gc
+import random
+import resource
+import time
+
+from products.autocomplete import PrefixIndex
+
+from .runner import percentile
+from .seed import catalog_products, product_words
+
+
+def product_rows(count, seed=0):
+    for product_id, product in enumerate(catalog_products(count, seed), start=1):
+        yield product_id, product.name, product.producer, product.slug
+
+
+def typed_prefixes(rng, count):
+    words = product_words()
+    for _ in range(count):
+        word = rng.choice(words)
+        if rng.random() < 0.2:
+            # a word and the start of the number that follows it in the names
+            yield '{} {}'.format(word, rng.randint(1, 99))
+        else:
+            yield word[:rng.randint(1, len(word))]
+
+
+# The index alone, without HTTP or a database: build time, retained memory and lookup latency
+def run_autocomplete(products, queries, limit=10, seed=0):
+    index = PrefixIndex()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    index.load(product_rows(products, seed))
+    build_seconds = time.perf_counter() - started
+    # ru_maxrss is in kilobytes on Linux; the growth includes the rows read while building
+    peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) * 1024
+    # the first full collection after the build walks every new object once, as it would at server startup
+    gc.collect()
+    rng = random.Random(seed)
+    latencies, results = [], 0
+    for prefix in typed_prefixes(rng, queries):
+        started = time.perf_counter()
+        suggestions = index.suggest(prefix, limit)
+        latencies.append(time.perf_counter() - started)
+        results += len(suggestions['products'])
+    return {
+        'products': products,
+        'build_seconds': build_seconds,
+        'peak_memory_mb': peak / 2 ** 20,
+        'estimated_memory_mb': index.size / 2 ** 20,
+        'word_matches': index.tables.words is not None,
+        'queries': queries,
+        'results_per_query': results / queries,
+        'p50_us': percentile(latencies, 50) * 1e6,
+        'p95_us': percentile(latencies, 95) * 1e6,
+        'p99_us': percentile(latencies, 99) * 1e6,
+        'max_us': max(latencies) * 1e6,
+    }
@@ -0,0 +1,163 @@
+import http.client
+import math
+import socket
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * percent / 100) - 1, 0)]
+
+
+def summarize(latencies, errors, elapsed, queries=None):
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_second': len(latencies) / elapsed,
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+    if queries is not None:
+        result['queries_per_request'] = statistics.mean(queries)
+    return result
+
+
+class Clients:
+
+    def __init__(self):
+        self.clients = {}
+
+    def get(self, user):
+        key = user.id if user else None
+        if key not in self.clients:
+            client = Client()
+            if user:
+                client.force_login(user)
+            self.clients[key] = client
+        return self.clients[key]
+
+    def cookie(self, user):
+        cookies = self.get(user).cookies
+        return '; '.join('{}={}'.format(name, morsel.value) for name, morsel in cookies.items())
+
+
+# In-process run through the test Client, also counts queries per request
+def run_client(scenario, context, requests):
+    clients = Clients()
+    latencies, queries = [], []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        method, path, user = scenario(context)
+        client = clients.get(user)
+        with CaptureQueriesContext(connection) as captured:
+            request_started = time.perf_counter()
+            response = client.generic(method, path)
+            latencies.append(time.perf_counter() - request_started)
+        queries.append(len(captured))
+        errors += response.status_code >= 500
+    return summarize(latencies, errors, time.perf_counter() - started, queries)
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(application=None):
+    server = make_server('127.0.0.1', 0, application or get_wsgi_application(),
+                         server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def send(host, port, method, path, cookie):
+    headers = {'Host': 'testserver'}
+    if cookie:
+        headers['Cookie'] = cookie
+    http_connection = http.client.HTTPConnection(host, port, timeout=60)
+    try:
+        started = time.perf_counter()
+        http_connection.request(method, path, headers=headers)
+        response = http_connection.getresponse()
+        response.read()
+        return time.perf_counter() - started, response.status
+    finally:
+        http_connection.close()
+
+
+# Concurrent HTTP run against a server, measures what a real client would see
+def run_http(scenario, context, requests, concurrency, host, port):
+    clients = Clients()
+    planned = []
+    for _ in range(requests):
+        method, path, user = scenario(context)
+        planned.append((method, path, clients.cookie(user) if user else ''))
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda request: send(host, port, *request), planned))
+    elapsed = time.perf_counter() - started
+    return summarize([latency for latency, status in results], sum(status >= 500 for latency, status in results),
+                     elapsed)
+
+
+def run_server(scenario, context, requests, concurrency):
+    server = start_server()
+    try:
+        host, port = server.server_address
+        return run_http(scenario, context, requests, concurrency, host, port)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# uvicorn is only needed for the ASGI runs: pip install uvicorn
+def start_asgi_server(application=None):
+    import uvicorn
+
+    if application is None:
+        from shop.asgi import application
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    server = uvicorn.Server(uvicorn.Config(application, lifespan='off', log_level='warning', access_log=False))
+    thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError('ASGI server did not start')
+        time.sleep(0.01)
+    return server, thread, sock
+
+
+def run_asgi(scenario, context, requests, concurrency):
+    server, thread, sock = start_asgi_server()
+    try:
+        host, port = sock.getsockname()
+        return run_http(scenario, context, requests, concurrency, host, port)
+    finally:
+        server.should_exit = True
+        thread.join()
+        sock.close()
+
+
+def environment():
+    return {'database': settings.DATABASES['default']['ENGINE'], 'cache': settings.CACHES['default']['BACKEND']}
@@ -0,0 +1,71 @@
+import random
+
+from products.pagination import NEXT, encode_cursor
+
+from .seed import PRODUCERS, product_words, sample_products
+
+
+class Context:
+
+    def __init__(self, users, seed=0):
+        self.rng = random.Random(seed)
+        self.users = users
+        products = sample_products(self.rng, 1000)
+        self.slugs = [product.slug for product in products]
+        self.cursors = [encode_cursor(NEXT, [product.name, product.id]) for product in products[:50]]
+        self.words = product_words()
+
+
+# Every scenario returns the next request to send as (method, path, user or None)
+def browse(context):
+    choice = context.rng.random()
+    if choice < 0.3:
+        return 'GET', '/products/', None
+    if choice < 0.6:
+        return 'GET', '/products/?cursor={}'.format(context.rng.choice(context.cursors)), None
+    return 'GET', '/products/details/{}'.format(context.rng.choice(context.slugs)), None
+
+
+# Filtered catalog pages, counts come from the facet summary
+def facets(context):
+    params = context.rng.choice((
+        'producer={}'.format(context.rng.choice(PRODUCERS)),
+        'price={}'.format(context.rng.choice((0, 25, 50, 100, 250))),
+        'producer={}&price=100'.format(context.rng.choice(PRODUCERS)),
+    ))
+    return 'GET', '/products/?{}'.format(params), None
+
+
+def search(context):
+    word = context.rng.choice(context.words)
+    return 'GET', '/products/search/?phrase={}'.format(word[:context.rng.randint(3, len(word))]), None
+
+
+def cart(context):
+    user = context.rng.choice(context.users)
+    slug = context.rng.choice(context.slugs)
+    return context.rng.choice((
+        ('GET', '/products/add_to_cart/{}'.format(slug), user),
+        ('GET', '/products/cart/', user),
+        ('GET', '/products/remove_from_cart/{}'.format(slug), user),
+    ))
+
+
+def checkout(context):
+    user = context.rng.choice(context.users)
+    if context.rng.random() < 0.5:
+        return 'GET', '/products/add_to_cart/{}'.format(context.rng.choice(context.slugs)), user
+    return 'GET', '/products/confirm_order/', user
+
+
+# The browse mix over the JSON API, a page of 12 like categories.html
+def api(context):
+    choice = context.rng.random()
+    if choice < 0.3:
+        return 'GET', '/products/api/?limit=12', None
+    if choice < 0.6:
+        return 'GET', '/products/api/?limit=12&cursor={}'.format(context.rng.choice(context.cursors)), None
+    return 'GET', '/products/api/{}'.format(context.rng.choice(context.slugs)), None
+
+
+SCENARIOS = {'browse': browse, 'facets': facets, 'api': api, 'search': search, 'cart': cart, 'checkout': checkout}
@@ -0,0 +1,70 @@
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db.models import Max, Min
+
+from products.autocomplete import autocomplete_index
+from products.cart import add_to_cart
+from products.catalog_cache import bump_catalog_generation
+from products.facets import rebuild_facets
+from products.models import ClientAdress, Product
+from products.search import get_index
+
+PRODUCERS = ('Bosch', 'Philips', 'Tefal', 'Braun', 'Siemens', 'Zelmer', 'Electrolux', 'Samsung', 'Sony', 'Gorenje')
+ADJECTIVES = ('Compact', 'Classic', 'Smart', 'Silent', 'Steel', 'Portable', 'Digital', 'Premium', 'Mini', 'Turbo')
+NOUNS = ('kettle', 'toaster', 'blender', 'mixer', 'grill', 'fryer', 'juicer', 'heater', 'fan', 'vacuum')
+IMAGE = 'media/images/test_image.jpg'
+
+
+def product_words():
+    return [word.lower() for word in PRODUCERS + ADJECTIVES + NOUNS]
+
+
+def sample_products(rng, count):
+    bounds = Product.objects.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return []
+    ids = range(bounds['low'], bounds['high'] + 1)
+    return list(Product.objects.filter(id__in=rng.sample(ids, min(count, len(ids)))))
+
+
+def catalog_products(count, seed=0):
+    rng = random.Random(seed)
+    for number in range(count):
+        producer = rng.choice(PRODUCERS)
+        name = '{} {} {}'.format(rng.choice(ADJECTIVES), rng.choice(NOUNS), number)
+        price = round(rng.uniform(1, 500), 2)
+        yield Product(name=name, producer=producer, price=price, image=IMAGE,
+                      description='{} {} by {}'.format(name, rng.choice(NOUNS), producer),
+                      slug=Product.make_slug(producer, name), price_bucket=Product.make_price_bucket(price))
+
+
+def seed_catalog(count, batch_size=5000, seed=0):
+    batch = []
+    for product in catalog_products(count, seed):
+        batch.append(product)
+        if len(batch) == batch_size:
+            Product.objects.bulk_create(batch)
+            batch = []
+    Product.objects.bulk_create(batch)
+    get_index().rebuild()
+    autocomplete_index.rebuild()
+    rebuild_facets()
+    bump_catalog_generation()
+
+
+def seed_users(count, cart_size=3, seed=0):
+    rng = random.Random(seed)
+    password = make_password('benchmark')
+    User.objects.bulk_create([User(username='bench_user_{}'.format(number), password=password,
+                                   email='bench_user_{}@example.com'.format(number)) for number in range(count)])
+    users = list(User.objects.filter(username__startswith='bench_user_').order_by('id'))
+    ClientAdress.objects.bulk_create([
+        ClientAdress(client=user, name='Bench', surname=user.username, street='Main', zip_code='00-001',
+                     city='Warsaw', street_number='1', apartment_number='2') for user in users])
+    products = sample_products(rng, max(cart_size * 10, 100))
+    for user in users:
+        for product in rng.sample(products, min(cart_size, len(products))):
+            add_to_cart(user, product)
+    return users
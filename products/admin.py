@@ -1,8 +1,16 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from django.db.models import Q
+from django.template.response import TemplateResponse
+
+from .catalog_io import adjust_prices, delete_products
 from .models import ClientAdress, Product
+from .pagination import EstimatedCountPaginator
+from .search import search_ids
 
 
 class UserCreateForm(UserCreationForm):
@@ -23,8 +31,85 @@ class UserAdmin(UserAdmin):
     )
 
 
+class PriceAdjustmentForm(forms.Form):
+    percentage = forms.DecimalField(max_digits=6, decimal_places=2, min_value=-99, max_value=1000,
+                                    help_text='E.g. 10 raises the prices by 10%, -15 lowers them by 15%.')
+
+
+def bulk_action_page(model_admin, request, queryset, action, title, form=None):
+    return TemplateResponse(request, 'admin/products/bulk_action.html', {
+        **model_admin.admin_site.each_context(request),
+        'title': title,
+        'opts': model_admin.model._meta,
+        'action': action,
+        'form': form,
+        'count': queryset.count(),
+        'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+        'select_across': request.POST.get('select_across', '0'),
+        'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+    })
+
+
+@admin.register(Product)
+class ProductAdmin(admin.ModelAdmin):
+    list_display = ('name', 'producer', 'price', 'slug')
+    ordering = ('name', 'id')
+    search_fields = ('name', 'producer', 'description')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ('adjust_prices', 'delete_products')
+
+    def get_actions(self, request):
+        # replaced by delete_products, which does not load and signal every product
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    # Answered by the search index instead of LIKE scans over three columns
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        ids, truncated = search_ids(search_term)
+        if truncated:
+            self.message_user(request, 'Only the best {} matches are listed, a longer search term finds the others.'
+                              .format(len(ids)), messages.WARNING)
+        return queryset.filter(pk__in=ids), False
+
+    @admin.action(description='Adjust prices of selected products by a percentage', permissions=['change'])
+    def adjust_prices(self, request, queryset):
+        form = PriceAdjustmentForm(request.POST if 'apply' in request.POST else None)
+        if not form.is_valid():
+            return bulk_action_page(self, request, queryset, 'adjust_prices', 'Adjust prices', form)
+        count = adjust_prices(queryset, form.cleaned_data['percentage'])
+        self.message_user(request, 'Adjusted the price of {} product(s).'.format(count))
+
+    @admin.action(description='Delete selected products and their images', permissions=['delete'])
+    def delete_products(self, request, queryset):
+        if 'apply' not in request.POST:
+            return bulk_action_page(self, request, queryset, 'delete_products', 'Delete products')
+        count = delete_products(queryset)
+        self.message_user(request, 'Deleted {} product(s).'.format(count))
+
+
+@admin.register(ClientAdress)
+class ClientAdressAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'name', 'surname', 'company', 'city')
+    # __str__ shows the username
+    list_select_related = ('client',)
+    search_fields = ('client__username', 'surname', 'tax_number')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    # Exact matches only, each one served by an index
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        condition = Q(client__in=User.objects.filter(username=term).values('pk')) | Q(surname=term)
+        if term.isdigit() and len(term) < 19:
+            condition |= Q(tax_number=int(term))
+        return queryset.filter(condition), False
+
+
 admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
-admin.site.register(ClientAdress)
-admin.site.register(Product)
-
@@ -0,0 +1,194 @@
+from functools import wraps
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+from django.utils.text import compress_string
+
+from shop.pooling import thread_pooled
+
+from .autocomplete import suggest
+from .catalog_cache import conditional_catalog_response
+from .images import derivative_urls
+from .models import Product
+from .pagination import CursorPaginator, InvalidCursor
+from .search import ranked_products, search_ids
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# API field -> Product column
+FIELDS = {
+    'id': 'id',
+    'slug': 'slug',
+    'name': 'name',
+    'producer': 'producer',
+    'description': 'description',
+    'price': 'price',
+    'image': 'image',
+    'images': 'image_derivatives',
+}
+DEFAULT_FIELDS = ('slug', 'name', 'producer', 'price', 'image')
+IMAGE_FORMATS = ('webp', 'jpeg')
+COMPRESS_MIN_LENGTH = 200
+
+accepts_brotli = _lazy_re_compile(r'\bbr\b')
+accepts_gzip = _lazy_re_compile(r'\bgzip\b')
+
+
+class InvalidParameter(ValueError):
+    pass
+
+
+def api_view(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return JsonResponse({'error': 'Method not allowed'}, status=405)
+        try:
+            return view(request, *args, **kwargs)
+        except InvalidParameter as error:
+            return JsonResponse({'error': str(error)}, status=400)
+    return wrapper
+
+
+# Like GZipMiddleware, but only for the API and with brotli when it is installed
+def compressed(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if response.status_code != 200 or response.has_header('Content-Encoding'):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is not None and accepts_brotli.search(accept_encoding):
+            encoding = 'br'
+        elif accepts_gzip.search(accept_encoding):
+            encoding = 'gzip'
+        else:
+            return response
+        if len(response.content) < COMPRESS_MIN_LENGTH:
+            return response
+        content = brotli.compress(response.content, quality=5) if encoding == 'br' \
+            else compress_string(response.content)
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        # the body differs per encoding, so the validator of the uncompressed body is only weak
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+    return wrapper
+
+
+def selected_fields(request):
+    requested = request.GET.get('fields')
+    if requested is None:
+        return DEFAULT_FIELDS
+    fields = tuple(dict.fromkeys(field.strip() for field in requested.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in FIELDS]
+    if not fields or unknown:
+        raise InvalidParameter('Unknown field(s): {}. Available: {}'.format(
+            ', '.join(unknown) or requested, ', '.join(FIELDS)))
+    return fields
+
+
+def suggestion_count(request):
+    try:
+        limit = int(request.GET.get('limit', settings.AUTOCOMPLETE_MAX_RESULTS))
+    except ValueError:
+        raise InvalidParameter('limit must be an integer')
+    if not 1 <= limit <= settings.AUTOCOMPLETE_MAX_RESULTS:
+        raise InvalidParameter('limit must be between 1 and {}'.format(settings.AUTOCOMPLETE_MAX_RESULTS))
+    return limit
+
+
+def page_size(request):
+    try:
+        limit = int(request.GET.get('limit', settings.API_PAGE_SIZE))
+    except ValueError:
+        raise InvalidParameter('limit must be an integer')
+    if not 1 <= limit <= settings.API_MAX_PAGE_SIZE:
+        raise InvalidParameter('limit must be between 1 and {}'.format(settings.API_MAX_PAGE_SIZE))
+    return limit
+
+
+# Only the requested columns are read, as dicts, and the cursor columns on top of them
+def columns(fields, ordering=()):
+    return tuple(dict.fromkeys([FIELDS[field] for field in fields] + list(ordering)))
+
+
+def serialize(row, fields):
+    item = {}
+    for field in fields:
+        value = row[FIELDS[field]]
+        if field == 'image':
+            value = Product._meta.get_field('image').storage.url(value) if value else None
+        elif field == 'images':
+            value = {image_format: [{'width': width, 'url': url} for width, url in derivative_urls(value, image_format)]
+                     for image_format in IMAGE_FORMATS}
+        item[field] = value
+    return item
+
+
+# A page is at most API_MAX_PAGE_SIZE rows, it is read whole and sent as one JSON document
+def page_response(queryset, request, fields, ordering, extra=None):
+    paginator = CursorPaginator(queryset.values(*columns(fields, ordering)), page_size(request), ordering=ordering)
+    try:
+        page = paginator.get_page(request.GET.get('cursor'), strict=True)
+    except InvalidCursor:
+        raise InvalidParameter('invalid cursor')
+    data = {'results': [serialize(row, fields) for row in page], 'next': page.next_cursor,
+            'previous': page.previous_cursor}
+    data.update(extra or {})
+    return JsonResponse(data)
+
+
+@thread_pooled
+@api_view
+@compressed
+@conditional_catalog_response
+def products_list(request):
+    return page_response(Product.objects.all(), request, selected_fields(request), ('name', 'id'))
+
+
+@thread_pooled
+@api_view
+@compressed
+@conditional_catalog_response
+def product_detail(request, slug):
+    fields = selected_fields(request)
+    row = Product.objects.filter(slug=slug).values(*columns(fields)).first()
+    if row is None:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    return JsonResponse(serialize(row, fields))
+
+
+@thread_pooled
+@api_view
+@compressed
+@conditional_catalog_response
+def search(request):
+    phrase = request.GET.get('q', '').strip()
+    if not phrase:
+        raise InvalidParameter('q is required')
+    ids, truncated = search_ids(phrase)
+    # true when more products matched than the SEARCH_MAX_RESULTS listed
+    return page_response(ranked_products(ids), request, selected_fields(request), ('search_rank', 'id'),
+                         {'truncated': truncated})
+
+
+# Names and producers starting with what was typed, from the in-process prefix index
+@thread_pooled
+@api_view
+@compressed
+@conditional_catalog_response
+def autocomplete(request):
+    prefix = request.GET.get('q', '').strip()
+    if not prefix:
+        raise InvalidParameter('q is required')
+    return JsonResponse(suggest(prefix, suggestion_count(request)))
@@ -0,0 +1,319 @@
+import logging
+import re
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .catalog_cache import catalog_generation
+from .models import Product
+from .search import fold, search_products
+
+logger = logging.getLogger(__name__)
+
+WORD_START = re.compile(r'(?<!\w)\w')
+# rough CPython sizes: a list slot, an array('q') item and a dict entry with its int key
+SLOT_SIZE = 8
+ID_SIZE = 8
+ENTRY_SIZE = 100
+FIELDS = ('name', 'producer', 'slug')
+SEPARATOR = '\x00'
+
+
+def normalize(text):
+    # case, accents and repeated spaces do not matter while typing, folded the way the search tokens are
+    return ' '.join(fold(text).split())
+
+
+# Suggestions start with what was typed: the name or the producer followed by the name. Words inside the name
+# are keyed with the rest of it, so "kettle 2" finds "Compact kettle 2000".
+def product_keys(name, producer):
+    name = normalize(name)
+    starts = (name, '{} {}'.format(normalize(producer), name))
+    return starts, [name[match.start():] for match in WORD_START.finditer(name)][1:]
+
+
+# One string per product instead of a tuple of three, half the objects for the same text
+def pack(name, producer, slug):
+    return SEPARATOR.join((name, producer, slug))
+
+
+def unpack(entry):
+    return entry.split(SEPARATOR)
+
+
+def key_size(key):
+    return sys.getsizeof(key) + SLOT_SIZE + ID_SIZE
+
+
+# Sorted keys with the product id of each key in a parallel array; one key can belong to several products
+class SortedKeys:
+
+    def __init__(self, keys=(), ids=()):
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.keys = [keys[position] for position in order]
+        self.ids = array('q', (ids[position] for position in order))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def insert(self, key, product_id):
+        position = bisect_right(self.keys, key)
+        self.keys.insert(position, key)
+        self.ids.insert(position, product_id)
+
+    def delete(self, key, product_id):
+        position = bisect_left(self.keys, key)
+        while position < len(self.keys) and self.keys[position] == key:
+            if self.ids[position] == product_id:
+                del self.keys[position]
+                del self.ids[position]
+                return
+            position += 1
+
+    def scan(self, prefix):
+        position = bisect_left(self.keys, prefix)
+        while position < len(self.keys) and self.keys[position].startswith(prefix):
+            yield self.ids[position]
+            position += 1
+
+
+class PrefixTables:
+
+    def __init__(self, products, starts, words, size):
+        self.products = products
+        self.starts = starts
+        # None once the word keys did not fit in AUTOCOMPLETE_MEMORY_LIMIT
+        self.words = words
+        self.size = size
+        self.producers = {}
+        for name, producer, slug in map(unpack, products.values()):
+            self.producers[producer] = self.producers.get(producer, 0) + 1
+        self.producer_keys = sorted((normalize(producer), producer) for producer in self.producers)
+
+    def add(self, product_id, name, producer, slug):
+        self.remove(product_id)
+        self.products[product_id] = entry = pack(name, producer, slug)
+        self.size += ENTRY_SIZE + sys.getsizeof(entry)
+        starts, words = product_keys(name, producer)
+        for key in starts:
+            self.starts.insert(key, product_id)
+            self.size += key_size(key)
+        if self.words is not None:
+            for key in words:
+                self.words.insert(key, product_id)
+                self.size += key_size(key)
+        self.producers[producer] = self.producers.get(producer, 0) + 1
+        if self.producers[producer] == 1:
+            self.producer_keys = sorted((normalize(producer), producer) for producer in self.producers)
+
+    def remove(self, product_id):
+        entry = self.products.pop(product_id, None)
+        if entry is None:
+            return
+        name, producer, slug = unpack(entry)
+        self.size -= ENTRY_SIZE + sys.getsizeof(entry)
+        starts, words = product_keys(name, producer)
+        for key in starts:
+            self.starts.delete(key, product_id)
+            self.size -= key_size(key)
+        if self.words is not None:
+            for key in words:
+                self.words.delete(key, product_id)
+                self.size -= key_size(key)
+        self.producers[producer] -= 1
+        if not self.producers[producer]:
+            del self.producers[producer]
+            self.producer_keys = sorted((normalize(producer), producer) for producer in self.producers)
+
+    def suggest(self, prefix, limit):
+        found = []
+        for table in (self.starts, self.words):
+            if table is None:
+                continue
+            for product_id in table.scan(prefix):
+                if len(found) == limit:
+                    break
+                if product_id not in found:
+                    found.append(product_id)
+        producers = []
+        position = bisect_left(self.producer_keys, (prefix,))
+        while position < len(self.producer_keys) and len(producers) < limit \
+                and self.producer_keys[position][0].startswith(prefix):
+            producers.append(self.producer_keys[position][1])
+            position += 1
+        return {
+            'products': [dict(zip(FIELDS, unpack(self.products[product_id]))) for product_id in found],
+            'producers': producers,
+        }
+
+
+# Names and producers for search-as-you-type, answered from memory in a few microseconds. It is built once,
+# at startup by preload() or on the first request, and follows committed product changes of its own process
+# through the signals. Changes made by other processes bump the catalog generation, which a lookup compares
+# with the one the index was read at to rebuild it in the background.
+class PrefixIndex:
+    # False builds on the looking up thread, for tests whose data other connections cannot see
+    background = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.build_lock = threading.RLock()
+        self.tables = None
+        self.loaded = False
+        self.building = False
+        self.pending = []
+        self.generation = None
+        self.refreshed = 0
+
+    def build(self, rows):
+        limit = settings.AUTOCOMPLETE_MEMORY_LIMIT
+        products, starts, start_ids, words, word_ids = {}, [], [], [], []
+        size = words_size = 0
+        for product_id, name, producer, slug in rows:
+            products[product_id] = entry = pack(name, producer, slug)
+            size += ENTRY_SIZE + sys.getsizeof(entry)
+            product_starts, product_words = product_keys(name, producer)
+            for key in product_starts:
+                starts.append(key)
+                start_ids.append(product_id)
+                size += key_size(key)
+            if words is not None:
+                for key in product_words:
+                    words.append(key)
+                    word_ids.append(product_id)
+                    words_size += key_size(key)
+                if size + words_size > limit:
+                    logger.warning('Autocomplete word matches exceed AUTOCOMPLETE_MEMORY_LIMIT, only name and '
+                                   'producer prefixes are indexed')
+                    words = word_ids = None
+                    words_size = 0
+            if size > limit:
+                logger.error('Autocomplete index exceeds AUTOCOMPLETE_MEMORY_LIMIT, suggestions come from search')
+                return None
+        return PrefixTables(products, SortedKeys(starts, start_ids),
+                            SortedKeys(words, word_ids) if words is not None else None, size + words_size)
+
+    def load(self, rows=None):
+        with self.build_lock:
+            with self.lock:
+                self.building = True
+                self.pending = []
+            try:
+                # read before the catalog, a change committed while it is read shows as a newer generation
+                generation = catalog_generation()
+                if rows is None:
+                    rows = Product.objects.values_list('id', 'name', 'producer', 'slug').iterator(chunk_size=5000)
+                tables = self.build(rows)
+            except Exception:
+                with self.lock:
+                    self.building = False
+                raise
+            with self.lock:
+                # changes saved while the catalog was read are applied on top of it
+                for product_id, entry in self.pending if tables is not None else ():
+                    if entry is None:
+                        tables.remove(product_id)
+                    else:
+                        tables.add(product_id, *entry)
+                self.tables = tables
+                self.generation = generation
+                self.loaded = True
+                self.building = False
+                self.pending = []
+
+    def ensure_loaded(self):
+        with self.build_lock:
+            if not self.loaded:
+                self.load()
+
+    def load_in_background(self, load, name):
+        def run():
+            try:
+                load()
+            except DatabaseError:
+                logger.exception('Autocomplete index could not be loaded')
+            finally:
+                connections.close_all()
+        threading.Thread(target=run, name=name, daemon=True).start()
+
+    # Servers build the index next to the first requests, which are answered from search until it is ready
+    def preload(self):
+        self.load_in_background(self.ensure_loaded, 'autocomplete-preload')
+
+    # At most one rebuild per AUTOCOMPLETE_REBUILD_INTERVAL, lookups use the current tables until it is done
+    def refresh(self):
+        with self.lock:
+            if self.building or self.generation == catalog_generation() \
+                    or time.monotonic() - self.refreshed < settings.AUTOCOMPLETE_REBUILD_INTERVAL:
+                return
+            self.refreshed = time.monotonic()
+        if self.background:
+            self.load_in_background(self.load, 'autocomplete-refresh')
+        else:
+            self.load()
+
+    def change(self, product_id, entry):
+        with self.lock:
+            if self.building:
+                self.pending.append((product_id, entry))
+            elif self.tables is not None:
+                if entry is None:
+                    self.tables.remove(product_id)
+                else:
+                    self.tables.add(product_id, *entry)
+
+    def add(self, product):
+        self.change(product.id, (product.name, product.producer, product.slug))
+
+    def remove(self, product_id):
+        self.remove_many([product_id])
+
+    def remove_many(self, product_ids):
+        for product_id in product_ids:
+            self.change(product_id, None)
+
+    # Bulk changes reload a loaded index, an unloaded one is read on first use anyway
+    def rebuild(self):
+        if self.loaded:
+            self.load()
+
+    def clear(self):
+        with self.lock:
+            self.tables = None
+            self.loaded = False
+
+    @property
+    def size(self):
+        tables = self.tables
+        return tables.size if tables is not None else 0
+
+    # None while the first build runs in another thread or when the index did not fit in the memory budget
+    def suggest(self, prefix, limit):
+        if not self.loaded and not self.building:
+            self.ensure_loaded()
+        elif self.loaded:
+            self.refresh()
+        prefix = normalize(prefix)
+        with self.lock:
+            if self.tables is None:
+                return None
+            if not prefix:
+                return {'products': [], 'producers': []}
+            return self.tables.suggest(prefix, limit)
+
+
+autocomplete_index = PrefixIndex()
+
+
+def suggest(prefix, limit):
+    suggestions = autocomplete_index.suggest(prefix, limit)
+    if suggestions is None:
+        products = search_products(prefix, limit).values_list('name', 'producer', 'slug')
+        suggestions = {'products': [dict(zip(FIELDS, row)) for row in products],
+                       'producers': []}
+    return suggestions
@@ -0,0 +1,152 @@
+import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .catalog_cache import catalog_generation
+from .jobs import enqueue
+from .models import Order, OrderProduct, Product
+from .tasks import SEND_INVOICE
+
+ZERO = Decimal('0.00')
+
+
+def money_field():
+    return DecimalField(max_digits=12, decimal_places=2)
+
+
+# Placed lines at the price they were charged, cart lines at the product's current price
+def line_total():
+    return Sum(F('quantity') * Coalesce('unit_price', 'product__price'), output_field=money_field())
+
+
+def current_price():
+    return Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1], output_field=money_field())
+
+
+# The value of each order computed from its lines, usable in a set-wise UPDATE of many orders
+def order_value_expression():
+    totals = OrderProduct.objects.filter(order=OuterRef('pk')).values('order') \
+        .annotate(total=line_total()).values('total')
+    return Coalesce(Subquery(totals, output_field=money_field()), Value(ZERO), output_field=money_field())
+
+
+def reconcile_order_values(orders, dry_run=False, batch_size=500):
+    expected = orders.annotate(expected=order_value_expression()).values_list('pk', 'value', 'expected')
+    stale = [pk for pk, value, total in expected.iterator() if value != total]
+    if not dry_run:
+        for start in range(0, len(stale), batch_size):
+            Order.objects.filter(pk__in=stale[start:start + batch_size]).update(value=order_value_expression())
+    return stale
+
+
+def open_orders_with(products):
+    return Order.objects.filter(ordered=False, products__product__in=products.values('pk'))
+
+
+# Every mutation locks the user's open order first, so concurrent clicks of one user are serialized
+def get_open_order(user, lock=False):
+    orders = Order.objects.filter(user=user, ordered=False)
+    if lock:
+        orders = orders.select_for_update()
+    return orders.first()
+
+
+# Keyed by the catalog generation so product edits are reflected in cached carts
+def cart_cache_key(user_id):
+    return 'cart:{}:{}'.format(catalog_generation(), user_id)
+
+
+def build_cart_summary(user):
+    order_products = OrderProduct.objects.filter(order__user=user, order__ordered=False) \
+        .select_related('product').annotate(order_value=F('order__value')).order_by('id')
+    items = [{
+        'slug': order_product.product.slug,
+        'name': order_product.product.name,
+        'producer': order_product.product.producer,
+        'price': order_product.product.price,
+        'image_url': order_product.product.image.url,
+        'image_derivatives': order_product.product.image_derivatives,
+        'quantity': order_product.quantity,
+    } for order_product in order_products]
+    return {
+        'items': items,
+        'count': sum(item['quantity'] for item in items),
+        'value': order_products[0].order_value if items else 0,
+    }
+
+
+def get_cart_summary(user):
+    key = cart_cache_key(user.id)
+    summary = cache.get(key)
+    if summary is None:
+        summary = build_cart_summary(user)
+        cache.set(key, summary, settings.CART_CACHE_TIMEOUT)
+    return summary
+
+
+def invalidate_cart_summary(user):
+    cache.delete(cart_cache_key(user.id))
+
+
+def add_to_cart(user, product):
+    with transaction.atomic():
+        order = get_open_order(user, lock=True)
+        created = order is None
+        if created:
+            try:
+                with transaction.atomic():
+                    order = Order.objects.create(user=user, ordered_time=timezone.now(), value=product.price)
+            except IntegrityError:
+                # a concurrent click opened the cart first, one_open_order_per_user keeps it the only one
+                order = get_open_order(user, lock=True)
+                created = False
+        if created or not OrderProduct.objects.filter(order=order, product=product, ordered=False) \
+                .update(quantity=F('quantity') + 1):
+            order_product = OrderProduct.objects.create(user=user, product=product)
+            Order.products.through.objects.create(order_id=order.id, orderproduct_id=order_product.id)
+        if not created:
+            # recomputed from the lines, a price edited since the last change would leave an increment off
+            Order.objects.filter(pk=order.pk).update(value=order_value_expression())
+    invalidate_cart_summary(user)
+    return order
+
+
+def remove_from_cart(user, product):
+    with transaction.atomic():
+        order = get_open_order(user, lock=True)
+        if order is None:
+            return None
+        order_product = OrderProduct.objects.filter(order=order, product=product, ordered=False).first()
+        if order_product is None:
+            return order
+        if order_product.quantity > 1:
+            OrderProduct.objects.filter(pk=order_product.pk).update(quantity=F('quantity') - 1)
+        else:
+            order_product.delete()
+        Order.objects.filter(pk=order.pk).update(value=order_value_expression())
+    invalidate_cart_summary(user)
+    return order
+
+
+def checkout(user):
+    with transaction.atomic():
+        order = get_open_order(user, lock=True)
+        if order is None:
+            return None
+        order.ordered_time = timezone.now()
+        order.payment_time = order.ordered_time + datetime.timedelta(days=14)
+        order.ordered = True
+        order.invoice_status = Order.INVOICE_PENDING
+        # prices may have changed since the items were added, the lines keep the current ones as charged
+        OrderProduct.objects.filter(order=order).update(ordered=True, unit_price=current_price())
+        order.value = OrderProduct.objects.filter(order=order).aggregate(total=line_total())['total'] or ZERO
+        order.save()
+        enqueue(SEND_INVOICE, order.id)
+    invalidate_cart_summary(user)
+    return order
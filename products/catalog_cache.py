@@ -0,0 +1,126 @@
+import hashlib
+import json
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+GENERATION_KEY = 'catalog:generation'
+
+
+# The generation is the time of the last catalog change, it versions every cached catalog page. It lives in the
+# default cache, which settings require to be shared when more than one process serves requests.
+def catalog_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, time.time(), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def bump_catalog_generation():
+    generation = max(time.time(), (cache.get(GENERATION_KEY) or 0) + 0.001)
+    cache.set(GENERATION_KEY, generation, None)
+    return generation
+
+
+def catalog_context():
+    return {'catalog_generation': catalog_generation()}
+
+
+# Stored pages pass the parameters their view validated, so a made up query string is no new entry;
+# validators of responses that are not stored may follow the full path
+def catalog_validators(request, parameters=None):
+    generation = catalog_generation()
+    if parameters is None:
+        name = request.get_full_path()
+    else:
+        name = '{}?{}'.format(request.path, json.dumps(parameters, cls=DjangoJSONEncoder))
+    key = 'catalog:page:{}:{}'.format(generation, hashlib.md5(name.encode()).hexdigest())
+    return key, quote_etag(hashlib.md5(key.encode()).hexdigest()), int(generation)
+
+
+def patch_catalog_headers(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, public=True, max_age=settings.CATALOG_BROWSER_MAX_AGE)
+    # logged in users see their name in the header, shared caches keep a copy per Cookie header
+    patch_vary_headers(response, ('Cookie',))
+
+
+# Without a session cookie nobody is logged in, so the session is not loaded at all: no session store read,
+# no Set-Cookie and the response is the same for every anonymous visitor
+def is_anonymous_read(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        request.user = AnonymousUser()
+        return True
+    return not request.user.is_authenticated
+
+
+def path_only(request, *args, **kwargs):
+    return []
+
+
+# Anonymous pages are stored once per path and the parameters page_parameters(request, *args, **kwargs) returns
+# for the query string; None stores nothing, for values that cannot be bounded such as unknown filters
+def cached_catalog_page(page_parameters=path_only):
+    def decorator(view):
+        conditional = conditional_catalog_response(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not is_anonymous_read(request):
+                return view(request, *args, **kwargs)
+            parameters = page_parameters(request, *args, **kwargs)
+            if parameters is None:
+                return conditional(request, *args, **kwargs)
+            key, etag, last_modified = catalog_validators(request, parameters)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                content = cache.get(key)
+                if content is None:
+                    response = view(request, *args, **kwargs)
+                    if response.status_code != 200:
+                        return response
+                    cache.set(key, response.content, settings.CATALOG_CACHE_TIMEOUT)
+                else:
+                    response = HttpResponse(content)
+            patch_catalog_headers(response, etag, last_modified)
+            return response
+        return wrapper
+    return decorator
+
+
+# Validators only, for responses that are the same for every user but not worth caching whole
+def conditional_catalog_response(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key, etag, last_modified = catalog_validators(request)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        patch_catalog_headers(response, etag, last_modified)
+        return response
+    return wrapper
+
+
+# Validators for anonymous reads of pages with too many variants to store, such as search results
+def conditional_anonymous_page(view):
+    conditional = conditional_catalog_response(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not is_anonymous_read(request):
+            return view(request, *args, **kwargs)
+        return conditional(request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,219 @@
+import csv
+import json
+import time
+from decimal import Decimal
+
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F, Func, Q, Value
+
+from .autocomplete import autocomplete_index
+from .cart import money_field, open_orders_with, reconcile_order_values
+from .catalog_cache import bump_catalog_generation
+from .facets import price_bucket, rebuild_facets
+from .forms import ImportProduct
+from .jobs import enqueue_many
+from .models import Order, Product
+from .search import get_index
+from .signals import bulk_change
+from .tasks import GENERATE_IMAGE_DERIVATIVES
+
+FIELDS = ('name', 'producer', 'description', 'price', 'image', 'slug')
+UPDATE_FIELDS = ('name', 'producer', 'description', 'price', 'image')
+FORMATS = ('csv', 'jsonl')
+DELETE_BATCH_SIZE = 500
+
+
+def row_error(message, code):
+    return {'__all__': [{'message': message, 'code': code}]}
+
+
+# Stands for a JSON line that is not an object, import_products counts it with the invalid rows
+class MalformedRow:
+
+    def __init__(self, message):
+        self.errors = row_error(message, 'invalid')
+
+
+def read_rows(stream, file_format):
+    if file_format == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as error:
+                yield MalformedRow('Invalid JSON: {}'.format(error))
+                continue
+            yield row if isinstance(row, dict) else MalformedRow('Expected a JSON object')
+
+
+class ImportStats:
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+
+    @property
+    def rows_per_second(self):
+        return self.rows / max(time.monotonic() - self.started, 1e-9)
+
+
+# A row updates the product of its slug column, or without one the product with its producer and name, and
+# creates a product when there is none. Each batch is written in its own transaction; signals are replaced by one
+# refresh at the end.
+def import_products(rows, batch_size=1000):
+    stats = ImportStats()
+    batch = {}
+    # first line of every product key, a later row with the same key would overwrite it unnoticed
+    seen = {}
+    for line, row in enumerate(rows, start=1):
+        stats.rows += 1
+        if isinstance(row, MalformedRow):
+            stats.errors.append((line, row.errors))
+            continue
+        form = ImportProduct(row)
+        if not form.is_valid():
+            stats.errors.append((line, form.errors.get_json_data()))
+            continue
+        product = Product(**{field: form.cleaned_data[field] for field in UPDATE_FIELDS})
+        product.slug = form.cleaned_data['slug']
+        key = ('slug', product.slug) if product.slug else ('name', product.producer, product.name)
+        if key in seen:
+            stats.errors.append((line, row_error('Same product as row {}'.format(seen[key]), 'duplicate')))
+            continue
+        seen[key] = line
+        product.price_bucket = price_bucket(product.price)
+        batch[key] = (line, product)
+        if len(batch) >= batch_size:
+            _write_batch(batch, stats)
+            batch = {}
+    if batch:
+        _write_batch(batch, stats)
+    if stats.created or stats.updated:
+        get_index().rebuild()
+        autocomplete_index.rebuild()
+        rebuild_facets()
+        bump_catalog_generation()
+    return stats
+
+
+# New products get the slug Product.save would give them, suffixed when it is taken or given out in the batch
+def assign_slugs(products):
+    for product in products:
+        product.slug = product.slug or Product.make_slug(product.producer, product.name)
+    taken = set(Product.objects.filter(slug__in=[product.slug for product in products])
+                .values_list('slug', flat=True))
+    assigned = set()
+    for product in products:
+        if product.slug in taken or product.slug in assigned:
+            product.slug = product.unique_slug(product.slug, reserved=assigned)
+        assigned.add(product.slug)
+
+
+def _write_batch(batch, stats):
+    with transaction.atomic():
+        slugs = [key[1] for key in batch if key[0] == 'slug']
+        names = {key[2] for key in batch if key[0] == 'name'}
+        existing = {('slug', slug): [product_id] for slug, product_id in
+                    Product.objects.filter(slug__in=slugs).values_list('slug', 'id')}
+        for product_id, producer, name in Product.objects.filter(name__in=names).values_list('id', 'producer', 'name'):
+            existing.setdefault(('name', producer, name), []).append(product_id)
+        created, updated = [], []
+        for key, (line, product) in batch.items():
+            matches = existing.get(key, [])
+            if len(matches) > 1:
+                stats.errors.append((line, row_error('{} products are named {} by {}, give the slug of the one to '
+                                                     'update'.format(len(matches), product.name, product.producer),
+                                                     'ambiguous')))
+            elif matches:
+                product.id = matches[0]
+                updated.append(product)
+            else:
+                created.append(product)
+        assign_slugs(created)
+        Product.objects.bulk_create(created)
+        Product.objects.bulk_update(updated, UPDATE_FIELDS + ('price_bucket',))
+        # bulk_create does not return ids on every backend, so the batch is read back once
+        written = Product.objects.filter(Q(slug__in=[product.slug for product in created]) |
+                                         Q(pk__in=[product.id for product in updated])) \
+            .values_list('id', 'image', 'image_derivatives')
+        enqueue_many(GENERATE_IMAGE_DERIVATIVES, [product_id for product_id, image, derivatives in written
+                                                  if image and derivatives.get('source') != image])
+    stats.created += len(created)
+    stats.updated += len(updated)
+
+
+def export_products(stream, file_format, chunk_size=2000):
+    products = Product.objects.order_by('id').values_list(*FIELDS).iterator(chunk_size=chunk_size)
+    count = 0
+    if file_format == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(FIELDS)
+        for row in products:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in products:
+            stream.write(json.dumps(dict(zip(FIELDS, row)), cls=DjangoJSONEncoder))
+            stream.write('\n')
+            count += 1
+    return count
+
+
+# One UPDATE for every selected product, rounded to cents; carts holding them are recomputed and rebuild_facets
+# moves the products to their new price ranges
+def adjust_prices(products, percentage):
+    factor = (Decimal(100) + percentage) / Decimal(100)
+    with transaction.atomic():
+        count = products.update(price=Func(F('price') * factor, Value(2), function='ROUND', output_field=money_field()))
+        reconcile_order_values(open_orders_with(Product.objects.filter(pk__in=products.values('pk'))))
+        rebuild_facets()
+    bump_catalog_generation()
+    return count
+
+
+# Every batch is deleted through the collector, which cascades with one query per related table and batch;
+# placed orders lose the lines as with a single delete, sales rollups keep their copy of the name. The search,
+# autocomplete and facets are updated once for all products, files go once nothing refers to them.
+def delete_products(products):
+    rows = list(products.values_list('id', 'image', 'image_derivatives'))
+    ids = [product_id for product_id, image, derivatives in rows]
+    with transaction.atomic(), bulk_change():
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            batch = Product.objects.filter(pk__in=ids[start:start + DELETE_BATCH_SIZE])
+            carts = list(open_orders_with(batch).values_list('pk', flat=True))
+            batch.delete()
+            reconcile_order_values(Order.objects.filter(pk__in=carts))
+        index = get_index()
+        if index.transactional:
+            index.remove_many(ids)
+        else:
+            transaction.on_commit(lambda: index.remove_many(ids))
+        transaction.on_commit(lambda: autocomplete_index.remove_many(ids))
+        rebuild_facets()
+        transaction.on_commit(lambda: delete_unused_images(rows))
+    bump_catalog_generation()
+    return len(ids)
+
+
+def delete_unused_images(rows):
+    images = list({image for product_id, image, derivatives in rows if image})
+    used = set()
+    for start in range(0, len(images), DELETE_BATCH_SIZE):
+        batch = images[start:start + DELETE_BATCH_SIZE]
+        used.update(Product.objects.filter(image__in=batch).values_list('image', flat=True))
+    storage = Product._meta.get_field('image').storage
+    for product_id, image, derivatives in rows:
+        if not image or image in used:
+            continue
+        storage.delete(image)
+        for variants in derivatives.get('widths', {}).values():
+            for name in variants.values():
+                default_storage.delete(name)
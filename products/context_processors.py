@@ -0,0 +1,10 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cart import get_cart_summary
+
+
+def cart_summary(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated or user.is_staff:
+        return {}
+    return {'cart_summary': SimpleLazyObject(lambda: get_cart_summary(user))}
@@ -0,0 +1,124 @@
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, Value, When
+from django.utils.http import urlencode
+
+from .models import Product, ProductFacet
+
+FACET_PRODUCERS = 20
+REFRESH_BATCH_SIZE = 1000
+
+
+def price_buckets():
+    return [Decimal(bound) for bound in settings.CATALOG_PRICE_BUCKETS]
+
+
+def price_bucket(price):
+    return Product.make_price_bucket(price)
+
+
+def price_range(price_from):
+    buckets = price_buckets()
+    index = buckets.index(price_from)
+    return price_from, buckets[index + 1] if index + 1 < len(buckets) else None
+
+
+def parse_price_from(value):
+    try:
+        value = Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    buckets = price_buckets()
+    # the bound as configured, 25.00 and 25 name the same range
+    return buckets[buckets.index(value)] if value.is_finite() and value in buckets else None
+
+
+# Every filter is a range of one index in page order: product_producer_name_idx for a producer,
+# product_bucket_name_idx for a price range and product_producer_bucket_idx for both
+def filter_products(products, producer=None, price_from=None):
+    if producer:
+        products = products.filter(producer=producer)
+    if price_from is not None:
+        products = products.filter(price_bucket=price_from)
+    return products
+
+
+# Product.save sets the bucket, this catches up after UPDATEs of the price and a changed CATALOG_PRICE_BUCKETS.
+# One UPDATE, only rows whose bucket is out of date are written.
+def update_price_buckets():
+    buckets = price_buckets()
+    bucket = Case(*[When(price__gte=low, then=Value(low)) for low in reversed(buckets[1:])],
+                  default=Value(buckets[0]), output_field=Product._meta.get_field('price_bucket'))
+    return Product.objects.exclude(price_bucket=bucket).update(price_bucket=bucket)
+
+
+# Full recount with one grouped query, for bulk changes and a changed CATALOG_PRICE_BUCKETS
+def rebuild_facets():
+    with transaction.atomic():
+        update_price_buckets()
+        rows = Product.objects.values('producer', 'price_bucket').annotate(product_count=Count('id')).order_by()
+        facets = [ProductFacet(producer=row['producer'], price_from=row['price_bucket'],
+                               product_count=row['product_count']) for row in rows]
+        ProductFacet.objects.all().delete()
+        ProductFacet.objects.bulk_create(facets, batch_size=REFRESH_BATCH_SIZE)
+    return len(facets)
+
+
+# Recounts single (producer, price_from) pairs through product_producer_bucket_idx, for saves and deletes
+def refresh_facets(pairs):
+    for producer, price_from in set(pairs):
+        count = filter_products(Product.objects.all(), producer, price_from).count()
+        facets = ProductFacet.objects.filter(producer=producer, price_from=price_from)
+        if not count:
+            facets.delete()
+        elif not facets.update(product_count=count):
+            ProductFacet.objects.bulk_create([ProductFacet(producer=producer, price_from=price_from,
+                                                           product_count=count)], ignore_conflicts=True)
+
+
+# The summary table is small, it is read once per catalog generation and counted in Python
+def facet_table(generation):
+    key = 'catalog:facets:{}'.format(generation)
+    return cache.get_or_set(key, lambda: list(ProductFacet.objects.values_list('producer', 'price_from',
+                                                                               'product_count')),
+                            settings.CATALOG_CACHE_TIMEOUT)
+
+
+def known_producer(generation, producer):
+    return any(row_producer == producer for row_producer, row_price_from, count in facet_table(generation))
+
+
+def facet_query(producer, price_from):
+    params = {}
+    if producer:
+        params['producer'] = producer
+    if price_from is not None:
+        params['price'] = price_from
+    return urlencode(params)
+
+
+# Counts of every filter value under the other selected filter, and the count of the selected page set
+def catalog_facets(generation, producer=None, price_from=None):
+    producers, prices, total = {}, dict.fromkeys(price_buckets(), 0), 0
+    for row_producer, row_price_from, count in facet_table(generation):
+        if price_from is None or row_price_from == price_from:
+            producers[row_producer] = producers.get(row_producer, 0) + count
+        if not producer or row_producer == producer:
+            prices[row_price_from] = prices.get(row_price_from, 0) + count
+            if price_from is None or row_price_from == price_from:
+                total += count
+    top = sorted(producers.items(), key=lambda item: (-item[1], item[0]))[:FACET_PRODUCERS]
+    if producer and producer not in dict(top):
+        top.append((producer, producers.get(producer, 0)))
+    return {
+        'total': total,
+        'producers': [{'value': value, 'count': count, 'selected': value == producer,
+                       'query': facet_query(None if value == producer else value, price_from)}
+                      for value, count in sorted(top)],
+        'prices': [{'from': low, 'to': price_range(low)[1], 'count': prices[low], 'selected': low == price_from,
+                    'query': facet_query(producer, None if low == price_from else low)}
+                   for low in price_buckets() if prices[low] or low == price_from],
+    }
@@ -1,6 +1,8 @@
 from .models import Product
+from .order_export import FORMATS as EXPORT_FORMATS
 from django import forms
 from django.contrib.auth.models import User
+from django.urls import reverse_lazy
 
 
 class LoginForm(forms.Form):
@@ -19,7 +21,7 @@ class AddProduct(forms.ModelForm):
     name = forms.CharField(label='Nazwa')
     producer = forms.CharField(label='Producent')
     description = forms.CharField(widget=forms.Textarea(), label='Opis')
-    price = forms.FloatField(label='Cena')
+    price = forms.DecimalField(max_digits=10, decimal_places=2, min_value=0, label='Cena')
     image = forms.ImageField(widget=forms.FileInput(), label='Dodaj zdjęcie')
 
     class Meta:
@@ -27,5 +29,26 @@ class AddProduct(forms.ModelForm):
         fields = ('name', 'producer', 'description', 'price', 'image')
 
 
+class ImportProduct(AddProduct):
+    image = forms.CharField(max_length=100, label='Zdjęcie')
+    # an exported slug picks the product to update, rows without one are matched on producer and name
+    slug = forms.SlugField(max_length=255, required=False)
+
+
 class Search(forms.Form):
-    phrase = forms.CharField(label='Szukaj')
+    # js/search_autocomplete.js fills the datalist while typing
+    phrase = forms.CharField(label='Szukaj', widget=forms.TextInput(attrs={
+        'list': 'phrase-suggestions', 'autocomplete': 'off', 'data-autocomplete': reverse_lazy('api_autocomplete')}))
+
+
+class OrderExport(forms.Form):
+    since = forms.DateField(required=False)
+    until = forms.DateField(required=False)
+    format = forms.ChoiceField(choices=[(file_format, file_format) for file_format in EXPORT_FORMATS], required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        since, until = cleaned_data.get('since'), cleaned_data.get('until')
+        if since and until and since > until:
+            raise forms.ValidationError('since must not be after until')
+        return cleaned_data
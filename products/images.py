@@ -0,0 +1,64 @@
+import hashlib
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+FORMATS = (('jpeg', 'jpg'), ('webp', 'webp'))
+
+
+def derivative_name(digest, width, extension):
+    return os.path.join(settings.PRODUCT_IMAGE_DERIVATIVES_DIR, '{}_{}.{}'.format(digest, width, extension))
+
+
+# JPEG has no alpha channel, transparent areas are laid on white instead of turning black
+def flatten(image):
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        return Image.alpha_composite(Image.new('RGBA', image.size, 'white'), image).convert('RGB')
+    return image.convert('RGB')
+
+
+# Widths above the source would only be upscaled copies, they are replaced by one at the source's own width
+def derivative_widths(source_width):
+    return sorted({min(width, source_width) for width in settings.PRODUCT_IMAGE_WIDTHS})
+
+
+# Derivatives are named after the source content, so unchanged images are never rendered twice
+def render_derivatives(source_name):
+    with default_storage.open(source_name, 'rb') as source:
+        content = source.read()
+    digest = hashlib.sha256(content).hexdigest()[:16]
+    derivatives = {'source': source_name, 'widths': {}}
+    # opening reads the header only, pixels are decoded once a derivative has to be rendered
+    image = Image.open(BytesIO(content))
+    decoded = None
+    for width in derivative_widths(image.width):
+        variants = {}
+        for image_format, extension in FORMATS:
+            name = derivative_name(digest, width, extension)
+            if not default_storage.exists(name):
+                if decoded is None:
+                    image.load()
+                    decoded = flatten(image)
+                resized = decoded
+                if decoded.width > width:
+                    resized = decoded.resize((width, round(decoded.height * width / decoded.width)), Image.LANCZOS)
+                output = BytesIO()
+                resized.save(output, image_format.upper(), quality=settings.PRODUCT_IMAGE_QUALITY)
+                name = default_storage.save(name, ContentFile(output.getvalue()))
+            variants[image_format] = name
+        derivatives['widths'][str(width)] = variants
+    return derivatives
+
+
+def needs_derivatives(product):
+    return bool(product.image) and product.image_derivatives.get('source') != product.image.name
+
+
+def derivative_urls(derivatives, image_format):
+    return [(int(width), default_storage.url(variants[image_format]))
+            for width, variants in sorted(derivatives.get('widths', {}).items(), key=lambda item: int(item[0]))]
@@ -0,0 +1,83 @@
+import datetime
+import logging
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+handlers = {}
+
+
+def job_handler(name, on_failure=None):
+    def register(func):
+        handlers[name] = (func, on_failure)
+        return func
+    return register
+
+
+def enqueue(name, object_id):
+    return Job.objects.create(name=name, object_id=object_id)
+
+
+def enqueue_many(name, object_ids, batch_size=1000):
+    return Job.objects.bulk_create([Job(name=name, object_id=object_id) for object_id in object_ids],
+                                   batch_size=batch_size)
+
+
+def retry_delay(attempts):
+    delay = settings.JOB_RETRY_BACKOFF * 2 ** (attempts - 1)
+    return datetime.timedelta(seconds=min(delay, settings.JOB_RETRY_MAX_DELAY))
+
+
+def claim_next_job():
+    # A claimed job is leased until run_after, so jobs of a crashed worker are picked up again.
+    while True:
+        now = timezone.now()
+        job = Job.objects.filter(Q(status=Job.PENDING) | Q(status=Job.RUNNING), run_after__lte=now) \
+            .order_by('run_after', 'id').first()
+        if job is None:
+            return None
+        lease = now + datetime.timedelta(seconds=settings.JOB_LEASE_TIME)
+        claimed = Job.objects.filter(pk=job.pk, status=job.status, attempts=job.attempts) \
+            .update(status=Job.RUNNING, attempts=job.attempts + 1, run_after=lease)
+        if claimed:
+            job.status = Job.RUNNING
+            job.attempts += 1
+            job.run_after = lease
+            return job
+
+
+def run_job(job):
+    func, on_failure = handlers[job.name]
+    try:
+        func(job.object_id)
+    except Exception as error:
+        logger.exception('Job %s failed (attempt %s)', job, job.attempts)
+        job.last_error = repr(error)
+        if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+            job.status = Job.FAILED
+            if on_failure is not None:
+                on_failure(job.object_id)
+        else:
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + retry_delay(job.attempts)
+        job.save()
+        return False
+    job.status = Job.DONE
+    job.save()
+    return True
+
+
+def run_pending_jobs(limit=None):
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_next_job()
+        if job is None:
+            break
+        run_job(job)
+        processed += 1
+    return processed
@@ -0,0 +1,35 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.models import ClientAdress, Order
+from products.utils import render_invoice
+
+
+class Command(BaseCommand):
+    help = 'Measures invoice PDF render time on existing orders (nothing is stored).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=20, help='Number of ordered orders to render.')
+        parser.add_argument('--repeat', type=int, default=1, help='Renders per order.')
+
+    def handle(self, *args, **options):
+        orders = list(Order.objects.filter(ordered=True, user__clientadress__isnull=False)
+                      .select_related('user').order_by('-id')[:options['orders']])
+        if not orders:
+            raise CommandError('No ordered orders with a client address to render')
+        clients = {client.client_id: client for client in
+                   ClientAdress.objects.filter(client__in=[order.user_id for order in orders])}
+        timings = []
+        size = 0
+        for order in orders:
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                pdf = render_invoice('pdf/invoice.html', order, clients[order.user_id])
+                timings.append((time.perf_counter() - started) * 1000)
+                size += len(pdf)
+        timings.sort()
+        self.stdout.write('Rendered {} invoice(s), {:.0f} bytes on average'.format(len(timings), size / len(timings)))
+        self.stdout.write('mean {:.1f} ms, p50 {:.1f} ms, p95 {:.1f} ms, max {:.1f} ms'.format(
+            statistics.mean(timings), timings[len(timings) // 2], timings[int(len(timings) * 0.95)], timings[-1]))
@@ -0,0 +1,20 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from products.related import compute_related_products
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the "frequently bought together" lists from placed orders. Pair counts are kept in memory, '
+            'limit the history with --since on very large shops.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=datetime.date.fromisoformat, help='First order date (YYYY-MM-DD).')
+        parser.add_argument('--limit', type=int, default=None, help='Products per list, RELATED_PRODUCTS by default.')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        stats = compute_related_products(options['since'], options['limit'], options['chunk_size'])
+        self.stdout.write('Read {} order(s) ({:.0f}/s), stored {} related product(s) for {} product(s)'.format(
+            stats.orders, stats.orders_per_second, stats.rows, stats.products))
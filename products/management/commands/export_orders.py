@@ -0,0 +1,42 @@
+import datetime
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.order_export import FORMATS, export_orders
+
+
+class Command(BaseCommand):
+    help = 'Streams placed orders with their lines and buyer addresses to a CSV or XLSX file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, '-' writes to standard output.")
+        parser.add_argument('--format', choices=('csv', 'xlsx'), default=None, help='Defaults to the file extension.')
+        parser.add_argument('--since', type=datetime.date.fromisoformat, help='First order date (YYYY-MM-DD).')
+        parser.add_argument('--until', type=datetime.date.fromisoformat, help='Last order date (YYYY-MM-DD).')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.')
+        if file_format == 'xlsx' and file_format not in FORMATS:
+            raise CommandError('XLSX export needs XlsxWriter: pip install xlsxwriter')
+        if file_format not in FORMATS:
+            raise CommandError('Unknown format, use --format {}'.format('/'.join(FORMATS)))
+        started = time.monotonic()
+        if path == '-':
+            stream = sys.stdout if file_format == 'csv' else sys.stdout.buffer
+        elif file_format == 'csv':
+            stream = open(path, 'w', newline='', encoding='utf-8')
+        else:
+            stream = open(path, 'wb')
+        try:
+            count = export_orders(stream, file_format, options['since'], options['until'],
+                                  chunk_size=options['chunk_size'])
+        finally:
+            if stream not in (sys.stdout, sys.stdout.buffer):
+                stream.close()
+        elapsed = max(time.monotonic() - started, 1e-9)
+        self.stderr.write('Exported {} order line(s) ({:.0f} rows/s)'.format(count, count / elapsed))
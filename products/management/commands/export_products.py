@@ -0,0 +1,31 @@
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.catalog_io import FORMATS, export_products
+
+
+class Command(BaseCommand):
+    help = 'Streams the product catalog to a CSV or JSON Lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, '-' writes to standard output.")
+        parser.add_argument('--format', choices=FORMATS, default=None, help='Defaults to the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.')
+        if file_format not in FORMATS:
+            raise CommandError('Unknown format, use --format {}'.format('/'.join(FORMATS)))
+        started = time.monotonic()
+        stream = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        try:
+            count = export_products(stream, file_format, chunk_size=options['chunk_size'])
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        elapsed = max(time.monotonic() - started, 1e-9)
+        self.stderr.write('Exported {} product(s) ({:.0f} rows/s)'.format(count, count / elapsed))
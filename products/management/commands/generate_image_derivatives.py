@@ -0,0 +1,46 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from products.catalog_cache import bump_catalog_generation
+from products.images import needs_derivatives, render_derivatives
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Generates thumbnails and WebP variants for product images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Number of worker processes.')
+        parser.add_argument('--force', action='store_true', help='Regenerate derivatives of every product.')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').only('id', 'image', 'image_derivatives')
+        sources = {}
+        for product in products.iterator():
+            if options['force'] or needs_derivatives(product):
+                sources.setdefault(product.image.name, []).append(product.id)
+        if not sources:
+            self.stdout.write('All product images are up to date')
+            return
+        started = time.monotonic()
+        done = 0
+        # worker processes open their own connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+            futures = {executor.submit(render_derivatives, name): name for name in sources}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    derivatives = future.result()
+                except Exception as error:
+                    self.stderr.write('Failed to process {}: {!r}'.format(name, error))
+                    continue
+                done += Product.objects.filter(pk__in=sources[name], image=name) \
+                    .update(image_derivatives=derivatives)
+        bump_catalog_generation()
+        elapsed = time.monotonic() - started
+        self.stdout.write('Processed {} image(s) for {} product(s) in {:.1f}s'.format(len(sources), done, elapsed))
@@ -0,0 +1,31 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.catalog_io import FORMATS, import_products, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Imports (upserts by slug, or by producer and name) products from a CSV or JSON Lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, '-' reads standard input.")
+        parser.add_argument('--format', choices=FORMATS, default=None, help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.')
+        if file_format not in FORMATS:
+            raise CommandError('Unknown format, use --format {}'.format('/'.join(FORMATS)))
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            stats = import_products(read_rows(stream, file_format), batch_size=options['batch_size'])
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        for line, errors in stats.errors:
+            self.stderr.write('Row {}: {}'.format(line, errors))
+        self.stdout.write('{} row(s): {} created, {} updated, {} invalid ({:.0f} rows/s)'.format(
+            stats.rows, stats.created, stats.updated, len(stats.errors), stats.rows_per_second))
@@ -0,0 +1,34 @@
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired sessions from the database in batches, so writers are never locked out for long.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to wait between batches.')
+
+    def handle(self, *args, **options):
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        if not hasattr(store, 'get_model_class'):
+            self.stdout.write('{} keeps no sessions in the database'.format(settings.SESSION_ENGINE))
+            return
+        # sessions expiring while the command runs are left for the next run
+        expired = store.get_model_class().objects.filter(expire_date__lt=timezone.now())
+        deleted = 0
+        while True:
+            with transaction.atomic():
+                keys = list(expired.values_list('pk', flat=True)[:options['batch_size']])
+                if keys:
+                    expired.filter(pk__in=keys).delete()
+            deleted += len(keys)
+            if len(keys) < options['batch_size']:
+                break
+            time.sleep(options['pause'])
+        self.stdout.write('Deleted {} expired session(s)'.format(deleted))
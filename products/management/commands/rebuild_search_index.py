@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from products.autocomplete import autocomplete_index
+from products.catalog_cache import bump_catalog_generation
+from products.models import Product
+from products.search import get_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product search index from the catalog.'
+
+    def handle(self, *args, **options):
+        index = get_index()
+        index.rebuild()
+        autocomplete_index.rebuild()
+        # servers rebuild their autocomplete index once they see the new generation
+        bump_catalog_generation()
+        self.stdout.write('Indexed {} product(s) with {}'.format(Product.objects.count(), type(index).__name__))
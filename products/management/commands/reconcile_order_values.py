@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from products.cart import reconcile_order_values
+from products.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Recomputes order values from their lines and fixes the ones that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--placed', action='store_true',
+                            help='Also recompute placed orders, at the prices their lines were charged.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted orders.')
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all() if options['placed'] else Order.objects.filter(ordered=False)
+        stale = reconcile_order_values(orders, dry_run=options['dry_run'])
+        for pk in stale[:20]:
+            self.stdout.write('Order #{} drifted'.format(pk))
+        self.stdout.write('{} of {} order(s) {}'.format(
+            len(stale), orders.count(), 'drifted' if options['dry_run'] else 'recomputed'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.catalog_cache import bump_catalog_generation
+from products.facets import rebuild_facets
+
+
+class Command(BaseCommand):
+    help = 'Moves products to their price ranges and recounts the catalog filter facets, needed after ' \
+           'CATALOG_PRICE_BUCKETS changed.'
+
+    def handle(self, *args, **options):
+        count = rebuild_facets()
+        bump_catalog_generation()
+        self.stdout.write('Counted {} facet row(s)'.format(count))
@@ -0,0 +1,83 @@
+import datetime
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from products.models import Order
+from products.utils import html_to_pdf, render_invoice_html, store_invoice
+
+
+class Command(BaseCommand):
+    help = 'Re-renders invoices of ordered orders in a date range across a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=datetime.date.fromisoformat, help='First order date (YYYY-MM-DD).')
+        parser.add_argument('--until', type=datetime.date.fromisoformat, help='Last order date (YYYY-MM-DD).')
+        parser.add_argument('--workers', type=int, default=None, help='Number of worker processes.')
+        parser.add_argument('--chunk-size', type=int, default=100, help='Orders rendered between checkpoints.')
+        parser.add_argument('--checkpoint', default=os.path.join(settings.INVOICES_DIR, 'render_invoices.checkpoint'),
+                            help='File storing the date range and the id of the last order rendered.')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue after the order in the checkpoint, with the same --since and --until.')
+
+    # The id only marks progress within the range it was written for, another range would skip its orders
+    def read_checkpoint(self, path, filters):
+        try:
+            with open(path) as checkpoint:
+                state = json.load(checkpoint)
+        except FileNotFoundError:
+            return 0
+        except ValueError:
+            state = None
+        if not isinstance(state, dict) or not isinstance(state.get('last_id'), int):
+            raise CommandError('{} is no render_invoices checkpoint, run without --resume'.format(path))
+        if state.get('filters') != filters:
+            raise CommandError('{} was written for {}, run with the same --since and --until or without '
+                               '--resume'.format(path, state.get('filters')))
+        return state['last_id']
+
+    def write_checkpoint(self, path, filters, order_id):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as checkpoint:
+            json.dump({'filters': filters, 'last_id': order_id}, checkpoint)
+
+    def handle(self, *args, **options):
+        orders = Order.objects.filter(ordered=True, user__clientadress__isnull=False) \
+            .select_related('user__clientadress').prefetch_related('products__product').order_by('id')
+        if options['since']:
+            orders = orders.filter(ordered_time__date__gte=options['since'])
+        if options['until']:
+            orders = orders.filter(ordered_time__date__lte=options['until'])
+        filters = {'since': options['since'] and options['since'].isoformat(),
+                   'until': options['until'] and options['until'].isoformat()}
+        last_id = self.read_checkpoint(options['checkpoint'], filters) if options['resume'] else 0
+        total = orders.filter(id__gt=last_id).count()
+        self.stdout.write('{} invoice(s) to render'.format(total))
+        rendered = 0
+        pdf_bytes = 0
+        started = time.monotonic()
+        # worker processes open their own connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+            while True:
+                chunk = list(orders.filter(id__gt=last_id)[:options['chunk_size']])
+                if not chunk:
+                    break
+                htmls = [render_invoice_html('pdf/invoice.html', order, order.user.clientadress) for order in chunk]
+                for order, pdf in zip(chunk, executor.map(html_to_pdf, htmls)):
+                    store_invoice(order, pdf)
+                    pdf_bytes += len(pdf)
+                rendered += len(chunk)
+                last_id = chunk[-1].id
+                self.write_checkpoint(options['checkpoint'], filters, last_id)
+                elapsed = time.monotonic() - started
+                self.stdout.write('{}/{} rendered, {:.1f} invoices/s'.format(rendered, total, rendered / elapsed))
+        elapsed = max(time.monotonic() - started, 1e-9)
+        self.stdout.write('Rendered {} invoice(s) in {:.1f}s: {:.1f} invoices/s, {:.0f} KB/s'.format(
+            rendered, elapsed, rendered / elapsed, pdf_bytes / 1024 / elapsed))
@@ -0,0 +1,29 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.models import DailySales
+from products.reports import rollup_sales
+
+
+class Command(BaseCommand):
+    help = 'Rolls placed orders up into daily sales per product, from the last rolled up day on.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Recompute from this day (YYYY-MM-DD) on.')
+        parser.add_argument('--rebuild', action='store_true', help='Drop all rollups and recompute every day.')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = datetime.date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError('--since must be a date in YYYY-MM-DD format')
+        if options['rebuild']:
+            DailySales.objects.all().delete()
+        since, count = rollup_sales(since)
+        if since is None:
+            self.stdout.write('No placed orders to roll up')
+        else:
+            self.stdout.write('Rolled up {} row(s) from {} on'.format(count, since))
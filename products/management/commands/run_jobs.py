@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.jobs import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = 'Processes queued background jobs (invoices, emails).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process available jobs and exit.')
+        parser.add_argument('--sleep', type=float, default=5, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--limit', type=int, default=None, help='Maximum number of jobs per batch.')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = run_pending_jobs(limit=options['limit'])
+            if processed:
+                self.stdout.write('Processed {} job(s)'.format(processed))
+            if options['once']:
+                break
+            if not processed:
+                time.sleep(options['sleep'])
@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE products_product_fts USING fts5('
+            'name, producer, description, tokenize="unicode61 remove_diacritics 2")'
+        )
+    except OperationalError:
+        # SQLite built without FTS5, search falls back to the in-memory index
+        return
+    schema_editor.execute(
+        'INSERT INTO products_product_fts (rowid, name, producer, description) '
+        'SELECT id, name, producer, description FROM products_product'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS products_product_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_job_queue'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.5 on 2026-10-18 17:00
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F, Func, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def round_to_cents(expression):
+    return Func(expression, Value(2), function='ROUND')
+
+
+# Float prices and accumulated cart values are rounded to cents, open carts are recomputed from their lines
+def round_money(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    Order = apps.get_model('products', 'Order')
+    OrderProduct = apps.get_model('products', 'OrderProduct')
+    money = models.DecimalField(max_digits=12, decimal_places=2)
+    Product.objects.update(price=round_to_cents(F('price')))
+    Order.objects.filter(ordered=True).update(value=round_to_cents(F('value')))
+    totals = OrderProduct.objects.filter(order=OuterRef('pk')).values('order') \
+        .annotate(total=Sum(F('quantity') * F('product__price'), output_field=money)).values('total')
+    Order.objects.filter(ordered=False).update(
+        value=Coalesce(Subquery(totals, output_field=money), Value(Decimal('0.00')), output_field=money))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_order_invoice_storage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='value',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='price',
+            field=models.DecimalField(decimal_places=2, max_digits=10),
+        ),
+        migrations.RunPython(round_money, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.2.5 on 2026-10-18 17:02
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+# Products sharing a slug get numbered suffixes, the oldest one keeps the plain slug
+def deduplicate_slugs(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    duplicated = Product.objects.values('slug').annotate(count=Count('id')).filter(count__gt=1)
+    taken = set(Product.objects.values_list('slug', flat=True))
+    for slug in duplicated.values_list('slug', flat=True):
+        for product in Product.objects.filter(slug=slug).order_by('id')[1:]:
+            suffix = 2
+            while '{}-{}'.format(slug, suffix) in taken:
+                suffix += 1
+            product.slug = '{}-{}'.format(slug, suffix)
+            taken.add(product.slug)
+            product.save(update_fields=['slug'])
+
+
+# A user with several open orders keeps the oldest one, with the lines of all of them
+def merge_open_orders(apps, schema_editor):
+    Order = apps.get_model('products', 'Order')
+    OrderLines = Order.products.through
+    duplicated = Order.objects.filter(ordered=False).values('user').annotate(count=Count('id'), keep=Min('id')) \
+        .filter(count__gt=1)
+    for row in duplicated:
+        orders = Order.objects.filter(user=row['user'], ordered=False)
+        value = orders.aggregate(total=Sum('value'))['total']
+        others = orders.exclude(pk=row['keep'])
+        OrderLines.objects.filter(order_id__in=others.values('pk')).update(order_id=row['keep'])
+        others.delete()
+        Order.objects.filter(pk=row['keep']).update(value=value)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_decimal_money'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_slugs, migrations.RunPython.noop),
+        migrations.RunPython(merge_open_orders, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='slug',
+            field=models.SlugField(max_length=255, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('ordered', True)), fields=['user', 'ordered_time'], name='order_user_placed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderproduct',
+            index=models.Index(fields=['user', 'product', 'ordered'], name='orderproduct_user_product_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('ordered', False)), fields=('user',), name='one_open_order_per_user'),
+        ),
+    ]
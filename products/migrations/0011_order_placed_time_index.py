@@ -0,0 +1,17 @@
+# Generated by Django 3.2.5 on 2026-10-18 17:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_daily_sales'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('ordered', True)), fields=['ordered_time'], name='order_placed_time_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.5 on 2026-10-18 17:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_order_placed_time_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='clientadress',
+            index=models.Index(fields=['surname'], name='clientadress_surname_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientadress',
+            index=models.Index(fields=['tax_number'], name='clientadress_tax_number_idx'),
+        ),
+    ]
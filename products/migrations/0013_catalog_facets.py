@@ -0,0 +1,48 @@
+# Generated by Django 3.2.5 on 2026-10-18 17:20
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def count_facets(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductFacet = apps.get_model('products', 'ProductFacet')
+    buckets = [Decimal(bound) for bound in settings.CATALOG_PRICE_BUCKETS]
+    bucket = models.Case(*[models.When(price__gte=buckets[index], then=models.Value(index))
+                           for index in range(len(buckets) - 1, 0, -1)],
+                         default=models.Value(0), output_field=models.IntegerField())
+    rows = Product.objects.annotate(bucket=bucket).values('producer', 'bucket') \
+        .annotate(product_count=models.Count('id')).order_by()
+    ProductFacet.objects.bulk_create([ProductFacet(producer=row['producer'], price_from=buckets[row['bucket']],
+                                                   product_count=row['product_count']) for row in rows],
+                                     batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('producer', models.CharField(max_length=255)),
+                ('price_from', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('product_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['producer', 'name', 'id'], name='product_producer_name_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='productfacet',
+            constraint=models.UniqueConstraint(fields=('producer', 'price_from'), name='product_facet_producer_price'),
+        ),
+        migrations.RunPython(count_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.5 on 2026-10-18 17:47
+
+from django.db import migrations, models
+
+
+# The prices charged before this migration were not kept, the current ones are the closest record of them
+def snapshot_placed_prices(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    OrderProduct = apps.get_model('products', 'OrderProduct')
+    price = Product.objects.filter(pk=models.OuterRef('product_id')).values('price')[:1]
+    OrderProduct.objects.filter(ordered=True, unit_price__isnull=True).update(unit_price=models.Subquery(price))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0014_related_products'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderproduct',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(snapshot_placed_prices, migrations.RunPython.noop),
+    ]
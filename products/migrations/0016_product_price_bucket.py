@@ -0,0 +1,40 @@
+# Generated by Django 3.2.5 on 2026-10-18 17:59
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_price_buckets(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    buckets = [Decimal(bound) for bound in settings.CATALOG_PRICE_BUCKETS]
+    for index, low in enumerate(buckets):
+        products = Product.objects.all() if index == 0 else Product.objects.filter(price__gte=low)
+        if index + 1 < len(buckets):
+            products = products.filter(price__lt=buckets[index + 1])
+        products.update(price_bucket=low)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0015_order_line_unit_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='price_bucket',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price_bucket', 'name', 'id'], name='product_bucket_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['producer', 'price_bucket', 'name', 'id'], name='product_producer_bucket_idx'),
+        ),
+        migrations.RunPython(fill_price_buckets, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,11 @@
+from bisect import bisect_right
+from decimal import Decimal
+
+from django.conf import settings
 from django.db import models
+from django.db.models import Q
 
+from django.utils import timezone
 from django.utils.text import slugify
 from django.contrib.auth.models import User
 
@@ -22,27 +28,86 @@ class ClientAdress(models.Model):
     class Meta:
         verbose_name = 'Client address'
         verbose_name_plural = 'Clients address'
+        indexes = [models.Index(fields=['surname'], name='clientadress_surname_idx'),
+                   models.Index(fields=['tax_number'], name='clientadress_tax_number_idx')]
 
 
 class Product(models.Model):
     name = models.CharField(null=False, max_length=255)
     producer = models.CharField(null=False, max_length=255)
     description = models.TextField()
-    price = models.FloatField(max_length=3, null=False)
+    price = models.DecimalField(max_digits=10, decimal_places=2, null=False)
     image = models.ImageField(upload_to='media/images', null=False)
-    slug = models.SlugField()
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    slug = models.SlugField(max_length=255, unique=True)
+    # lower bound of the CATALOG_PRICE_BUCKETS range of the price, the catalog's price filter is a range of its indexes
+    price_bucket = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
 
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def make_slug(producer, name):
+        name_and_producer = '{} {}'.format(producer, name)
+        # room is left for the suffix of a colliding slug
+        return slugify(name_and_producer)[:240].strip('-') or 'product'
+
+    @staticmethod
+    def make_price_bucket(price):
+        buckets = [Decimal(bound) for bound in settings.CATALOG_PRICE_BUCKETS]
+        # the first range also takes anything below it
+        return buckets[max(bisect_right(buckets, Decimal(price)) - 1, 0)]
+
+    # reserved holds slugs given out but not saved yet, by a bulk import
+    def unique_slug(self, base, reserved=()):
+        taken = set(Product.objects.filter(slug__startswith=base).exclude(pk=self.pk).values_list('slug', flat=True))
+        taken.update(reserved)
+        slug, suffix = base, 1
+        while slug in taken:
+            suffix += 1
+            slug = '{}-{}'.format(base, suffix)
+        return slug
+
     def save(self, *args, **kwargs):
-        name_and_producer = '{} {}'.format(self.producer, self.name)
-        self.slug = slugify(name_and_producer)
+        # the stored row is read once, products.signals takes the facet the product leaves from it too
+        self._stored = Product.objects.filter(pk=self.pk).values('name', 'producer', 'price', 'price_bucket').first() \
+            if self.pk is not None else None
+        stored = self._stored
+        # an unchanged name and producer keep the slug, so links to the product stay valid
+        derived = set()
+        if not self.slug or stored is None or (stored['name'], stored['producer']) != (self.name, self.producer):
+            self.slug = self.unique_slug(self.make_slug(self.producer, self.name))
+            derived.add('slug')
+        self.price_bucket = self.make_price_bucket(self.price)
+        update_fields = kwargs.get('update_fields')
+        # an empty update_fields saves nothing, the derived fields neither
+        if update_fields:
+            if 'price' in update_fields:
+                derived.add('price_bucket')
+            kwargs['update_fields'] = {*update_fields, *derived}
         super(Product, self).save(*args, **kwargs)
 
     class Meta:
         verbose_name = 'Product'
         verbose_name_plural = 'Products'
+        indexes = [models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+                   models.Index(fields=['producer', 'name', 'id'], name='product_producer_name_idx'),
+                   models.Index(fields=['price_bucket', 'name', 'id'], name='product_bucket_name_idx'),
+                   models.Index(fields=['producer', 'price_bucket', 'name', 'id'], name='product_producer_bucket_idx')]
+
+
+# Product counts per producer and price range, kept current by products.facets so the catalog filters
+# are listed with their counts without grouping the whole product table
+class ProductFacet(models.Model):
+    producer = models.CharField(max_length=255)
+    price_from = models.DecimalField(max_digits=10, decimal_places=2)
+    product_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return '{} from {}'.format(self.producer, self.price_from)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['producer', 'price_from'], name='product_facet_producer_price')]
 
 
 class OrderProduct(models.Model):
@@ -50,18 +115,102 @@ class OrderProduct(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1)
     ordered = models.BooleanField(default=False)
+    # the price the line was charged at, set at checkout; cart lines follow the product's current price
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
 
     def __str__(self):
         return self.product.name
 
+    class Meta:
+        indexes = [models.Index(fields=['user', 'product', 'ordered'], name='orderproduct_user_product_idx')]
+
 
 class Order(models.Model):
+    INVOICE_PENDING = 'pending'
+    INVOICE_SENT = 'sent'
+    INVOICE_FAILED = 'failed'
+    INVOICE_STATUS_CHOICES = (
+        (INVOICE_PENDING, 'Pending'),
+        (INVOICE_SENT, 'Sent'),
+        (INVOICE_FAILED, 'Failed'),
+    )
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     products = models.ManyToManyField(OrderProduct, null=True)
     ordered = models.BooleanField(default=False)
     ordered_time = models.DateTimeField(blank=True, null=True)
     payment_time = models.DateTimeField(blank=True, null=True)
-    value = models.FloatField(default=0)
+    value = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    invoice_status = models.CharField(max_length=10, choices=INVOICE_STATUS_CHOICES, blank=True)
+    invoice_file = models.CharField(max_length=255, blank=True)
+    invoice_size = models.PositiveIntegerField(blank=True, null=True)
+    invoice_hash = models.CharField(max_length=64, blank=True)
 
     def __str__(self):
         return self.user.username
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'ordered_time'], condition=Q(ordered=True),
+                                name='order_user_placed_idx'),
+                   models.Index(fields=['ordered_time'], condition=Q(ordered=True), name='order_placed_time_idx')]
+        constraints = [models.UniqueConstraint(fields=['user'], condition=Q(ordered=False),
+                                               name='one_open_order_per_user')]
+
+
+class Job(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=100)
+    object_id = models.BigIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '{} #{}'.format(self.name, self.object_id)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+
+# One row per day and product, written by the rollup_sales command; names are kept for deleted products
+class DailySales(models.Model):
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True)
+    product_name = models.CharField(max_length=255)
+    producer = models.CharField(max_length=255)
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return '{} {}'.format(self.day, self.product_name)
+
+    class Meta:
+        verbose_name = 'Daily sales'
+        verbose_name_plural = 'Daily sales'
+        constraints = [models.UniqueConstraint(fields=['day', 'product'], name='daily_sales_day_product')]
+
+
+# The products most often bought in the same orders as `product`, best first; written by compute_related_products
+class RelatedProduct(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='bought_with')
+    rank = models.PositiveSmallIntegerField()
+    orders = models.PositiveIntegerField()
+
+    def __str__(self):
+        return '{} -> {}'.format(self.product_id, self.related_id)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['product', 'rank'], name='related_product_rank')]
@@ -0,0 +1,113 @@
+import csv
+import datetime
+
+from django.utils import timezone
+
+from .models import OrderProduct
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+# Header -> OrderProduct lookup, one row per order line
+COLUMNS = (
+    ('order', 'order__id'),
+    ('ordered_time', 'order__ordered_time'),
+    ('payment_time', 'order__payment_time'),
+    ('order_value', 'order__value'),
+    ('invoice_status', 'order__invoice_status'),
+    ('username', 'order__user__username'),
+    ('email', 'order__user__email'),
+    ('company', 'order__user__clientadress__company'),
+    ('tax_number', 'order__user__clientadress__tax_number'),
+    ('name', 'order__user__clientadress__name'),
+    ('surname', 'order__user__clientadress__surname'),
+    ('street', 'order__user__clientadress__street'),
+    ('street_number', 'order__user__clientadress__street_number'),
+    ('apartment_number', 'order__user__clientadress__apartment_number'),
+    ('zip_code', 'order__user__clientadress__zip_code'),
+    ('city', 'order__user__clientadress__city'),
+    ('product', 'product__name'),
+    ('producer', 'product__producer'),
+    ('quantity', 'quantity'),
+    ('unit_price', 'unit_price'),
+)
+HEADERS = tuple(header for header, lookup in COLUMNS) + ('line_total',)
+FORMATS = ('csv', 'xlsx') if xlsxwriter is not None else ('csv',)
+CSV_CHUNK_SIZE = 64 * 1024
+
+
+def start_of(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def local_time(value):
+    return timezone.localtime(value).replace(microsecond=0, tzinfo=None) if value else None
+
+
+# One joined query over the placed order lines, `until` is inclusive
+def order_lines(since=None, until=None):
+    # the filters are multi-valued lookups, in separate filter() calls each would join the orders again
+    filters = {'order__ordered': True}
+    if since:
+        filters['order__ordered_time__gte'] = start_of(since)
+    if until:
+        filters['order__ordered_time__lt'] = start_of(until + datetime.timedelta(days=1))
+    return OrderProduct.objects.filter(**filters).order_by('order__ordered_time', 'order__id', 'id') \
+        .values_list(*(lookup for header, lookup in COLUMNS))
+
+
+def order_rows(since=None, until=None, chunk_size=2000):
+    for row in order_lines(since, until).iterator(chunk_size=chunk_size):
+        row = list(row)
+        row[1], row[2] = local_time(row[1]), local_time(row[2])
+        row.append(row[-2] * row[-1])
+        yield row
+
+
+class Echo:
+
+    def write(self, value):
+        return value
+
+
+# Rows are joined into blocks, so a streamed response does not send one tiny chunk per line
+def csv_chunks(rows):
+    writer = csv.writer(Echo())
+    block, size = [writer.writerow(HEADERS)], 0
+    for row in rows:
+        line = writer.writerow(row)
+        block.append(line)
+        size += len(line)
+        if size >= CSV_CHUNK_SIZE:
+            yield ''.join(block)
+            block, size = [], 0
+    yield ''.join(block)
+
+
+# A zip file cannot be sent before it is complete; constant_memory flushes every row to a temporary file
+def write_xlsx(file, rows):
+    workbook = xlsxwriter.Workbook(file, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+    worksheet = workbook.add_worksheet('Orders')
+    worksheet.write_row(0, 0, HEADERS)
+    for index, row in enumerate(rows, start=1):
+        worksheet.write_row(index, 0, row)
+    workbook.close()
+
+
+def export_orders(file, file_format, since=None, until=None, chunk_size=2000):
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for count, row in enumerate(rows, start=1):
+            yield row
+
+    rows = counted(order_rows(since, until, chunk_size))
+    if file_format == 'csv':
+        for chunk in csv_chunks(rows):
+            file.write(chunk)
+    else:
+        write_xlsx(file, rows)
+    return count
@@ -0,0 +1,187 @@
+import base64
+import binascii
+import json
+from functools import reduce
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(direction, values):
+    data = json.dumps([direction, values], cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def decode_cursor(cursor):
+    try:
+        direction, values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, TypeError, ValueError):
+        return None, None
+    if direction not in (NEXT, PREVIOUS) or not isinstance(values, list):
+        return None, None
+    return direction, values
+
+
+class CursorPage:
+
+    def __init__(self, object_list, cursor, has_next, has_previous, paginator):
+        self.object_list = object_list
+        self.cursor = cursor or ''
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return encode_cursor(NEXT, self.paginator.position(self.object_list[-1]))
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return encode_cursor(PREVIOUS, self.paginator.position(self.object_list[0]))
+
+    @property
+    def count(self):
+        return self.paginator.count
+
+
+# Seeks on an ascending unique ordering instead of OFFSET, so every page costs one indexed range scan
+class CursorPaginator:
+
+    def __init__(self, object_list, per_page, ordering=('name', 'id'), count_cache_key=None, count_timeout=300,
+                 count=None):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.ordering = ordering
+        self.count_cache_key = count_cache_key
+        self.count_timeout = count_timeout
+        self.known_count = count
+
+    def position(self, obj):
+        if isinstance(obj, dict):
+            return [obj[field] for field in self.ordering]
+        return [getattr(obj, field) for field in self.ordering]
+
+    def _seek(self, values, lookup):
+        conditions = []
+        for index, field in enumerate(self.ordering):
+            condition = {'{}__{}'.format(field, lookup): values[index]}
+            condition.update(zip(self.ordering[:index], values[:index]))
+            conditions.append(Q(**condition))
+        return reduce(lambda left, right: left | right, conditions)
+
+    def _field(self, name):
+        annotation = self.object_list.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return self.object_list.model._meta.get_field(name)
+
+    # A cursor comes from the client, its values are checked against the ordering's fields before any query
+    def parse_cursor(self, cursor):
+        direction, values = decode_cursor(cursor)
+        if values is None or len(values) != len(self.ordering):
+            raise InvalidCursor(cursor)
+        try:
+            values = [self._field(field).to_python(value) for field, value in zip(self.ordering, values)]
+        except (TypeError, ValueError, ValidationError):
+            raise InvalidCursor(cursor)
+        if None in values:
+            raise InvalidCursor(cursor)
+        return direction, values
+
+    # A forged or outdated cursor starts over from the first page, or raises InvalidCursor when strict
+    def get_page(self, cursor=None, strict=False):
+        try:
+            direction, values = self.parse_cursor(cursor) if cursor else (None, None)
+        except InvalidCursor:
+            if strict:
+                raise
+            direction = values = None
+        if direction == PREVIOUS:
+            ordering = ['-{}'.format(field) for field in self.ordering]
+            rows = list(self.object_list.filter(self._seek(values, 'lt')).order_by(*ordering)[:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            return CursorPage(rows[:self.per_page][::-1], cursor, True, has_previous, self)
+        queryset = self.object_list.order_by(*self.ordering)
+        if direction == NEXT:
+            queryset = queryset.filter(self._seek(values, 'gt'))
+        rows = list(queryset[:self.per_page + 1])
+        return CursorPage(rows[:self.per_page], cursor, len(rows) > self.per_page, direction == NEXT, self)
+
+    @property
+    def count(self):
+        if self.known_count is not None:
+            return self.known_count
+        if self.count_cache_key is None:
+            return self.object_list.count()
+        return cache.get_or_set(self.count_cache_key, self.object_list.count, self.count_timeout)
+
+
+# The planner's idea of the table size, None when the database has no statistics for it
+def estimated_row_count(model, using='default'):
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute('SELECT table_rows FROM information_schema.tables '
+                           'WHERE table_schema = DATABASE() AND table_name = %s', [table])
+        elif connection.vendor == 'sqlite':
+            # sqlite_stat1 only exists once ANALYZE ran, the first number of a row is the table size
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+        else:
+            return None
+        row = cursor.fetchone()
+    # PostgreSQL reports -1 for tables that were never analyzed
+    return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+
+# Unfiltered change lists of big tables show the estimate instead of running COUNT(*) over the whole table
+class EstimatedCountPaginator(Paginator):
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= settings.ADMIN_COUNT_ESTIMATE_THRESHOLD:
+                return estimate
+        return super().count
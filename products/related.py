@@ -0,0 +1,79 @@
+import heapq
+import time
+from collections import Counter, defaultdict
+from itertools import groupby, permutations
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import transaction
+
+from .catalog_cache import bump_catalog_generation
+from .models import Order, Product, RelatedProduct
+from .order_export import start_of
+
+# Bigger orders are wholesale, every pair in them would count once and drown the rest
+MAX_BASKET_SIZE = 50
+
+
+class RelatedStats:
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.orders = 0
+        self.products = 0
+        self.rows = 0
+
+    @property
+    def orders_per_second(self):
+        return self.orders / max(time.monotonic() - self.started, 1e-9)
+
+
+# The products of every placed order, read in order id order through the M2M table without loading it whole
+def order_baskets(since=None, chunk_size=5000):
+    filters = {'order__ordered': True}
+    if since:
+        filters['order__ordered_time__gte'] = start_of(since)
+    lines = Order.products.through.objects.filter(**filters).order_by('order_id') \
+        .values_list('order_id', 'orderproduct__product_id').iterator(chunk_size=chunk_size)
+    for order_id, rows in groupby(lines, key=itemgetter(0)):
+        yield {line[1] for line in rows}
+
+
+def co_occurrences(baskets, stats):
+    counts = defaultdict(Counter)
+    for basket in baskets:
+        stats.orders += 1
+        if 1 < len(basket) <= MAX_BASKET_SIZE:
+            for product_id, other_id in permutations(basket, 2):
+                counts[product_id][other_id] += 1
+    return counts
+
+
+# Replaces every product's top list, ties go to the older product so reruns give the same ranks
+def compute_related_products(since=None, limit=None, chunk_size=5000):
+    limit = limit or settings.RELATED_PRODUCTS
+    stats = RelatedStats()
+    counts = co_occurrences(order_baskets(since, chunk_size), stats)
+    rows = []
+    for product_id, others in counts.items():
+        top = heapq.nsmallest(limit, others.items(), key=lambda item: (-item[1], item[0]))
+        rows.extend(RelatedProduct(product_id=product_id, related_id=related_id, rank=rank, orders=orders)
+                    for rank, (related_id, orders) in enumerate(top))
+    with transaction.atomic():
+        RelatedProduct.objects.all().delete()
+        RelatedProduct.objects.bulk_create(rows, batch_size=1000)
+    bump_catalog_generation()
+    stats.products, stats.rows = len(counts), len(rows)
+    return stats
+
+
+# One join read through the (product, rank) constraint's index
+def bought_together(product, limit=None):
+    return Product.objects.filter(bought_with__product=product) \
+        .order_by('bought_with__rank')[:limit or settings.RELATED_PRODUCTS]
+
+
+# A range of product_producer_name_idx
+def same_producer(product, limit=None):
+    return Product.objects.filter(producer=product.producer).exclude(pk=product.pk) \
+        .order_by('name', 'id')[:limit or settings.RELATED_PRODUCTS]
@@ -0,0 +1,63 @@
+import datetime
+
+from django.db import transaction
+from django.db.models import F, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .cart import money_field
+from .models import DailySales, Order, OrderProduct
+
+TOP_PRODUCTS = 10
+
+
+def first_day_to_roll_up():
+    # the last rolled up day may have been partial, so it is recomputed together with the days after it
+    last = DailySales.objects.aggregate(last=Max('day'))['last']
+    if last is not None:
+        return last
+    first = Order.objects.filter(ordered=True).aggregate(first=Min('ordered_time'))['first']
+    return timezone.localdate(first) if first else None
+
+
+# Revenue at the prices the lines were charged, so recomputed days still add up to their orders' values
+def charged_total():
+    return Sum(F('quantity') * F('unit_price'), output_field=money_field())
+
+
+# Days from `since` on are recomputed from the order lines with one grouped query and replaced in bulk
+def rollup_sales(since=None):
+    since = since or first_day_to_roll_up()
+    if since is None:
+        return None, 0
+    start = timezone.make_aware(datetime.datetime.combine(since, datetime.time.min))
+    rows = OrderProduct.objects.filter(ordered=True, order__ordered=True, order__ordered_time__gte=start) \
+        .annotate(day=TruncDate('order__ordered_time')) \
+        .values('day', 'product_id', 'product__name', 'product__producer') \
+        .annotate(units=Sum('quantity'), sales=charged_total()).order_by()
+    rollups = [DailySales(day=row['day'], product_id=row['product_id'], product_name=row['product__name'],
+                          producer=row['product__producer'], quantity=row['units'], revenue=row['sales'])
+               for row in rows]
+    with transaction.atomic():
+        DailySales.objects.filter(day__gte=since).delete()
+        DailySales.objects.bulk_create(rollups, batch_size=1000)
+    return since, len(rollups)
+
+
+def totals(rollups):
+    return rollups.annotate(units=Sum('quantity'), sales=Sum('revenue'))
+
+
+def sales_report(days):
+    start = timezone.localdate() - datetime.timedelta(days=days - 1)
+    rollups = DailySales.objects.filter(day__gte=start)
+    return {
+        'days': days,
+        'start': start,
+        'rolled_up_until': DailySales.objects.aggregate(last=Max('day'))['last'],
+        'total': rollups.aggregate(units=Sum('quantity'), sales=Sum('revenue')),
+        'per_day': totals(rollups.values('day')).order_by('day'),
+        'top_products': totals(rollups.values('product_id', 'product_name', 'producer'))
+        .order_by('-sales')[:TOP_PRODUCTS],
+        'per_producer': totals(rollups.values('producer')).order_by('-sales', 'producer'),
+    }
@@ -0,0 +1,255 @@
+import logging
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import Case, IntegerField, Value, When
+
+from .catalog_cache import catalog_generation
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'products_product_fts'
+FIELD_WEIGHTS = (('name', 10.0), ('producer', 5.0), ('description', 1.0))
+
+# letters and digits, as FTS5's unicode61 tokenizer splits them
+TOKEN_RE = re.compile(r'[^\W_]+')
+REMOVE_BATCH_SIZE = 500
+
+
+# Lower case without accents, like unicode61 with remove_diacritics 2, so both indexes match "cafe" to "Café"
+def fold(text):
+    text = (text or '').lower()
+    if text.isascii():
+        return text
+    return ''.join(char for char in unicodedata.normalize('NFKD', text) if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(fold(text))
+
+
+# SQLite FTS5 table written in the same transaction as the product itself
+class FTSIndex:
+    transactional = True
+
+    def add(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(FTS_TABLE), [product.id])
+            cursor.execute('INSERT INTO {} (rowid, name, producer, description) VALUES (%s, %s, %s, %s)'
+                           .format(FTS_TABLE), [product.id, product.name, product.producer, product.description])
+
+    def remove(self, product_id):
+        self.remove_many([product_id])
+
+    def remove_many(self, product_ids):
+        with connection.cursor() as cursor:
+            for start in range(0, len(product_ids), REMOVE_BATCH_SIZE):
+                batch = product_ids[start:start + REMOVE_BATCH_SIZE]
+                cursor.execute('DELETE FROM {} WHERE rowid IN ({})'.format(FTS_TABLE, ', '.join(['%s'] * len(batch))),
+                               batch)
+
+    def rebuild(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(FTS_TABLE))
+            cursor.execute('INSERT INTO {} (rowid, name, producer, description) '
+                           'SELECT id, name, producer, description FROM {}'
+                           .format(FTS_TABLE, Product._meta.db_table))
+
+    def search(self, phrase, limit):
+        terms = tokenize(phrase)
+        if not terms:
+            return []
+        query = ' '.join('"{}"*'.format(term) for term in terms)
+        weights = ', '.join(str(weight) for field, weight in FIELD_WEIGHTS)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT rowid FROM {0} WHERE {0} MATCH %s ORDER BY bm25({0}, {1}) LIMIT %s'
+                           .format(FTS_TABLE, weights), [query, limit])
+            return [row[0] for row in cursor.fetchall()]
+
+
+# In-process inverted index, fallback for databases without FTS5. It takes committed changes of its own process
+# and is read again in the background once another process bumped the catalog generation, like the autocomplete.
+class MemoryIndex:
+    transactional = False
+    # False reads the catalog again on the searching thread, for tests whose data other connections cannot see
+    background = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.building = False
+        self.pending = []
+        self.generation = None
+        self.refreshed = 0
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.tokens = []
+
+    def _index(self, product_id, fields):
+        scores = defaultdict(float)
+        for (field, weight), text in zip(FIELD_WEIGHTS, fields):
+            for token in tokenize(text):
+                scores[token] += weight
+        for token, score in scores.items():
+            self.postings[token][product_id] = score
+        self.documents[product_id] = list(scores)
+
+    def _unindex(self, product_id):
+        for token in self.documents.pop(product_id, ()):
+            self.postings[token].pop(product_id, None)
+            if not self.postings[token]:
+                del self.postings[token]
+
+    @staticmethod
+    def _read():
+        fresh = MemoryIndex()
+        # read before the catalog, a change committed while it is read shows as a newer generation
+        fresh.generation = catalog_generation()
+        products = Product.objects.values_list('id', 'name', 'producer', 'description')
+        for product_id, *fields in products.iterator():
+            fresh._index(product_id, fields)
+        return fresh
+
+    # Called with the lock held; changes made while the catalog was read are applied on top of it
+    def _swap(self, fresh):
+        for product_id, fields in self.pending:
+            fresh._unindex(product_id)
+            if fields is not None:
+                fresh._index(product_id, fields)
+        self.postings, self.documents, self.generation = fresh.postings, fresh.documents, fresh.generation
+        self.tokens = sorted(self.postings)
+        self.loaded = True
+        self.building = False
+        self.pending = []
+
+    def _load(self):
+        if not self.loaded:
+            self._swap(self._read())
+
+    def _rebuild_stale(self):
+        try:
+            fresh = self._read()
+        except DatabaseError:
+            with self.lock:
+                self.building = False
+            logger.exception('Search index could not be read again')
+            return
+        with self.lock:
+            self._swap(fresh)
+
+    # At most one rebuild per SEARCH_REBUILD_INTERVAL, searches use the current postings until it is done
+    def refresh(self):
+        with self.lock:
+            if not self.loaded or self.building or self.generation == catalog_generation() \
+                    or time.monotonic() - self.refreshed < settings.SEARCH_REBUILD_INTERVAL:
+                return
+            self.refreshed = time.monotonic()
+            self.building = True
+            self.pending = []
+        if not self.background:
+            self._rebuild_stale()
+            return
+
+        def run():
+            try:
+                self._rebuild_stale()
+            finally:
+                connections.close_all()
+        threading.Thread(target=run, name='search-index-refresh', daemon=True).start()
+
+    # fields are (name, producer, description), None removes the product
+    def change(self, product_id, fields):
+        with self.lock:
+            if self.building:
+                self.pending.append((product_id, fields))
+            if self.loaded:
+                self._unindex(product_id)
+                if fields is not None:
+                    self._index(product_id, fields)
+                self.tokens = sorted(self.postings)
+
+    def add(self, product):
+        self.change(product.id, [getattr(product, field) for field, weight in FIELD_WEIGHTS])
+
+    def remove(self, product_id):
+        self.remove_many([product_id])
+
+    def remove_many(self, product_ids):
+        with self.lock:
+            if self.building:
+                self.pending.extend((product_id, None) for product_id in product_ids)
+            if self.loaded:
+                for product_id in product_ids:
+                    self._unindex(product_id)
+                self.tokens = sorted(self.postings)
+
+    def rebuild(self):
+        with self.lock:
+            self.loaded = False
+            self._load()
+
+    def _prefix_matches(self, prefix):
+        scores = defaultdict(float)
+        position = bisect_left(self.tokens, prefix)
+        while position < len(self.tokens) and self.tokens[position].startswith(prefix):
+            for product_id, score in self.postings[self.tokens[position]].items():
+                scores[product_id] += score
+            position += 1
+        return scores
+
+    def search(self, phrase, limit):
+        terms = tokenize(phrase)
+        if not terms:
+            return []
+        self.refresh()
+        with self.lock:
+            self._load()
+            ranking = None
+            for term in terms:
+                matches = self._prefix_matches(term)
+                if ranking is None:
+                    ranking = matches
+                else:
+                    ranking = {product_id: score + matches[product_id]
+                               for product_id, score in ranking.items() if product_id in matches}
+        return sorted(ranking, key=lambda product_id: (-ranking[product_id], product_id))[:limit]
+
+
+memory_index = MemoryIndex()
+fts_index = FTSIndex()
+_fts_available = {}
+
+
+def get_index():
+    if connection.vendor != 'sqlite':
+        return memory_index
+    if connection.alias not in _fts_available:
+        _fts_available[connection.alias] = FTS_TABLE in connection.introspection.table_names()
+    return fts_index if _fts_available[connection.alias] else memory_index
+
+
+# The ids of at most `limit` best matches, and whether more products matched than that
+def search_ids(phrase, limit=None):
+    limit = limit or settings.SEARCH_MAX_RESULTS
+    ids = get_index().search(phrase, limit + 1)
+    return ids[:limit], len(ids) > limit
+
+
+# Annotated with the index rank so results can be ordered and paginated by (search_rank, id)
+def ranked_products(ids):
+    if not ids:
+        return Product.objects.none().annotate(search_rank=Value(0, output_field=IntegerField()))
+    rank = Case(*[When(pk=product_id, then=Value(position)) for position, product_id in enumerate(ids)],
+                output_field=IntegerField())
+    return Product.objects.filter(pk__in=ids).annotate(search_rank=rank).order_by('search_rank', 'id')
+
+
+def search_products(phrase, limit=None):
+    return ranked_products(search_ids(phrase, limit)[0])
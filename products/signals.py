@@ -0,0 +1,80 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .autocomplete import autocomplete_index
+from .cart import open_orders_with, reconcile_order_values
+from .catalog_cache import bump_catalog_generation
+from .facets import refresh_facets
+from .images import needs_derivatives
+from .jobs import enqueue
+from .models import Product
+from .search import get_index
+from .tasks import GENERATE_IMAGE_DERIVATIVES
+
+
+# The in-process indexes only take committed changes. The generation is bumped again once they are
+# visible, so a process that read the catalog between the save and the commit reads it again.
+def after_commit(change, *args):
+    def run():
+        change(*args)
+        bump_catalog_generation()
+    transaction.on_commit(run)
+
+
+state = threading.local()
+
+
+# Bulk changes refresh the indexes and facets once for all products, the per-product receivers stand aside
+@contextmanager
+def bulk_change():
+    state.bulk = True
+    try:
+        yield
+    finally:
+        state.bulk = False
+
+
+@receiver(pre_save, sender=Product)
+def product_saving(sender, instance, **kwargs):
+    # the facet the product leaves has to be recounted too, Product.save read its stored row
+    previous = getattr(instance, '_stored', None)
+    instance._previous_facet = (previous['producer'], previous['price_bucket']) if previous else None
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    index = get_index()
+    if index.transactional:
+        index.add(instance)
+    else:
+        after_commit(index.change, instance.id, [instance.name, instance.producer, instance.description])
+    after_commit(autocomplete_index.change, instance.id, (instance.name, instance.producer, instance.slug))
+    pairs = {(instance.producer, instance.price_bucket)}
+    if getattr(instance, '_previous_facet', None):
+        pairs.add(instance._previous_facet)
+    refresh_facets(pairs)
+    previous = getattr(instance, '_stored', None)
+    if previous and previous['price'] != instance.price:
+        # open carts holding the product are valued at its current price
+        reconcile_order_values(open_orders_with(Product.objects.filter(pk=instance.pk)))
+    bump_catalog_generation()
+    if needs_derivatives(instance):
+        enqueue(GENERATE_IMAGE_DERIVATIVES, instance.id)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    if getattr(state, 'bulk', False):
+        return
+    index = get_index()
+    if index.transactional:
+        index.remove(instance.id)
+    else:
+        after_commit(index.remove, instance.id)
+    after_commit(autocomplete_index.remove, instance.id)
+    refresh_facets([(instance.producer, instance.price_bucket)])
+    bump_catalog_generation()
@@ -0,0 +1,31 @@
+from .catalog_cache import bump_catalog_generation
+from .images import needs_derivatives, render_derivatives
+from .jobs import job_handler
+from .models import ClientAdress, Order, Product
+from .utils import create_invoice, send_email_with_invoice
+
+SEND_INVOICE = 'send_invoice'
+GENERATE_IMAGE_DERIVATIVES = 'generate_image_derivatives'
+
+
+def invoice_failed(order_id):
+    Order.objects.filter(pk=order_id).update(invoice_status=Order.INVOICE_FAILED)
+
+
+@job_handler(SEND_INVOICE, on_failure=invoice_failed)
+def send_invoice(order_id):
+    order = Order.objects.select_related('user').get(pk=order_id)
+    client = ClientAdress.objects.get(client=order.user)
+    pdf = create_invoice(template_src='pdf/invoice.html', order=order, client=client)
+    send_email_with_invoice(order, pdf)
+    Order.objects.filter(pk=order_id).update(invoice_status=Order.INVOICE_SENT)
+
+
+@job_handler(GENERATE_IMAGE_DERIVATIVES)
+def generate_image_derivatives(product_id):
+    product = Product.objects.filter(pk=product_id).first()
+    if product is None or not needs_derivatives(product):
+        return
+    derivatives = render_derivatives(product.image.name)
+    Product.objects.filter(pk=product_id, image=product.image.name).update(image_derivatives=derivatives)
+    bump_catalog_generation()
@@ -0,0 +1,21 @@
+from django import template
+from django.conf import settings
+from django.templatetags.static import static
+from django.utils.html import format_html_join
+
+from shop.assets import bundle_path, is_collected
+
+register = template.Library()
+
+TAGS = {
+    'css': '<link rel="stylesheet" type="text/css" href="{}">',
+    'js': '<script src="{}"></script>',
+}
+
+
+# One fingerprinted file once collectstatic built the bundle, its sources one by one before that
+@register.simple_tag
+def bundle(name):
+    path = bundle_path(name)
+    paths = [path] if is_collected(path) else settings.STATIC_BUNDLES[name]
+    return format_html_join('\n', TAGS[name.rsplit('.', 1)[1]], ((static(path),) for path in paths))
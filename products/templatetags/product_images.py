@@ -0,0 +1,31 @@
+from django import template
+
+from products.images import derivative_urls
+
+register = template.Library()
+
+
+def image_source(product):
+    if isinstance(product, dict):
+        return product['image_url'], product.get('image_derivatives') or {}
+    return product.image.url, product.image_derivatives
+
+
+@register.inclusion_tag('product_picture.html')
+def product_picture(product, sizes='100vw'):
+    url, derivatives = image_source(product)
+    return {
+        'url': url,
+        'sizes': sizes,
+        'webp_srcset': ', '.join('{} {}w'.format(src, width) for width, src in derivative_urls(derivatives, 'webp')),
+        'jpeg_srcset': ', '.join('{} {}w'.format(src, width) for width, src in derivative_urls(derivatives, 'jpeg')),
+    }
+
+
+@register.simple_tag
+def product_image_url(product, width):
+    url, derivatives = image_source(product)
+    for derivative_width, src in derivative_urls(derivatives, 'jpeg'):
+        if derivative_width >= width:
+            return src
+    return url
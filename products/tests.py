@@ -1,10 +1,69 @@
+import asyncio
+import csv
+import datetime
+import gzip
+import itertools
+import json
+import os
+import runpy
+import shutil
+import tempfile
+import threading
+import tracemalloc
+from decimal import Decimal
+from io import StringIO
+
+from django.core import mail
+from django.core.asgi import get_asgi_application
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.core.signals import request_started
+from django.contrib.staticfiles.storage import staticfiles_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import Q, Sum
+from django.db.models.signals import post_delete
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
+from django.template import Context, Template
 from django.urls import reverse
-from .models import ClientAdress, Product, OrderProduct, Order
+from django.utils import timezone
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from PIL import Image
+from benchmarks.autocomplete import run_autocomplete
+from benchmarks.runner import run_client
+from benchmarks.scenarios import SCENARIOS, Context as BenchmarkContext
+from benchmarks.seed import seed_catalog, seed_users
+import shop.settings
+from shop.assets import StaticFilesApplication, brotli
+from shop.profiling import ProfilingMiddleware, RequestProfile, registry
+from . import api
+from .autocomplete import PrefixIndex, autocomplete_index
+from .catalog_cache import bump_catalog_generation
+from .catalog_io import adjust_prices
+from .cart import add_to_cart, checkout, get_cart_summary, get_open_order, reconcile_order_values, remove_from_cart
+from .jobs import run_pending_jobs
+from .facets import catalog_facets, filter_products, rebuild_facets
+from .models import ClientAdress, DailySales, Job, Product, ProductFacet, OrderProduct, Order, RelatedProduct
+from .order_export import HEADERS, csv_chunks, order_lines, order_rows, xlsxwriter
+from .pagination import NEXT, PREVIOUS, CursorPaginator, EstimatedCountPaginator, encode_cursor, estimated_row_count
+from .related import bought_together, compute_related_products, same_producer
+from .reports import rollup_sales, sales_report
+from .search import MemoryIndex, get_index, search_products
+from .tasks import GENERATE_IMAGE_DERIVATIVES
 from .tests_utils import delete_test_image
+from .views import add_product, products_list
+
+# executed again with a patched environment to check what the settings refuse
+SETTINGS_PATH = shop.settings.__file__
 
 
 # models tests
@@ -68,6 +127,41 @@ class ProductTest(TestCase):
         record = Product.objects.get(name=self.product.name)
         self.assertFalse(isinstance(record, User))
 
+    def test_slug_collision(self):
+        duplicates = [Product.objects.create(name=self.product.name, producer=self.product.producer, description='',
+                                             price=1, image='media/images/test_image.jpg') for _ in range(2)]
+        self.assertEqual([product.slug for product in duplicates],
+                         [self.product.slug + '-2', self.product.slug + '-3'])
+        duplicates[0].price = 2
+        duplicates[0].save()
+        self.assertEqual(duplicates[0].slug, self.product.slug + '-2')
+        duplicates[1].name = 'Renamed'
+        duplicates[1].save()
+        self.assertEqual(duplicates[1].slug, 'test-item-producer-renamed')
+
+    def test_rename_drops_numbers_of_the_old_name(self):
+        product = Product.objects.create(name='Kettle 2024', producer='Bosch', description='', price=1,
+                                         image='media/images/test_image.jpg')
+        self.assertEqual(product.slug, 'bosch-kettle-2024')
+        product.name = 'Kettle'
+        product.save()
+        self.assertEqual(product.slug, 'bosch-kettle')
+        self.assertEqual(Product.objects.get(pk=product.pk).slug, 'bosch-kettle')
+        product.price = 5
+        product.save()
+        self.assertEqual(product.slug, 'bosch-kettle')
+
+    def test_update_fields_save_the_new_slug(self):
+        product = Product.objects.create(name='Kettle', producer='Bosch', description='', price=1,
+                                         image='media/images/test_image.jpg')
+        product.name = 'Toaster'
+        product.save(update_fields=['name'])
+        self.assertEqual(Product.objects.get(pk=product.pk).slug, 'bosch-toaster')
+        product.price = 30
+        product.save(update_fields=['price'])
+        self.assertEqual(Product.objects.values_list('slug', 'price_bucket').get(pk=product.pk),
+                         ('bosch-toaster', Decimal(25)))
+
 
 class OrderProductTest(TestCase):
 
@@ -461,3 +555,1707 @@ class ConfirmOrderViewTest(TestCase):
     def confirm_order_view_fail(self):
         response = self.client.get(reverse('confirm_order'))
         self.assertNotEqual(response.status_code, 200)
+
+
+class InvoiceJobTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        cls.user.email = 'test_user@email.com'
+        cls.user.set_password('test')
+        cls.user.save()
+        cls.address = create_client_address(cls.user)
+        cls.product = create_product()
+        cls.slug = cls.product.slug
+        Job.objects.filter(name=GENERATE_IMAGE_DERIVATIVES).delete()
+
+    def setUp(self):
+        self.invoices_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.invoices_dir)
+        override = override_settings(INVOICE_STORAGE_OPTIONS={'location': self.invoices_dir})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client.login(username='test_user', password='test')
+        self.client.get(reverse('add_product_to_cart', args=[self.slug]))
+        response = self.client.get(reverse('confirm_order'))
+        self.assertEqual(response.status_code, 200)
+        self.order = Order.objects.get(user=self.user)
+
+    def tearDown(self):
+        delete_test_image()
+
+    def test_confirm_order_enqueues_invoice(self):
+        self.assertTrue(self.order.ordered)
+        self.assertEqual(self.order.invoice_status, Order.INVOICE_PENDING)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertTrue(Job.objects.filter(object_id=self.order.id, status=Job.PENDING).exists())
+
+    def test_worker_sends_invoice(self):
+        self.assertEqual(run_pending_jobs(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
+        self.assertEqual(mail.outbox[0].attachments[0][2], 'application/pdf')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.invoice_status, Order.INVOICE_SENT)
+        self.assertEqual(Job.objects.get(object_id=self.order.id).status, Job.DONE)
+        self.assertEqual(run_pending_jobs(), 0)
+
+    def test_invoice_is_stored_once(self):
+        run_pending_jobs()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.invoice_file, 'order_{}/{}.pdf'.format(self.order.id, self.order.invoice_hash))
+        self.assertEqual(os.path.getsize(os.path.join(self.invoices_dir, self.order.invoice_file)),
+                         self.order.invoice_size)
+        with mock.patch('products.utils.render_invoice') as render:
+            self.client.post(reverse('resend_invoice', args=[self.order.id]))
+            run_pending_jobs()
+        render.assert_not_called()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].attachments, mail.outbox[1].attachments)
+
+    def test_resend_invoice(self):
+        run_pending_jobs()
+        url = reverse('resend_invoice', args=[self.order.id])
+        self.assertContains(self.client.get(reverse('order_history')), 'action="{}"'.format(url))
+        self.assertEqual(self.client.get(url).status_code, 405)
+        csrf_client = Client(enforce_csrf_checks=True)
+        csrf_client.login(username='test_user', password='test')
+        self.assertEqual(csrf_client.post(url).status_code, 403)
+        self.assertEqual(run_pending_jobs(), 0)
+        response = self.client.post(url, follow=True)
+        self.assertRedirects(response, reverse('order_history'))
+        self.assertContains(response, 'will be sent to your email again')
+        self.assertEqual(run_pending_jobs(), 1)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_download_invoice(self):
+        response = self.client.get(reverse('download_invoice', args=[self.order.id]))
+        self.assertEqual(response.status_code, 404)
+        run_pending_jobs()
+        response = self.client.get(reverse('download_invoice', args=[self.order.id]))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        self.client.logout()
+        other = User.objects.create(username='other_user')
+        other.set_password('test')
+        other.save()
+        self.client.login(username='other_user', password='test')
+        response = self.client.get(reverse('download_invoice', args=[self.order.id]))
+        self.assertEqual(response.status_code, 403)
+
+    def test_benchmark_command(self):
+        run_pending_jobs()
+        out = StringIO()
+        call_command('benchmark_invoices', orders=1, stdout=out)
+        self.assertIn('Rendered 1 invoice(s)', out.getvalue())
+
+    def test_worker_retries_with_backoff(self):
+        with mock.patch('products.tasks.send_email_with_invoice', side_effect=ConnectionError):
+            self.assertEqual(run_pending_jobs(), 1)
+        job = Job.objects.get(object_id=self.order.id)
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(run_pending_jobs(), 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+    @override_settings(JOB_MAX_ATTEMPTS=1)
+    def test_worker_gives_up(self):
+        with mock.patch('products.tasks.send_email_with_invoice', side_effect=ConnectionError):
+            run_pending_jobs()
+        self.assertEqual(Job.objects.get(object_id=self.order.id).status, Job.FAILED)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.invoice_status, Order.INVOICE_FAILED)
+
+
+class SearchIndexTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.by_name = Product.objects.create(name='Kettle', producer='Bosch', description='Electric',
+                                             price=10, image='media/images/test_image.jpg')
+        cls.by_description = Product.objects.create(name='Toaster', producer='Philips',
+                                                    description='Fits next to a kettle', price=20,
+                                                    image='media/images/test_image.jpg')
+
+    def assertRanking(self, index):
+        self.assertEqual(index.search('kettle', 10), [self.by_name.id, self.by_description.id])
+        self.assertEqual(index.search('ket', 10), [self.by_name.id, self.by_description.id])
+        self.assertEqual(index.search('kettle phil', 10), [self.by_description.id])
+        self.assertEqual(index.search('blender', 10), [])
+
+    def test_fts_index(self):
+        self.assertRanking(get_index())
+
+    def test_memory_index(self):
+        self.assertRanking(MemoryIndex())
+
+    def test_index_follows_product_changes(self):
+        self.by_name.name = 'Blender'
+        self.by_name.save()
+        self.assertEqual(list(search_products('blender')), [self.by_name])
+        self.by_description.delete()
+        self.assertFalse(search_products('kettle').exists())
+
+    def test_both_indexes_fold_accents(self):
+        product = Product.objects.create(name='Crème brûlée torch', producer='Bosch', description='Kitchen_tool',
+                                         price=10, image='media/images/test_image.jpg')
+        for index in (get_index(), MemoryIndex()):
+            self.assertEqual(index.search('creme brulee', 10), [product.id])
+            self.assertEqual(index.search('CRÈME', 10), [product.id])
+            # underscores separate words in both
+            self.assertEqual(index.search('tool', 10), [product.id])
+
+    def test_memory_index_takes_committed_changes(self):
+        index = MemoryIndex()
+        index.background = False
+        self.assertEqual(index.search('kettle', 10), [self.by_name.id, self.by_description.id])
+        with mock.patch('products.signals.get_index', return_value=index):
+            try:
+                with transaction.atomic():
+                    self.by_name.name = 'Blender'
+                    self.by_name.save()
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+            self.assertEqual(index.search('blender', 10), [])
+            with self.captureOnCommitCallbacks(execute=True):
+                self.by_name.save()
+        self.assertEqual(index.search('blender', 10), [self.by_name.id])
+
+    @override_settings(SEARCH_REBUILD_INTERVAL=0)
+    def test_memory_index_follows_other_processes(self):
+        index = MemoryIndex()
+        index.background = False
+        self.assertEqual(index.search('blender', 10), [])
+        # another process renames the product and bumps the generation once it committed
+        Product.objects.filter(pk=self.by_name.pk).update(name='Blender')
+        self.assertEqual(index.search('blender', 10), [])
+        bump_catalog_generation()
+        self.assertEqual(index.search('blender', 10), [self.by_name.id])
+
+    @override_settings(SEARCH_MAX_RESULTS=1)
+    def test_capped_results_are_reported(self):
+        response = self.client.get(reverse('search'), {'phrase': 'kettle'})
+        self.assertEqual(list(response.context['products']), [self.by_name])
+        self.assertContains(response, 'Only the best 1 matches are listed')
+        self.assertNotContains(self.client.get(reverse('search'), {'phrase': 'bosch'}), 'Only the best')
+        response = self.client.get(reverse('api_search'), {'q': 'kettle'})
+        data = json.loads(response.content)
+        self.assertEqual((len(data['results']), data['truncated']), (1, True))
+        User.objects.create_user('staff', password='test', is_staff=True, is_superuser=True)
+        self.client.login(username='staff', password='test')
+        response = self.client.get(reverse('admin:products_product_changelist'), {'q': 'kettle'})
+        self.assertContains(response, 'Only the best 1 matches are listed')
+
+    def test_rebuild_command(self):
+        call_command('rebuild_search_index', stdout=open(os.devnull, 'w'))
+        self.assertEqual(list(search_products('bosch')), [self.by_name])
+
+
+class AutocompleteTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for name, producer in (('Compact kettle 2000', 'Bosch'), ('Kettle', 'Philips'), ('Café maker', 'Tefal'),
+                               ('Toaster', 'Bosch')):
+            Product.objects.create(name=name, producer=producer, description='Item', price=10,
+                                   image='media/images/test_image.jpg')
+
+    def setUp(self):
+        cache.clear()
+        autocomplete_index.clear()
+        # a rebuilding thread would not see the test transaction's products
+        patcher = mock.patch.object(PrefixIndex, 'background', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def names(self, suggestions):
+        return [product['name'] for product in suggestions['products']]
+
+    def test_prefixes(self):
+        index = PrefixIndex()
+        self.assertEqual(self.names(index.suggest('ket', 10)), ['Kettle', 'Compact kettle 2000'])
+        self.assertEqual(self.names(index.suggest('Bosch  CO', 10)), ['Compact kettle 2000'])
+        self.assertEqual(self.names(index.suggest('kettle 2', 10)), ['Compact kettle 2000'])
+        self.assertEqual(self.names(index.suggest('cafe', 10)), ['Café maker'])
+        self.assertEqual(index.suggest('bo', 10)['producers'], ['Bosch'])
+        self.assertEqual(len(index.suggest('t', 1)['products']), 1)
+        with self.assertNumQueries(0):
+            suggestions = index.suggest('toa', 10)
+        self.assertEqual(suggestions['products'], [{'name': 'Toaster', 'producer': 'Bosch',
+                                                    'slug': 'bosch-toaster'}])
+
+    def test_index_follows_product_changes(self):
+        self.assertEqual(self.names(autocomplete_index.suggest('ket', 10)), ['Kettle', 'Compact kettle 2000'])
+        product = Product.objects.get(name='Kettle')
+        product.name = 'Blender'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(self.names(autocomplete_index.suggest('ket', 10)), ['Compact kettle 2000'])
+        self.assertEqual(self.names(autocomplete_index.suggest('ble', 10)), ['Blender'])
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertEqual(autocomplete_index.suggest('ble', 10)['products'], [])
+        self.assertEqual(autocomplete_index.suggest('phil', 10)['producers'], [])
+
+    def test_rolled_back_changes_are_not_indexed(self):
+        index = PrefixIndex()
+        index.load()
+        product = Product.objects.get(name='Toaster')
+        with mock.patch('products.signals.autocomplete_index', index), self.captureOnCommitCallbacks() as callbacks:
+            try:
+                with transaction.atomic():
+                    product.name = 'Blender'
+                    product.save()
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertEqual(index.tables.suggest('ble', 10)['products'], [])
+
+    @override_settings(AUTOCOMPLETE_REBUILD_INTERVAL=0)
+    def test_changes_of_other_processes(self):
+        index = PrefixIndex()
+        self.assertEqual(self.names(index.suggest('ket', 10)), ['Kettle', 'Compact kettle 2000'])
+        # another process renames the product and bumps the generation once it committed
+        Product.objects.filter(name='Kettle').update(name='Blender')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(index.suggest('ket', 10)), ['Kettle', 'Compact kettle 2000'])
+        bump_catalog_generation()
+        self.assertEqual(self.names(index.suggest('ket', 10)), ['Compact kettle 2000'])
+        self.assertEqual(self.names(index.suggest('ble', 10)), ['Blender'])
+        with override_settings(AUTOCOMPLETE_REBUILD_INTERVAL=3600):
+            Product.objects.filter(name='Blender').update(name='Mixer')
+            bump_catalog_generation()
+            # a rebuild just ran, the next one waits for the interval
+            self.assertEqual(self.names(index.suggest('ble', 10)), ['Blender'])
+
+    def test_changes_during_a_build_are_kept(self):
+        index = PrefixIndex()
+        kettle = Product.objects.get(name='Kettle')
+
+        def rows():
+            for row in Product.objects.values_list('id', 'name', 'producer', 'slug'):
+                yield row
+                index.remove(kettle.id)
+        index.load(rows())
+        self.assertEqual(self.names(index.suggest('ket', 10)), ['Compact kettle 2000'])
+
+    def test_memory_limit(self):
+        index = PrefixIndex()
+        index.load()
+        # one byte short of the whole index leaves the words inside names out
+        with override_settings(AUTOCOMPLETE_MEMORY_LIMIT=index.size - 1):
+            index.load()
+        self.assertIsNone(index.tables.words)
+        self.assertEqual(self.names(index.suggest('ket', 10)), ['Kettle'])
+        with override_settings(AUTOCOMPLETE_MEMORY_LIMIT=100):
+            index.load()
+        self.assertIsNone(index.suggest('ket', 10))
+
+    def test_endpoint(self):
+        url = reverse('api_autocomplete')
+        response = self.client.get(url, {'q': 'ket', 'limit': 1})
+        self.assertEqual(response.json(), {'products': [{'name': 'Kettle', 'producer': 'Philips',
+                                                         'slug': 'philips-kettle'}], 'producers': []})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'q': 'bos'})
+        self.assertEqual(response.json()['producers'], ['Bosch'])
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(url, {'q': 'ket', 'limit': 100}).status_code, 400)
+        # without the index the search answers
+        with override_settings(AUTOCOMPLETE_MEMORY_LIMIT=100):
+            autocomplete_index.load()
+            cache.clear()
+            response = self.client.get(url, {'q': 'toaster'})
+        self.assertEqual(response.json()['products'][0]['name'], 'Toaster')
+
+
+class CartServiceTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        cls.user.set_password('test')
+        cls.user.save()
+        cls.product = Product.objects.create(name='Kettle', producer='Bosch', description='Electric', price=10,
+                                             image='media/images/test_image.jpg')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_add_and_remove(self):
+        add_to_cart(self.user, self.product)
+        order = add_to_cart(self.user, self.product)
+        order.refresh_from_db()
+        self.assertEqual(order.value, 20)
+        self.assertEqual(order.products.get().quantity, 2)
+        remove_from_cart(self.user, self.product)
+        self.assertEqual(order.products.get().quantity, 1)
+        remove_from_cart(self.user, self.product)
+        order.refresh_from_db()
+        self.assertEqual(order.value, 0)
+        self.assertFalse(order.products.exists())
+        self.assertFalse(OrderProduct.objects.filter(user=self.user).exists())
+
+    def test_price_edit_between_add_and_remove(self):
+        order = add_to_cart(self.user, self.product)
+        product = Product.objects.get(pk=self.product.pk)
+        product.price = 20
+        product.save()
+        order.refresh_from_db()
+        self.assertEqual(order.value, 20)
+        self.assertEqual(get_cart_summary(self.user)['value'], 20)
+        remove_from_cart(self.user, product)
+        order.refresh_from_db()
+        self.assertEqual(order.value, 0)
+        # an UPDATE bypasses the signal, the next change of the cart catches up
+        add_to_cart(self.user, product)
+        add_to_cart(self.user, product)
+        Product.objects.filter(pk=product.pk).update(price=30)
+        remove_from_cart(self.user, product)
+        order.refresh_from_db()
+        self.assertEqual(order.value, 30)
+
+    def test_checkout_closes_cart(self):
+        add_to_cart(self.user, self.product)
+        order = checkout(self.user)
+        self.assertTrue(order.ordered)
+        self.assertTrue(OrderProduct.objects.get(user=self.user).ordered)
+        self.assertEqual(get_cart_summary(self.user)['count'], 0)
+        new_order = add_to_cart(self.user, self.product)
+        self.assertNotEqual(new_order.id, order.id)
+        self.assertEqual(new_order.products.get().quantity, 1)
+
+    def test_money_is_exact(self):
+        product = Product.objects.create(name='Pin', producer='Bosch', description='Small', price='0.10',
+                                         image='media/images/test_image.jpg')
+        for _ in range(3):
+            order = add_to_cart(self.user, product)
+        order.refresh_from_db()
+        self.assertEqual(order.value, Decimal('0.30'))
+
+    def test_checkout_charges_current_prices(self):
+        add_to_cart(self.user, self.product)
+        add_to_cart(self.user, self.product)
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal('12.50'))
+        order = checkout(self.user)
+        order.refresh_from_db()
+        self.assertEqual(order.value, Decimal('25.00'))
+        self.assertEqual(order.products.get().unit_price, Decimal('12.50'))
+        # later price changes leave the placed order alone
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal('15.00'))
+        self.assertEqual(reconcile_order_values(Order.objects.all()), [])
+
+    def test_reconcile_order_values(self):
+        order = add_to_cart(self.user, self.product)
+        add_to_cart(self.user, self.product)
+        Order.objects.filter(pk=order.pk).update(value=Decimal('3.33'))
+        out = StringIO()
+        call_command('reconcile_order_values', '--dry-run', stdout=out)
+        self.assertIn('1 of 1 order(s) drifted', out.getvalue())
+        order.refresh_from_db()
+        self.assertEqual(order.value, Decimal('3.33'))
+        call_command('reconcile_order_values', stdout=out)
+        order.refresh_from_db()
+        self.assertEqual(order.value, Decimal('20.00'))
+        self.assertEqual(reconcile_order_values(Order.objects.all()), [])
+
+    def assertMaxQueries(self, limit, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertLessEqual(len(queries), limit, [query['sql'] for query in queries])
+
+    def test_query_count(self):
+        # ceilings include the session and user lookups and the test transaction savepoints,
+        # opening the cart adds the savepoint around the insert guarded by one_open_order_per_user
+        self.client.login(username='test_user', password='test')
+        self.assertMaxQueries(11, reverse('add_product_to_cart', args=[self.product.slug]))
+        self.assertMaxQueries(8, reverse('add_product_to_cart', args=[self.product.slug]))
+        self.assertMaxQueries(3, reverse('cart'))
+        self.assertMaxQueries(9, reverse('remove_product_from_cart', args=[self.product.slug]))
+        self.assertMaxQueries(10, reverse('remove_product_from_cart', args=[self.product.slug]))
+
+
+class CartSummaryTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        cls.user.set_password('test')
+        cls.user.save()
+        cls.products = [Product.objects.create(name='Kettle {}'.format(i), producer='Bosch', description='Electric',
+                                               price=10, image='media/images/test_image.jpg') for i in range(3)]
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username='test_user', password='test')
+        for product in self.products:
+            add_to_cart(self.user, product)
+
+    def test_summary_is_invalidated_on_mutation(self):
+        self.assertEqual(get_cart_summary(self.user)['count'], 3)
+        add_to_cart(self.user, self.products[0])
+        self.assertEqual(get_cart_summary(self.user)['count'], 4)
+        remove_from_cart(self.user, self.products[1])
+        summary = get_cart_summary(self.user)
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(summary['value'], 30)
+        self.assertEqual([item['quantity'] for item in summary['items']], [2, 1])
+
+    def test_cached_cart_view(self):
+        response = self.client.get(reverse('cart'))
+        self.assertContains(response, 'Kettle 2')
+        self.assertContains(response, 'checkout_items')
+        # only the session and the user are loaded once the summary is cached
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('cart'))
+        self.assertContains(response, 'Subtotal: £30')
+
+
+class CatalogCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Kettle', producer='Bosch', description='Electric', price=10,
+                                             image='media/images/test_image.jpg')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_pages_are_cached(self):
+        for url in (reverse('products_list'), reverse('product_detail', args=[self.product.slug])):
+            response = self.client.get(url)
+            self.assertContains(response, 'Kettle')
+            with self.assertNumQueries(0):
+                cached = self.client.get(url)
+            self.assertEqual(cached.content, response.content)
+            self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_pages_are_stored_under_validated_parameters(self):
+        response = self.client.get(reverse('products_list'), {'producer': 'Bosch', 'price': '0'})
+        # unknown parameters, an equal price and a forged cursor are the same page
+        for params in ({'producer': 'Bosch', 'price': '0.00', 'utm_source': 'mail'},
+                       {'producer': 'Bosch', 'price': '0', 'cursor': 'forged'}):
+            with self.assertNumQueries(0):
+                cached = self.client.get(reverse('products_list'), params)
+            self.assertEqual(cached.content, response.content)
+            self.assertEqual(cached['ETag'], response['ETag'])
+        # a producer the catalog does not have is answered but not stored
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('products_list'), {'producer': 'Nobody'})
+            self.assertContains(response, '0 <span>products</span>')
+            self.assertTrue(queries)
+
+    def test_conditional_get(self):
+        response = self.client.get(reverse('products_list'))
+        response = self.client.get(reverse('products_list'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(reverse('products_list'), HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_workers_need_a_shared_cache(self):
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '4'}):
+            os.environ.pop('CACHE_BACKEND', None)
+            with self.assertRaisesMessage(ImproperlyConfigured, 'needs a shared CACHE_BACKEND'):
+                runpy.run_path(SETTINGS_PATH)
+            os.environ['CACHE_BACKEND'] = 'django.core.cache.backends.redis.RedisCache'
+            self.assertTrue(runpy.run_path(SETTINGS_PATH)['SHARED_CACHE'])
+
+    def test_product_change_invalidates_pages(self):
+        response = self.client.get(reverse('products_list'))
+        etag = response['ETag']
+        self.product.name = 'Toaster'
+        self.product.save()
+        response = self.client.get(reverse('products_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Toaster')
+
+
+class CursorPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(30):
+            Product.objects.create(name='Product {:02d}'.format(i // 2), producer='Producer {}'.format(i),
+                                   description='Item', price=10, image='media/images/test_image.jpg')
+        cls.ordered = list(Product.objects.order_by('name', 'id'))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_walk_forward_and_back(self):
+        paginator = CursorPaginator(Product.objects.all(), 12)
+        first = paginator.get_page()
+        self.assertFalse(first.has_previous())
+        second = paginator.get_page(first.next_cursor)
+        third = paginator.get_page(second.next_cursor)
+        self.assertFalse(third.has_next())
+        self.assertEqual(list(first) + list(second) + list(third), self.ordered)
+        back = paginator.get_page(third.previous_cursor)
+        self.assertEqual(list(back), list(second))
+        self.assertEqual(list(paginator.get_page(back.previous_cursor)), list(first))
+        self.assertFalse(paginator.get_page(back.previous_cursor).has_previous())
+
+    def test_invalid_cursor_returns_first_page(self):
+        paginator = CursorPaginator(Product.objects.all(), 12)
+        self.assertEqual(list(paginator.get_page('not a cursor')), self.ordered[:12])
+
+    def test_forged_cursor_returns_first_page(self):
+        forged = [encode_cursor(NEXT, [{}, 'x']), encode_cursor(PREVIOUS, ['Product 03', None]),
+                  encode_cursor(NEXT, ['Product 03']), encode_cursor(NEXT, ['Product 03', '1.5'])]
+        first = self.client.get(reverse('products_list'))
+        self.assertEqual(list(first.context['products']), self.ordered[:12])
+        for cursor in forged:
+            # the first page, served from its stored copy
+            response = self.client.get(reverse('products_list'), {'cursor': cursor})
+            self.assertEqual(response.content, first.content)
+            response = self.client.get(reverse('search'), {'phrase': 'producer', 'cursor': cursor})
+            self.assertEqual(len(response.context['products']), 12)
+            self.assertFalse(response.context['products'].has_previous())
+        # well typed values past the last product give an empty page
+        response = self.client.get(reverse('products_list'), {'cursor': encode_cursor(NEXT, [['x'], 2])})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['products'])
+
+    def test_list_view(self):
+        response = self.client.get(reverse('products_list'))
+        self.assertContains(response, '30 <span>products</span>')
+        cursor = response.context['products'].next_cursor
+        response = self.client.get(reverse('products_list'), {'cursor': cursor})
+        self.assertEqual(list(response.context['products']), self.ordered[12:24])
+
+    def test_search_view(self):
+        response = self.client.get(reverse('search'), {'phrase': 'producer'})
+        products = response.context['products']
+        self.assertEqual(len(products), 12)
+        response = self.client.get(reverse('search'), {'phrase': 'producer', 'cursor': products.next_cursor})
+        self.assertEqual(len(response.context['products']), 12)
+        self.assertFalse(set(products) & set(response.context['products']))
+
+
+class CatalogFacetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for producer, price in (('Bosch', 10), ('Bosch', 30), ('Bosch', '30.50'), ('Philips', 60), ('Philips', 1200),
+                                ('Tefal', 5)):
+            Product.objects.create(name='{} {}'.format(producer, price), producer=producer, description='Item',
+                                   price=price, image='media/images/test_image.jpg')
+
+    def setUp(self):
+        cache.clear()
+
+    def facet_rows(self):
+        return sorted(ProductFacet.objects.values_list('producer', 'price_from', 'product_count'))
+
+    def assertFacetsCurrent(self):
+        for price, bucket in Product.objects.values_list('price', 'price_bucket'):
+            self.assertEqual(bucket, Product.make_price_bucket(price))
+        rows = self.facet_rows()
+        rebuild_facets()
+        self.assertEqual(rows, self.facet_rows())
+
+    def test_counts_follow_saves_and_deletes(self):
+        self.assertEqual(self.facet_rows(), [('Bosch', Decimal(0), 1), ('Bosch', Decimal(25), 2),
+                                             ('Philips', Decimal(50), 1), ('Philips', Decimal(1000), 1),
+                                             ('Tefal', Decimal(0), 1)])
+        product = Product.objects.get(name='Bosch 30')
+        product.producer, product.price = 'Tefal', Decimal('4.99')
+        product.save()
+        self.assertFacetsCurrent()
+        self.assertIn(('Tefal', Decimal(0), 2), self.facet_rows())
+        Product.objects.get(name='Philips 1200').delete()
+        self.assertFacetsCurrent()
+        adjust_prices(Product.objects.filter(producer='Bosch'), Decimal(200))
+        self.assertFacetsCurrent()
+        self.assertIn(('Bosch', Decimal(25), 1), self.facet_rows())
+
+    def test_facet_counts(self):
+        generation = 1
+        facets = catalog_facets(generation, 'Bosch')
+        self.assertEqual(facets['total'], 3)
+        self.assertEqual([(facet['from'], facet['count']) for facet in facets['prices']],
+                         [(Decimal(0), 1), (Decimal(25), 2)])
+        facets = catalog_facets(generation, price_from=Decimal(0))
+        self.assertEqual(facets['total'], 2)
+        self.assertEqual([(facet['value'], facet['count']) for facet in facets['producers']],
+                         [('Bosch', 1), ('Tefal', 1)])
+        self.assertEqual(catalog_facets(generation, 'Nobody')['total'], 0)
+
+    def test_filtered_list_view(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('products_list'), {'producer': 'Bosch', 'price': '25'})
+        self.assertEqual([product.name for product in response.context['products']], ['Bosch 30', 'Bosch 30.50'])
+        self.assertContains(response, '2 <span>products</span>')
+        self.assertEqual(len(queries), 2)
+        self.assertFalse([query for query in queries if 'GROUP BY' in query['sql'] or 'COUNT(' in query['sql']])
+        response = self.client.get(reverse('products_list'), {'price': '50'})
+        self.assertEqual([product.name for product in response.context['products']], ['Philips 60'])
+        # an unknown range is no filter
+        response = self.client.get(reverse('products_list'), {'price': 'sNaN'})
+        self.assertContains(response, '6 <span>products</span>')
+
+    def test_cursor_keeps_filters(self):
+        for i in range(12):
+            Product.objects.create(name='Bosch extra {:02d}'.format(i), producer='Bosch', description='Item',
+                                   price=20, image='media/images/test_image.jpg')
+        response = self.client.get(reverse('products_list'), {'producer': 'Bosch'})
+        self.assertContains(response, '15 <span>products</span>')
+        self.assertContains(response, '?producer=Bosch&amp;cursor=')
+        response = self.client.get(reverse('products_list'), {'producer': 'Bosch',
+                                                              'cursor': response.context['products'].next_cursor})
+        self.assertEqual(len(response.context['products']), 3)
+        self.assertTrue(all(product.producer == 'Bosch' for product in response.context['products']))
+
+    def test_refresh_command(self):
+        ProductFacet.objects.all().delete()
+        out = StringIO()
+        call_command('refresh_facets', stdout=out)
+        self.assertIn('Counted 5 facet row(s)', out.getvalue())
+
+    def test_refresh_command_moves_products_to_new_ranges(self):
+        with self.settings(CATALOG_PRICE_BUCKETS=(0, 100)):
+            call_command('refresh_facets', stdout=StringIO())
+            self.assertEqual(self.facet_rows(), [('Bosch', Decimal(0), 3), ('Philips', Decimal(0), 1),
+                                                 ('Philips', Decimal(100), 1), ('Tefal', Decimal(0), 1)])
+            response = self.client.get(reverse('products_list'), {'price': '100'})
+            self.assertEqual([product.name for product in response.context['products']], ['Philips 1200'])
+
+
+class SessionlessCatalogTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Kettle', producer='Bosch', description='Electric', price=10,
+                                             image='media/images/test_image.jpg')
+        cls.user = User.objects.create_user(username='buyer', password='test')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_reads_skip_session_and_csrf(self):
+        for url in (reverse('products_list'), reverse('product_detail', args=[self.product.slug]),
+                    reverse('search') + '?phrase=kettle'):
+            response = self.client.get(url)
+            self.assertContains(response, 'Kettle')
+            self.assertFalse(response.wsgi_request.session.accessed)
+            self.assertFalse(response.cookies)
+            self.assertIn('public', response['Cache-Control'])
+            self.assertIn('Cookie', response['Vary'])
+        self.assertNotContains(response, 'csrfmiddlewaretoken')
+
+    def test_logged_in_pages_are_personal(self):
+        self.client.login(username='buyer', password='test')
+        response = self.client.get(reverse('products_list'))
+        self.assertContains(response, 'Hello buyer')
+        self.assertFalse(response.has_header('ETag'))
+        response = self.client.get(reverse('log_in'))
+        self.assertContains(response, 'csrfmiddlewaretoken')
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookie_sessions(self):
+        self.assertTrue(self.client.login(username='buyer', password='test'))
+        self.assertContains(self.client.get(reverse('cart')), 'Hello buyer')
+        self.assertFalse(Session.objects.exists())
+        out = StringIO()
+        call_command('purge_sessions', stdout=out)
+        self.assertIn('keeps no sessions in the database', out.getvalue())
+
+    def test_cached_sessions_need_a_shared_cache(self):
+        with mock.patch.dict(os.environ, {'SESSION_BACKEND': 'cached_db', 'WEB_CONCURRENCY': '1'}):
+            os.environ.pop('CACHE_BACKEND', None)
+            # one process can keep them in its local cache
+            self.assertEqual(runpy.run_path(SETTINGS_PATH)['SESSION_ENGINE'],
+                             'django.contrib.sessions.backends.cached_db')
+            os.environ['WEB_CONCURRENCY'] = '4'
+            with self.assertRaisesMessage(ImproperlyConfigured, 'needs a shared CACHE_BACKEND'):
+                runpy.run_path(SETTINGS_PATH)
+            os.environ['CACHE_BACKEND'] = 'django.core.cache.backends.memcached.PyMemcacheCache'
+            config = runpy.run_path(SETTINGS_PATH)
+        self.assertEqual(config['SESSION_ENGINE'], 'django.contrib.sessions.backends.cached_db')
+
+    def test_purge_sessions(self):
+        for expiry in (-60, -60, -60, -60, -60, 3600):
+            session = SessionStore()
+            session['key'] = 'value'
+            session.set_expiry(expiry)
+            session.create()
+        out = StringIO()
+        call_command('purge_sessions', '--batch-size', '2', stdout=out)
+        self.assertIn('Deleted 5 expired session(s)', out.getvalue())
+        self.assertEqual(Session.objects.count(), 1)
+
+
+class ImageDerivativesTest(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.media_root, 'media/images'))
+        shutil.copy('media/images/test_image.jpg', os.path.join(self.media_root, 'media/images'))
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+    def create_products(self, count):
+        return [Product.objects.create(name='Kettle {}'.format(i), producer='Bosch', description='Electric', price=10,
+                                       image='media/images/test_image.jpg') for i in range(count)]
+
+    def derivative_files(self):
+        return sorted(os.listdir(os.path.join(self.media_root, 'media/derivatives')))
+
+    def test_derivatives_are_generated_in_background(self):
+        first, second = self.create_products(2)
+        self.assertEqual(first.image_derivatives, {})
+        self.assertEqual(run_pending_jobs(), 2)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(set(first.image_derivatives['widths']), {'100', '300', '600'})
+        self.assertEqual(first.image_derivatives, second.image_derivatives)
+        self.assertEqual(len(self.derivative_files()), 6)
+        first.save()
+        self.assertFalse(Job.objects.filter(status=Job.PENDING).exists())
+
+    def test_picture_tag(self):
+        product = self.create_products(1)[0]
+        run_pending_jobs()
+        product.refresh_from_db()
+        html = Template('{% load product_images %}{% product_picture product "300px" %}').render(
+            Context({'product': product}))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('_300.webp 300w', html)
+        self.assertIn('_100.jpg 100w', html)
+
+    def test_small_transparent_source(self):
+        image = Image.new('RGBA', (200, 100), (0, 0, 0, 0))
+        image.paste((200, 0, 0, 255), (0, 0, 50, 100))
+        image.save(os.path.join(self.media_root, 'media/images/logo.png'))
+        product = Product.objects.create(name='Logo', producer='Bosch', description='Sticker', price=10,
+                                         image='media/images/logo.png')
+        run_pending_jobs()
+        product.refresh_from_db()
+        # 300 and 600 would be upscaled, the source width stands in for them
+        self.assertEqual(set(product.image_derivatives['widths']), {'100', '200'})
+        with Image.open(os.path.join(self.media_root, product.image_derivatives['widths']['200']['jpeg'])) as jpeg:
+            self.assertEqual(jpeg.size, (200, 100))
+            self.assertTrue(all(channel > 245 for channel in jpeg.getpixel((150, 50))))
+            self.assertGreater(jpeg.getpixel((20, 50))[0], 150)
+
+    def test_backfill_command(self):
+        products = self.create_products(3)
+        call_command('generate_image_derivatives', workers=2, stdout=open(os.devnull, 'w'))
+        for product in products:
+            product.refresh_from_db()
+            self.assertIn('600', product.image_derivatives['widths'])
+        self.assertEqual(len(self.derivative_files()), 6)
+
+
+class ProductImportExportTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def test_import_upserts_by_slug(self):
+        path = self.write('products.csv', 'name,producer,description,price,image\n'
+                                          'Kettle,Bosch,Electric,10.5,media/images/test_image.jpg\n'
+                                          'Toaster,Philips,Two slots,20,media/images/test_image.jpg\n'
+                                          'Broken,Philips,No price,,media/images/test_image.jpg\n')
+        out, err = StringIO(), StringIO()
+        call_command('import_products', path, batch_size=1, stdout=out, stderr=err)
+        self.assertIn('2 created, 0 updated, 1 invalid', out.getvalue())
+        self.assertIn('Row 3', err.getvalue())
+        self.assertEqual(Product.objects.get(slug='bosch-kettle').price, 10.5)
+        self.assertEqual(list(search_products('toaster').values_list('slug', flat=True)), ['philips-toaster'])
+        self.assertEqual(Job.objects.filter(name=GENERATE_IMAGE_DERIVATIVES).count(), 2)
+
+        path = self.write('products.jsonl', '{"name": "Kettle", "producer": "Bosch", "description": "Steel", '
+                                            '"price": 12, "image": "media/images/test_image.jpg"}\n')
+        out = StringIO()
+        call_command('import_products', path, stdout=out)
+        self.assertIn('0 created, 1 updated', out.getvalue())
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(Product.objects.get(slug='bosch-kettle').description, 'Steel')
+
+    def test_import_matches_producer_and_name(self):
+        for price in (10, 20):
+            Product.objects.create(name='Kettle', producer='Bosch', description='Electric', price=price,
+                                   image='media/images/test_image.jpg')
+        path = self.write('products.csv', 'name,producer,description,price,image\n'
+                                          'Kettle 2,Bosch,Bigger,30,media/images/test_image.jpg\n'
+                                          'Kettle,Bosch,Which one,40,media/images/test_image.jpg\n')
+        out, err = StringIO(), StringIO()
+        call_command('import_products', path, stdout=out, stderr=err)
+        # the suffixed slug of the second Kettle is no match for "Kettle 2"
+        self.assertIn('2 row(s): 1 created, 0 updated, 1 invalid', out.getvalue())
+        self.assertIn("Row 2: {'__all__': [{'message': '2 products are named Kettle by Bosch", err.getvalue())
+        self.assertEqual(sorted(Product.objects.values_list('name', 'slug', 'price')),
+                         [('Kettle', 'bosch-kettle', Decimal(10)), ('Kettle', 'bosch-kettle-2', Decimal(20)),
+                          ('Kettle 2', 'bosch-kettle-2-2', Decimal(30))])
+        path = self.write('products.csv', 'name,producer,description,price,image,slug\n'
+                                          'Kettle,Bosch,Steel,25,media/images/test_image.jpg,bosch-kettle-2\n')
+        out = StringIO()
+        call_command('import_products', path, stdout=out)
+        self.assertIn('0 created, 1 updated, 0 invalid', out.getvalue())
+        self.assertEqual(Product.objects.get(slug='bosch-kettle-2').price, 25)
+
+    def test_duplicate_rows_are_reported(self):
+        path = self.write('products.csv', 'name,producer,description,price,image\n'
+                                          'Kettle,Bosch,Electric,10,media/images/test_image.jpg\n'
+                                          'Toaster,Philips,Two slots,20,media/images/test_image.jpg\n'
+                                          'Kettle,Bosch,Steel,12,media/images/test_image.jpg\n')
+        out, err = StringIO(), StringIO()
+        call_command('import_products', path, batch_size=1, stdout=out, stderr=err)
+        self.assertIn('3 row(s): 2 created, 0 updated, 1 invalid', out.getvalue())
+        self.assertIn("Row 3: {'__all__': [{'message': 'Same product as row 1', 'code': 'duplicate'}]}", err.getvalue())
+        self.assertEqual(Product.objects.get(slug='bosch-kettle').price, 10)
+
+    def test_malformed_json_lines(self):
+        path = self.write('products.jsonl', '{"name": "Kettle", "producer": "Bosch", "description": "Steel", '
+                                            '"price": 12, "image": "media/images/test_image.jpg"}\n'
+                                            '{"name": "Toaster", "producer": \n'
+                                            '["not", "an", "object"]\n'
+                                            '{"name": "Toaster", "producer": "Philips", "description": "Two slots", '
+                                            '"price": 20, "image": "media/images/test_image.jpg"}\n')
+        out, err = StringIO(), StringIO()
+        call_command('import_products', path, batch_size=1, stdout=out, stderr=err)
+        self.assertIn('4 row(s): 2 created, 0 updated, 2 invalid', out.getvalue())
+        self.assertIn('Row 2: {\'__all__\': [{\'message\': \'Invalid JSON', err.getvalue())
+        self.assertIn('Row 3: {\'__all__\': [{\'message\': \'Expected a JSON object', err.getvalue())
+        # the refresh after the last batch still ran
+        self.assertEqual(list(search_products('toaster').values_list('slug', flat=True)), ['philips-toaster'])
+
+    def test_export_round_trip(self):
+        Product.objects.create(name='Kettle', producer='Bosch', description='Electric', price=10,
+                               image='media/images/test_image.jpg')
+        path = os.path.join(self.directory, 'export.jsonl')
+        call_command('export_products', path, chunk_size=1, stderr=StringIO())
+        with open(path) as file:
+            rows = [json.loads(line) for line in file]
+        self.assertEqual(rows, [{'name': 'Kettle', 'producer': 'Bosch', 'description': 'Electric', 'price': '10.00',
+                                 'image': 'media/images/test_image.jpg', 'slug': 'bosch-kettle'}])
+
+
+class RenderInvoicesCommandTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        create_client_address(cls.user)
+        product = Product.objects.create(name='Kettle', producer='Bosch', description='Electric', price=10,
+                                         image='media/images/test_image.jpg')
+        for day in (1, 2, 3):
+            add_to_cart(cls.user, product)
+            order = checkout(cls.user)
+            Order.objects.filter(pk=order.pk).update(ordered_time=timezone.make_aware(
+                datetime.datetime(2026, 1, day, 12)))
+
+    def setUp(self):
+        self.invoices_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.invoices_dir)
+        override = override_settings(INVOICE_STORAGE_OPTIONS={'location': self.invoices_dir})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.checkpoint = os.path.join(self.invoices_dir, 'checkpoint')
+
+    def test_render_date_range_and_resume(self):
+        out = StringIO()
+        call_command('render_invoices', since=datetime.date(2026, 1, 2), workers=2, chunk_size=1,
+                     checkpoint=self.checkpoint, stdout=out)
+        self.assertIn('2/2 rendered', out.getvalue())
+        rendered = Order.objects.exclude(invoice_hash='').order_by('ordered_time')
+        self.assertEqual([order.ordered_time.day for order in rendered], [2, 3])
+        out = StringIO()
+        call_command('render_invoices', since=datetime.date(2026, 1, 2), resume=True, checkpoint=self.checkpoint,
+                     stdout=out)
+        self.assertIn('0 invoice(s) to render', out.getvalue())
+        # the checkpoint's id would skip the first day of a wider range
+        with self.assertRaisesMessage(CommandError, 'run with the same --since and --until'):
+            call_command('render_invoices', resume=True, checkpoint=self.checkpoint, stdout=StringIO())
+        with open(self.checkpoint, 'w') as checkpoint:
+            checkpoint.write('3')
+        with self.assertRaisesMessage(CommandError, 'is no render_invoices checkpoint'):
+            call_command('render_invoices', resume=True, checkpoint=self.checkpoint, stdout=StringIO())
+
+
+class ProductAdminTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='test')
+        cls.kettle = Product.objects.create(name='Kettle', producer='Bosch', description='Electric', price=10,
+                                            image='media/images/kettle.jpg')
+        cls.toaster = Product.objects.create(name='Toaster', producer='Philips', description='Electric', price=25,
+                                             image='media/images/test_image.jpg')
+        for number in range(20):
+            user = User.objects.create(username='client_{}'.format(number))
+            ClientAdress.objects.create(client=user, name='Name', surname='Surname {}'.format(number), street='Street',
+                                        zip_code='00-000', city='City', street_number='1', apartment_number='2',
+                                        tax_number=1000 + number)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+        self.media_root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.media_root, 'media/images'))
+        for name in ('kettle.jpg', 'test_image.jpg'):
+            shutil.copy('media/images/test_image.jpg', os.path.join(self.media_root, 'media/images', name))
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+    def action(self, action, products, **data):
+        return self.client.post(reverse('admin:products_product_changelist'), dict(
+            data, action=action, _selected_action=[product.pk for product in products]))
+
+    def test_change_lists(self):
+        # session, user, statistics, count and the page; the addresses' users come with the page
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('admin:products_clientadress_changelist'))
+        self.assertContains(response, 'Client address client_19')
+        response = self.client.get(reverse('admin:products_clientadress_changelist'), {'q': 'Surname 3'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        response = self.client.get(reverse('admin:products_clientadress_changelist'), {'q': '1007'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        response = self.client.get(reverse('admin:products_product_changelist'), {'q': 'toast'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.toaster])
+
+    def test_adjust_prices(self):
+        add_to_cart(self.admin, self.kettle)
+        add_to_cart(self.admin, self.toaster)
+        response = self.action('adjust_prices', [self.kettle, self.toaster])
+        self.assertContains(response, 'name="percentage"')
+        with CaptureQueriesContext(connection) as captured:
+            self.action('adjust_prices', [self.kettle, self.toaster], percentage='-12.5', apply='1')
+        # one for the prices and one for the price ranges they moved to
+        self.assertEqual(len([query for query in captured if query['sql'].startswith('UPDATE "products_product"')]), 2)
+        self.assertEqual(sorted(Product.objects.values_list('price', flat=True)), [Decimal('8.75'), Decimal('21.88')])
+        self.assertEqual(get_open_order(self.admin).value, Decimal('30.63'))
+
+    def test_delete_products(self):
+        response = self.client.get(reverse('admin:products_product_changelist'))
+        actions = dict(response.context['action_form'].fields['action'].choices)
+        self.assertIn('delete_products', actions)
+        self.assertNotIn('delete_selected', actions)
+        user = create_user()
+        add_to_cart(user, self.kettle)
+        add_to_cart(user, self.toaster)
+        placed = checkout(user)
+        rollup_sales()
+        compute_related_products()
+        add_to_cart(self.admin, self.kettle)
+        add_to_cart(self.admin, self.toaster)
+        other = Product.objects.create(name='Mixer', producer='Bosch', description='Electric', price=5,
+                                       image='media/images/test_image.jpg')
+        response = self.action('delete_products', [self.kettle, self.toaster])
+        self.assertContains(response, 'Delete products: 2 Products')
+        deleted = []
+
+        def collect(sender, instance, **kwargs):
+            deleted.append(instance.pk)
+        # the collector sends the delete signals, receivers outside the app still see every product
+        post_delete.connect(collect, sender=Product)
+        self.addCleanup(post_delete.disconnect, collect, sender=Product)
+        with CaptureQueriesContext(connection) as captured, self.captureOnCommitCallbacks(execute=True):
+            self.action('delete_products', [self.kettle, self.toaster], apply='1')
+        deletes = [query for query in captured if query['sql'].startswith('DELETE FROM "products_product"')]
+        self.assertEqual(len(deletes), 1)
+        self.assertEqual(sorted(deleted), sorted([self.kettle.pk, self.toaster.pk]))
+        self.assertEqual(list(Product.objects.all()), [other])
+        self.assertFalse(placed.products.exists())
+        self.assertEqual(get_open_order(self.admin).value, Decimal('0.00'))
+        self.assertEqual(DailySales.objects.filter(product__isnull=True).count(), 2)
+        self.assertFalse(RelatedProduct.objects.exists())
+        self.assertEqual(search_products('kettle').count(), 0)
+        # the toaster's image is still shown by the mixer
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'media/images')), ['test_image.jpg'])
+
+    @skipUnless(connection.vendor == 'sqlite', 'statistics are read from sqlite_stat1')
+    def test_estimated_count(self):
+        paginator = EstimatedCountPaginator(Product.objects.order_by('id'), 10)
+        self.assertIsNone(estimated_row_count(Product))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(estimated_row_count(Product), 2)
+        with override_settings(ADMIN_COUNT_ESTIMATE_THRESHOLD=2):
+            Product.objects.create(name='Mixer', producer='Bosch', description='Electric', price=5,
+                                   image='media/images/test_image.jpg')
+            # unfiltered it trusts the statistics, filtered it counts
+            self.assertEqual(paginator.count, 2)
+            filtered = EstimatedCountPaginator(Product.objects.filter(producer='Bosch').order_by('id'), 10)
+            self.assertEqual(filtered.count, 2)
+
+
+@override_settings(PROFILING_ENABLED=True)
+class ProfilingMiddlewareTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_superuser(username='super_user', email='test_user_email@email.com')
+        cls.staff.set_password('test')
+        cls.staff.save()
+        Product.objects.create(name='Kettle', producer='Bosch', description='Electric', price=10,
+                               image='media/images/test_image.jpg')
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+
+    def test_view_stats(self):
+        self.client.get(reverse('products_list'))
+        self.client.get(reverse('products_list'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.login(username='super_user', password='test')
+        stats = self.client.get(reverse('metrics'), {'format': 'json'}).json()
+        self.assertEqual(stats['products_list']['requests'], 2)
+        self.assertGreater(stats['products_list']['mean_queries'], 0)
+        self.assertGreater(stats['products_list']['template_ms'], 0)
+        self.assertGreater(stats['products_list']['response_bytes'], 0)
+        response = self.client.get(reverse('metrics'))
+        self.assertContains(response, 'shop_view_duration_seconds_count{view="products_list"} 2')
+        self.assertContains(response, 'shop_view_queries_bucket{view="products_list",le="+Inf"} 2')
+
+    def test_disabled_by_default(self):
+        with override_settings(PROFILING_ENABLED=False):
+            with self.assertRaises(MiddlewareNotUsed):
+                ProfilingMiddleware(lambda request: HttpResponse())
+        with mock.patch.dict(os.environ):
+            os.environ.pop('PROFILING_ENABLED', None)
+            self.assertFalse(runpy.run_path(SETTINGS_PATH)['PROFILING_ENABLED'])
+
+    def test_overlapping_requests_are_counted_apart(self):
+        # both views run their queries on the one thread and connection sync_to_async shares, interleaved
+        async def view(request):
+            for _ in range(request.queries):
+                await sync_to_async(Product.objects.exists)()
+                await asyncio.sleep(0)
+            return HttpResponse()
+
+        async def overlap(middleware, requests):
+            await asyncio.gather(*(middleware(request) for request in requests))
+
+        requests = []
+        for name, queries in (('two_queries', 2), ('five_queries', 5)):
+            request = RequestFactory().get('/')
+            request.queries, request.resolver_match = queries, mock.Mock(view_name=name)
+            requests.append(request)
+        with mock.patch.object(registry, 'record') as record:
+            async_to_sync(overlap)(ProfilingMiddleware(view), requests)
+        counts = {call.args[0]: call.args[1].query_count for call in record.call_args_list}
+        self.assertEqual(counts, {'two_queries': 2, 'five_queries': 5})
+
+    def test_repeated_statements(self):
+        profile = RequestProfile()
+        with connection.execute_wrapper(profile):
+            for product in Product.objects.all():
+                for _ in range(5):
+                    Product.objects.filter(pk=product.pk).exists()
+        self.assertEqual(profile.query_count, 6)
+        self.assertEqual(len(profile.repeated_statements(5)), 1)
+
+
+class SalesReportTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        cls.user.set_password('test')
+        cls.user.save()
+        cls.staff = User.objects.create_user('staff', password='test', is_staff=True)
+        cls.kettle = Product.objects.create(name='Kettle', producer='Bosch', description='Electric', price=10,
+                                            image='media/images/test_image.jpg')
+        cls.toaster = Product.objects.create(name='Toaster', producer='Philips', description='Electric', price=25,
+                                             image='media/images/test_image.jpg')
+
+    def setUp(self):
+        cache.clear()
+
+    def place_order(self, products, days_ago=0):
+        for product in products:
+            add_to_cart(self.user, product)
+        order = checkout(self.user)
+        Order.objects.filter(pk=order.pk).update(ordered_time=timezone.now() - datetime.timedelta(days=days_ago))
+        return order
+
+    def test_incremental_rollup(self):
+        self.place_order([self.kettle, self.kettle, self.toaster], days_ago=2)
+        self.place_order([self.kettle], days_ago=1)
+        out = StringIO()
+        call_command('rollup_sales', stdout=out)
+        self.assertIn('Rolled up 3 row(s)', out.getvalue())
+        two_days_ago = timezone.localdate() - datetime.timedelta(days=2)
+        self.assertEqual(DailySales.objects.get(day=two_days_ago, product=self.kettle).quantity, 2)
+        self.assertEqual(DailySales.objects.get(day=two_days_ago, product=self.toaster).revenue, Decimal('25.00'))
+        self.place_order([self.toaster])
+        since, count = rollup_sales()
+        # only the last rolled up day and the days after it are recomputed
+        self.assertEqual(since, timezone.localdate() - datetime.timedelta(days=1))
+        self.assertEqual(count, 2)
+        self.assertEqual(DailySales.objects.count(), 4)
+        report = sales_report(7)
+        self.assertEqual(report['total'], {'units': 5, 'sales': Decimal('80.00')})
+        self.assertEqual([row['units'] for row in report['per_day']], [3, 1, 1])
+        self.assertEqual(report['top_products'][0]['product_name'], 'Toaster')
+        self.assertEqual([row['producer'] for row in report['per_producer']], ['Philips', 'Bosch'])
+
+    def test_repricing_keeps_past_revenue(self):
+        orders = [self.place_order([self.kettle, self.toaster], days_ago=1), self.place_order([self.kettle])]
+        rollup_sales()
+        Product.objects.update(price=Decimal('99.00'))
+        rollup_sales()
+        call_command('rollup_sales', '--rebuild', stdout=StringIO())
+        self.assertEqual(DailySales.objects.aggregate(sales=Sum('revenue'))['sales'], Decimal('45.00'))
+        self.assertEqual(sum(Order.objects.get(pk=order.pk).value for order in orders), Decimal('45.00'))
+
+    def test_dashboard(self):
+        self.place_order([self.kettle])
+        rollup_sales()
+        self.client.login(username='test_user', password='test')
+        self.assertEqual(self.client.get(reverse('sales_dashboard')).status_code, 403)
+        self.client.login(username='staff', password='test')
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('sales_dashboard'), {'days': 7})
+        self.assertContains(response, 'Bosch')
+        self.assertContains(response, '£10.00')
+
+    def test_order_history(self):
+        for _ in range(12):
+            self.place_order([self.kettle, self.toaster])
+        self.client.login(username='test_user', password='test')
+        # session, user, cart badge, count, orders, their lines and the lines' products
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('order_history'))
+        self.assertEqual(len(response.context['orders']), 10)
+        self.assertContains(response, 'Toaster', count=10)
+        response = self.client.get(reverse('order_history'), {'page': 2})
+        self.assertEqual(len(response.context['orders']), 2)
+
+
+class RelatedProductsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        cls.kettle, cls.toaster, cls.mixer, cls.blender, cls.grill = [
+            Product.objects.create(name=name, producer=producer, description='Electric', price=10,
+                                   image='media/images/test_image.jpg')
+            for name, producer in (('Kettle', 'Bosch'), ('Toaster', 'Philips'), ('Mixer', 'Bosch'),
+                                   ('Blender', 'Tefal'), ('Grill', 'Bosch'))]
+
+    def setUp(self):
+        cache.clear()
+
+    def place_order(self, products):
+        for product in products:
+            add_to_cart(self.user, product)
+        return checkout(self.user)
+
+    def test_compute_and_show(self):
+        self.place_order([self.kettle, self.toaster])
+        self.place_order([self.kettle, self.toaster, self.mixer])
+        self.place_order([self.kettle, self.mixer])
+        self.place_order([self.kettle, self.blender])
+        self.place_order([self.grill])
+        # the open cart is no purchase
+        add_to_cart(self.user, self.kettle)
+        add_to_cart(self.user, self.grill)
+        out = StringIO()
+        call_command('compute_related_products', '--limit', '2', '--chunk-size', '2', stdout=out)
+        self.assertIn('Read 5 order(s)', out.getvalue())
+        self.assertIn('stored 7 related product(s) for 4 product(s)', out.getvalue())
+        self.assertEqual(list(bought_together(self.kettle)), [self.toaster, self.mixer])
+        self.assertEqual(list(bought_together(self.mixer)), [self.kettle, self.toaster])
+        self.assertEqual(list(bought_together(self.grill)), [])
+        self.assertEqual(list(same_producer(self.kettle)), [self.grill, self.mixer])
+        # the product, its producer's other products and the bought together list
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('product_detail', args=[self.kettle.slug]))
+        self.assertContains(response, 'Frequently bought together')
+        self.assertContains(response, 'More from Bosch')
+        self.assertContains(response, '/products/details/{}'.format(self.toaster.slug))
+        response = self.client.get(reverse('product_detail', args=[self.blender.slug]))
+        self.assertContains(response, 'Frequently bought together')
+        self.assertNotContains(response, 'More from')
+
+    def test_rerun_replaces_lists(self):
+        self.place_order([self.kettle, self.toaster])
+        compute_related_products()
+        self.kettle.delete()
+        self.assertFalse(RelatedProduct.objects.exists())
+        self.place_order([self.mixer, self.grill])
+        compute_related_products()
+        self.assertEqual(sorted(RelatedProduct.objects.values_list('product__name', 'related__name', 'orders')),
+                         [('Grill', 'Mixer', 1), ('Mixer', 'Grill', 1)])
+
+
+class OrderExportTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        cls.user.set_password('test')
+        cls.user.save()
+        create_client_address(cls.user)
+        cls.staff = User.objects.create_user('staff', password='test', is_staff=True)
+        cls.kettle = Product.objects.create(name='Kettle', producer='Bosch', description='Electric', price=10,
+                                            image='media/images/test_image.jpg')
+        cls.toaster = Product.objects.create(name='Toaster', producer='Philips', description='Electric', price=25,
+                                             image='media/images/test_image.jpg')
+        for products, days_ago in (([cls.kettle, cls.kettle, cls.toaster], 40), ([cls.toaster], 1)):
+            for product in products:
+                add_to_cart(cls.user, product)
+            order = checkout(cls.user)
+            Order.objects.filter(pk=order.pk).update(ordered_time=timezone.now() - datetime.timedelta(days=days_ago))
+        add_to_cart(cls.user, cls.kettle)
+
+    def export(self, **params):
+        self.client.login(username='staff', password='test')
+        response = self.client.get(reverse('orders_export'), params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_csv(self):
+        # lines are exported at the prices they were charged, not at today's
+        Product.objects.update(price=Decimal('99.99'))
+        response = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        # session and user before the response, the lines with their orders, buyers and products while it streams
+        with self.assertNumQueries(1):
+            rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], list(HEADERS))
+        # the open cart is not exported
+        self.assertEqual([(row[16], row[18], row[19], row[-1]) for row in rows[1:]],
+                         [('Kettle', '2', '10.00', '20.00'), ('Toaster', '1', '25.00', '25.00'),
+                          ('Toaster', '1', '25.00', '25.00')])
+        self.assertEqual(rows[1][3], '45.00')
+        self.assertEqual(sum(Decimal(row[-1]) for row in rows[1:3]), Decimal(rows[1][3]))
+        self.assertEqual(rows[1][7], 'test company')
+
+    def test_date_filters(self):
+        since = timezone.localdate() - datetime.timedelta(days=7)
+        response = self.export(since=since.isoformat())
+        self.assertIn('orders_{}_now.csv'.format(since), response['Content-Disposition'])
+        self.assertEqual(len(list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))), 2)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'orders.csv')
+            err = StringIO()
+            call_command('export_orders', path, '--until', since.isoformat(), stderr=err)
+            with open(path, newline='') as file:
+                self.assertEqual(len(list(csv.reader(file))), 3)
+        self.assertIn('Exported 2 order line(s)', err.getvalue())
+        response = self.client.get(reverse('orders_export'), {'since': '2021-02-01', 'until': '2021-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_staff_only(self):
+        self.client.login(username='test_user', password='test')
+        self.assertEqual(self.client.get(reverse('orders_export')).status_code, 403)
+
+    @skipUnless(xlsxwriter, 'XlsxWriter is not installed')
+    def test_xlsx(self):
+        response = self.export(format='xlsx')
+        self.assertIn('.xlsx', response['Content-Disposition'])
+        self.assertEqual(b''.join(response.streaming_content)[:2], b'PK')
+
+    def test_memory_stays_bounded(self):
+        orders = 2000
+        product_ids = [Product.objects.create(name='Item {}'.format(number), producer='Producer', description='',
+                                              price=number, image='media/images/test_image.jpg').id
+                       for number in range(10)]
+        placed = timezone.now()
+        Order.objects.bulk_create([Order(user=self.user, ordered=True, ordered_time=placed, value=45)
+                                   for _ in range(orders)])
+        OrderProduct.objects.bulk_create([OrderProduct(user=self.user, product_id=product_id, ordered=True,
+                                                       unit_price=number)
+                                          for _ in range(orders) for number, product_id in enumerate(product_ids)])
+        order_ids = Order.objects.filter(ordered_time=placed).order_by('id').values_list('id', flat=True)
+        line_ids = OrderProduct.objects.filter(product_id__in=product_ids).order_by('id').values_list('id', flat=True)
+        Order.products.through.objects.bulk_create([
+            Order.products.through(order_id=order_id, orderproduct_id=line_id)
+            for order_id, line_id in zip((order_id for order_id in order_ids for _ in product_ids), line_ids)])
+        peaks, sizes = [], []
+        for lines in (2000, 20000):
+            tracemalloc.start()
+            try:
+                rows = itertools.islice(order_rows(chunk_size=500), lines)
+                sizes.append(sum(len(chunk) for chunk in csv_chunks(rows)))
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+        # ten times the lines, but the export only ever holds a chunk of rows and a block of text
+        self.assertGreater(sizes[1], 9 * sizes[0])
+        self.assertLess(peaks[1], peaks[0] * 1.5)
+        self.assertLess(peaks[1], sizes[1] / 2)
+
+
+# Every hot lookup has to be answered from an index, and list pages read the index in order without sorting
+@skipUnless(connection.vendor == 'sqlite', 'plans are checked with SQLite EXPLAIN QUERY PLAN')
+class QueryPlanTest(TestCase):
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertRegex(plan, r'(SEARCH|SCAN) \S+ USING (COVERING )?INDEX {}\b'.format(index))
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_hot_queries(self):
+        self.assertUsesIndex(Product.objects.filter(slug='bosch-kettle'), 'sqlite_autoindex_products_product_1')
+        self.assertUsesIndex(Order.objects.filter(user_id=1, ordered=False), 'one_open_order_per_user')
+        self.assertUsesIndex(Order.objects.filter(user_id=1, ordered=True).order_by('-ordered_time'),
+                             'order_user_placed_idx')
+        self.assertUsesIndex(OrderProduct.objects.filter(user_id=1, product_id=1, ordered=False),
+                             'orderproduct_user_product_idx')
+        self.assertUsesIndex(Product.objects.order_by('name', 'id')[:13], 'product_name_id_idx')
+        addresses = ClientAdress.objects.filter(Q(client__in=User.objects.filter(username='x').values('pk')) |
+                                                Q(surname='x') | Q(tax_number=1))
+        plan = addresses.explain()
+        self.assertIn('MULTI-INDEX OR', plan)
+        self.assertIn('clientadress_surname_idx', plan)
+        self.assertIn('clientadress_tax_number_idx', plan)
+        self.assertNotRegex(plan, r'SCAN (TABLE )?products_clientadress\b')
+        # the export walks the placed orders in time order, only the lines of one order are sorted
+        plan = order_lines(since=timezone.localdate()).explain()
+        self.assertIn('USING INDEX order_placed_time_idx', plan)
+        self.assertNotIn('TEMP B-TREE FOR ORDER BY', plan)
+        seek = Product.objects.filter(Q(name__gt='Kettle') | Q(name='Kettle', id__gt=1)).order_by('name', 'id')
+        self.assertUsesIndex(seek[:13], 'product_name_id_idx')
+        self.assertUsesIndex(bought_together(Product(pk=1)), 'sqlite_autoindex_products_relatedproduct_1')
+        self.assertUsesIndex(same_producer(Product(pk=1, producer='Bosch')), 'product_producer_name_idx')
+        # catalog filters read a page in name order without sorting the filtered products
+        self.assertUsesIndex(filter_products(Product.objects.all(), 'Bosch').order_by('name', 'id')[:13],
+                             'product_producer_name_idx')
+        self.assertUsesIndex(filter_products(Product.objects.all(), 'Bosch', Decimal(25)).order_by('name', 'id')[:13],
+                             'product_producer_bucket_idx')
+        self.assertUsesIndex(filter_products(Product.objects.all(), price_from=Decimal(25)).order_by('name', 'id')[:13],
+                             'product_bucket_name_idx')
+
+    def test_one_open_order_per_user(self):
+        user = create_user()
+        Order.objects.create(user=user)
+        Order.objects.create(user=user, ordered=True)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Order.objects.create(user=user)
+
+
+class CatalogApiTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for index in range(5):
+            Product.objects.create(name='Kettle {}'.format(index), producer='Bosch', description='Electric',
+                                   price=10 + index, image='media/images/test_image.jpg')
+
+    def setUp(self):
+        cache.clear()
+
+    def get_json(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_list_pages_and_fields(self):
+        data = self.get_json(reverse('api_products_list'), limit=2, fields='name,price')
+        self.assertEqual(data['results'], [{'name': 'Kettle 0', 'price': '10.00'},
+                                           {'name': 'Kettle 1', 'price': '11.00'}])
+        self.assertIsNone(data['previous'])
+        names = [item['name'] for item in data['results']]
+        while data['next']:
+            data = self.get_json(reverse('api_products_list'), limit=2, fields='name', cursor=data['next'])
+            names += [item['name'] for item in data['results']]
+        self.assertEqual(names, ['Kettle {}'.format(index) for index in range(5)])
+        item = self.get_json(reverse('api_products_list'), limit=1)['results'][0]
+        self.assertEqual(set(item), {'slug', 'name', 'producer', 'price', 'image'})
+        self.assertTrue(item['image'].endswith('test_image.jpg'))
+
+    def test_detail_and_search(self):
+        product = Product.objects.get(name='Kettle 3')
+        data = self.get_json(reverse('api_product_detail', args=[product.slug]), fields='id,images')
+        self.assertEqual(data, {'id': product.id, 'images': {'webp': [], 'jpeg': []}})
+        self.assertEqual(self.client.get(reverse('api_product_detail', args=['missing'])).status_code, 404)
+        data = self.get_json(reverse('api_search'), q='kettle', fields='name', limit=10)
+        self.assertEqual(len(data['results']), 5)
+        self.assertEqual(self.get_json(reverse('api_search'), q='toaster')['results'], [])
+
+    def test_invalid_parameters(self):
+        for params in ({'fields': 'name,password'}, {'limit': 0}, {'limit': 'all'}):
+            response = self.client.get(reverse('api_products_list'), params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+        self.assertEqual(self.client.get(reverse('api_search')).status_code, 400)
+        self.assertEqual(self.client.post(reverse('api_products_list')).status_code, 405)
+        for url, params in ((reverse('api_products_list'), {}), (reverse('api_search'), {'q': 'kettle'})):
+            for cursor in ('not a cursor', encode_cursor(NEXT, [{}, 'x'])):
+                response = self.client.get(url, dict(params, cursor=cursor))
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'invalid cursor'})
+
+    def test_conditional_get(self):
+        response = self.client.get(reverse('api_products_list'))
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse('api_products_list'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        Product.objects.filter(name='Kettle 0').get().save()
+        response = self.client.get(reverse('api_products_list'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_gzip(self):
+        response = self.client.get(reverse('api_products_list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].startswith('W/'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+        data = json.loads(gzip.decompress(response.content))
+        self.assertEqual(len(data['results']), 5)
+        response = self.client.get(reverse('api_products_list'), HTTP_ACCEPT_ENCODING='gzip',
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    @skipUnless(api.brotli, 'brotli is not installed')
+    def test_brotli(self):
+        response = self.client.get(reverse('api_products_list'), HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        data = json.loads(api.brotli.decompress(response.content))
+        self.assertEqual(len(data['results']), 5)
+
+
+# Runs against a database file: every thread opens its own connection to it, like server workers do
+@skipUnless(connection.vendor == 'sqlite', 'SQLite specific')
+class SQLiteConcurrencyTest(SimpleTestCase):
+    users = 4
+    writers_per_user = 2
+    clicks = 10
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        database = dict(connections.databases['default'], NAME=os.path.join(directory, 'shop.sqlite3'))
+        patcher = mock.patch.dict(connections.databases, {'default': database})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def in_threads(self, targets):
+        errors = []
+
+        def run(target):
+            try:
+                target()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections.close_all()
+        threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_concurrent_cart_writers(self):
+        state = {}
+
+        def prepare():
+            call_command('migrate', verbosity=0)
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                state['journal_mode'] = cursor.fetchone()[0]
+            state['users'] = [User.objects.create_user('writer{}'.format(index)) for index in range(self.users)]
+            state['product'] = Product.objects.create(name='Kettle', producer='Bosch', description='Electric',
+                                                      price=10, image='media/images/test_image.jpg')
+        self.assertEqual(self.in_threads([prepare]), [])
+        self.assertEqual(state['journal_mode'], 'wal')
+
+        def click(user):
+            for _ in range(self.clicks):
+                add_to_cart(user, state['product'])
+        writers = [lambda user=user: click(user) for user in state['users'] for _ in range(self.writers_per_user)]
+        self.assertEqual(self.in_threads(writers), [])
+
+        def check():
+            for user in state['users']:
+                order = Order.objects.get(user=user, ordered=False)
+                self.assertEqual(order.value, 10 * self.clicks * self.writers_per_user)
+                self.assertEqual(order.products.get().quantity, self.clicks * self.writers_per_user)
+        self.assertEqual(self.in_threads([check]), [])
+
+    def test_health_check_drops_dead_connection(self):
+        state = {}
+
+        def request():
+            connection.ensure_connection()
+            with mock.patch.dict(connection.settings_dict, CONN_HEALTH_CHECKS=True), \
+                    mock.patch.object(connection, 'is_usable', return_value=False):
+                request_started.send(sender=None)
+            state['connection'] = connection.connection
+        self.assertEqual(self.in_threads([request]), [])
+        self.assertIsNone(state['connection'])
+
+
+# Pooled views run on other threads with their own connections, so the data has to be committed
+@override_settings(PROFILING_ENABLED=True)
+class ThreadPooledViewsTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        Product.objects.create(name='Kettle', producer='Bosch', description='Electric', price=10,
+                               image='media/images/test_image.jpg')
+
+    def get(self, path, headers=()):
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'headers': list(headers),
+                 'server': ('testserver', 80)}
+        communicator = ApplicationCommunicator(get_asgi_application(), scope)
+
+        async def exchange():
+            await communicator.send_input({'type': 'http.request'})
+            start = await communicator.receive_output(5)
+            body = []
+            while True:
+                message = await communicator.receive_output(5)
+                body.append(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            await communicator.wait()
+            return start['status'], b''.join(body)
+        return async_to_sync(exchange)()
+
+    def test_pooled_views(self):
+        self.assertTrue(asyncio.iscoroutinefunction(products_list))
+        self.assertFalse(asyncio.iscoroutinefunction(add_product))
+        status, body = self.get('/products/')
+        self.assertEqual(status, 200)
+        self.assertIn(b'Kettle', body)
+        status, body = self.get('/products/details/{}'.format(Product.objects.get().slug))
+        self.assertEqual(status, 200)
+        self.assertIn(b'Electric', body)
+        self.assertGreater(registry.as_json()['product_detail']['mean_queries'], 0)
+
+    def test_export(self):
+        user = User.objects.create_user('staff', password='test', is_staff=True)
+        add_to_cart(user, Product.objects.get())
+        checkout(user)
+        self.client.force_login(user)
+        cookie = 'sessionid={}'.format(self.client.cookies['sessionid'].value).encode()
+        # written to a file before it is sent, the event loop cannot read the database
+        status, body = self.get('/products/orders/export/', headers=[(b'cookie', cookie)])
+        self.assertEqual(status, 200)
+        self.assertEqual(len(list(csv.reader(StringIO(body.decode())))), 2)
+        self.assertIn('Kettle', body.decode())
+
+
+class StaticAssetsTest(SimpleTestCase):
+
+    def setUp(self):
+        source, self.root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        self.addCleanup(shutil.rmtree, self.root)
+        files = {
+            'css/site.css': '/* site */\nbody { margin: 0 ;\n  font: 12px Arial , sans-serif; }\n'
+                            ".icon { background: url('../fonts/icon.woff?v=1') }\n" * 20 +
+                            'a:after { content: "/* kept */  too"; }\n',
+            'css/fonts.css': "@import url('https://fonts.example.com/css');\nh1 { color: red; }\n",
+            'fonts/icon.woff': 'wOFF',
+            'js/first.js': 'var first = 1\n',
+            'js/second.js': '(function () { return first; })();\n',
+        }
+        for name, content in files.items():
+            os.makedirs(os.path.join(source, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(source, name), 'w') as file:
+                file.write(content)
+        override = override_settings(
+            STATICFILES_DIRS=[source], STATIC_ROOT=self.root,
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+            STATIC_BUNDLES={'site.css': ['css/site.css', 'css/fonts.css'], 'site.js': ['js/first.js', 'js/second.js']})
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def render(self, template):
+        return Template('{% load assets %}' + template).render(Context())
+
+    def test_sources_until_collected(self):
+        self.assertEqual(self.render("{% bundle 'site.js' %}"),
+                         '<script src="/static/js/first.js"></script>\n<script src="/static/js/second.js"></script>')
+
+    def test_collectstatic_builds_bundles(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.assertRegex(self.render("{% bundle 'site.css' %}"),
+                         r'^<link rel="stylesheet" type="text/css" href="/static/bundles/site\.[0-9a-f]{12}\.css">$')
+        name = staticfiles_storage.stored_name('bundles/site.css')
+        with open(os.path.join(self.root, name), 'rb') as file:
+            content = file.read()
+        css = content.decode()
+        self.assertTrue(css.startswith("@import url('https://fonts.example.com/css');\n"))
+        self.assertEqual(css.count('@import'), 1)
+        self.assertIn('body{margin:0;font:12px Arial,sans-serif;}', css)
+        self.assertIn('content:"/* kept */  too"', css)
+        self.assertNotIn('/* site */', css)
+        self.assertRegex(css, r'url\(["\']\.\./fonts/icon\.[0-9a-f]{12}\.woff\?v=1["\']\)')
+        with open(os.path.join(self.root, name + '.gz'), 'rb') as file:
+            self.assertEqual(gzip.decompress(file.read()), content)
+        if brotli is not None:
+            with open(os.path.join(self.root, name + '.br'), 'rb') as file:
+                self.assertEqual(brotli.decompress(file.read()), content)
+        with open(os.path.join(self.root, staticfiles_storage.stored_name('bundles/site.js'))) as file:
+            self.assertEqual(file.read(), 'var first = 1\n\n;\n(function () { return first; })();\n')
+
+    def test_wsgi_serving(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+        application = StaticFilesApplication(lambda environ, start_response: ['django'], root=self.root)
+        hashed = staticfiles_storage.stored_name('bundles/site.css')
+
+        def get(path, **headers):
+            environ = dict(headers, REQUEST_METHOD='GET', PATH_INFO=path)
+            response = {}
+            body = application(environ, lambda status, headers: response.update(status=status, headers=dict(headers)))
+            if body == ['django']:
+                return None, {}, b'django'
+            content = b''.join(body)
+            getattr(body, 'close', lambda: None)()
+            return response['status'], response['headers'], content
+
+        status, headers, body = get('/static/' + hashed, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Content-Type'], 'text/css')
+        self.assertEqual(int(headers['Content-Length']), len(body))
+        with open(os.path.join(self.root, hashed), 'rb') as file:
+            self.assertEqual(gzip.decompress(body), file.read())
+        status, headers, body = get('/static/css/site.css')
+        self.assertEqual(headers['Cache-Control'], 'public, max-age=3600')
+        self.assertNotIn('Content-Encoding', headers)
+        status, headers, body = get('/static/css/site.css', HTTP_IF_MODIFIED_SINCE=headers['Last-Modified'])
+        self.assertEqual(status, '304 Not Modified')
+        self.assertEqual(get('/static/../../etc/passwd')[0], '404 Not Found')
+        self.assertEqual(get('/products/')[2], b'django')
+
+
+class BenchmarkSmokeTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_scenarios(self):
+        seed_catalog(50)
+        users = seed_users(3, cart_size=2)
+        self.assertEqual(Product.objects.count(), 50)
+        self.assertEqual(ClientAdress.objects.filter(client__in=users).count(), 3)
+        for name, scenario in SCENARIOS.items():
+            result = run_client(scenario, BenchmarkContext(users), 10)
+            self.assertEqual(result['requests'], 10, name)
+            self.assertEqual(result['errors'], 0, name)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+    def test_autocomplete(self):
+        result = run_autocomplete(500, 50)
+        self.assertTrue(result['word_matches'])
+        self.assertGreater(result['results_per_query'], 0)
+        self.assertLessEqual(result['p50_us'], result['p99_us'])
@@ -8,3 +8,4 @@ def delete_test_image():
              and i.startswith('test_image_')]
     for file in files:
         os.remove(os.path.join(images_path, file))
+
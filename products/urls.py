@@ -1,8 +1,10 @@
 from django.urls import path
 
 
+from . import api
 from .views import add_product, add_product_to_cart, cart, confirm_order, confirm_product_deletion, delete_product, \
-    edit_product, log_in, log_out, product_detail, products_list, remove_product_from_cart, search
+    download_invoice, edit_product, log_in, log_out, order_history, orders_export, product_detail, products_list, \
+    remove_product_from_cart, resend_invoice, sales_dashboard, search
 
 urlpatterns = [
     path('log_in/', log_in, name='log_in'),
@@ -18,4 +20,13 @@ urlpatterns = [
     path('add_to_cart/<slug>', add_product_to_cart, name='add_product_to_cart'),
     path('remove_from_cart/<slug>', remove_product_from_cart, name='remove_product_from_cart'),
     path('confirm_order/', confirm_order, name='confirm_order'),
+    path('invoice/<int:order_id>', download_invoice, name='download_invoice'),
+    path('invoice/<int:order_id>/resend', resend_invoice, name='resend_invoice'),
+    path('orders/', order_history, name='order_history'),
+    path('orders/export/', orders_export, name='orders_export'),
+    path('sales/', sales_dashboard, name='sales_dashboard'),
+    path('api/', api.products_list, name='api_products_list'),
+    path('api/search/', api.search, name='api_search'),
+    path('api/autocomplete/', api.autocomplete, name='api_autocomplete'),
+    path('api/<slug>', api.product_detail, name='api_product_detail'),
 ]
\ No newline at end of file
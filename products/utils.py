@@ -1,32 +1,78 @@
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import get_storage_class
 from django.core.mail import EmailMessage
 from django.template.loader import get_template, render_to_string
-
-from io import BytesIO
 from xhtml2pdf import pisa
 
 from shop.settings import DEFAULT_VENDOR
 
 
-def create_invoice(template_src, order, client):
+def get_invoice_storage():
+    return get_storage_class(settings.INVOICE_STORAGE)(**settings.INVOICE_STORAGE_OPTIONS)
+
+
+def render_invoice_html(template_src, order, client):
     products = order.products.all()
     args = {'products': products, 'order': order, 'client': client, 'vendor': DEFAULT_VENDOR}
     template = get_template(template_src)
-    html = template.render(args)
-    result = open('temp/invoices/invoice_{}.pdf'.format(order.id), 'wb')
-    pdf = pisa.pisaDocument(BytesIO(html.encode("UTF-8")), result, encoding="UTF-8")
-    result.close()
+    return template.render(args)
+
+
+# CPU-bound part of rendering, needs no database so it can run in worker processes
+def html_to_pdf(html):
+    result = BytesIO()
+    pisa.pisaDocument(BytesIO(html.encode("UTF-8")), result, encoding="UTF-8")
+    return result.getvalue()
+
+
+def render_invoice(template_src, order, client):
+    return html_to_pdf(render_invoice_html(template_src, order, client))
+
+
+# Invoices are stored under their content hash, the order keeps a reference to the current one
+def store_invoice(order, pdf):
+    storage = get_invoice_storage()
+    invoice_hash = hashlib.sha256(pdf).hexdigest()
+    name = 'order_{}/{}.pdf'.format(order.id, invoice_hash)
+    if not storage.exists(name):
+        name = storage.save(name, ContentFile(pdf))
+    order.invoice_file = name
+    order.invoice_size = len(pdf)
+    order.invoice_hash = invoice_hash
+    type(order).objects.filter(pk=order.pk).update(invoice_file=name, invoice_size=len(pdf),
+                                                   invoice_hash=invoice_hash)
+    return name
+
+
+def read_invoice(order):
+    storage = get_invoice_storage()
+    if not order.invoice_file or not storage.exists(order.invoice_file):
+        return None
+    with storage.open(order.invoice_file, 'rb') as invoice:
+        return invoice.read()
+
+
+def create_invoice(template_src, order, client):
+    pdf = read_invoice(order)
+    if pdf is None:
+        pdf = render_invoice(template_src, order, client)
+        store_invoice(order, pdf)
+    return pdf
 
 
-def send_email_with_invoice(order):
+def send_email_with_invoice(order, pdf):
     email_subject = 'Orderd confirmation - Bart Strzyga shop'
     email_body = render_to_string(
         'email/order_confirmation.txt', {
-            'payment_time': order.payment_time, 'value': order.value, 'products': order.products.all()
+            'username': order.user.username, 'payment_time': order.payment_time, 'value': order.value,
+            'products': order.products.all()
         }
     )
-    content = open('temp/invoices/invoice_{}.pdf'.format(order.id), 'rb')
-    attachments = [('invoice_{}.pdf'.format(order.id), content.read(), 'application/pdf')]
-    content.close()
+    attachments = [('invoice_{}.pdf'.format(order.id), pdf, 'application/pdf')]
     email = EmailMessage(subject=email_subject, body=email_body, from_email='kontakt@poukladana.pl',
                          to=[order.user.email], attachments=attachments)
     email.send()
@@ -1,20 +1,34 @@
+import tempfile
+
+from django.contrib import messages
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
+from django.core.handlers.asgi import ASGIRequest
 from django.core.paginator import Paginator
-from django.http import HttpResponseForbidden, HttpResponseRedirect, HttpResponseNotAllowed
-from django.middleware import csrf
-from django.shortcuts import get_object_or_404, render
-from django.utils import timezone
+from django.http import FileResponse, Http404, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseRedirect, \
+    HttpResponseNotAllowed, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.views.decorators.http import require_POST
 
-import datetime
+from shop.pooling import thread_pooled
 
-from .forms import AddProduct, LoginForm, Search
-from .models import Product, OrderProduct, Order, ClientAdress
-from .utils import create_invoice, send_email_with_invoice
+from .catalog_cache import cached_catalog_page, catalog_context, catalog_generation, conditional_anonymous_page
+from .cart import add_to_cart, checkout, get_cart_summary, remove_from_cart
+from .facets import catalog_facets, facet_query, filter_products, known_producer, parse_price_from
+from .forms import AddProduct, LoginForm, OrderExport, Search
+from .jobs import enqueue
+from .models import Product, ClientAdress, Order
+from .order_export import FORMATS as EXPORT_FORMATS, csv_chunks, order_rows, write_xlsx
+from .pagination import CursorPaginator, InvalidCursor
+from .related import bought_together, same_producer
+from .reports import sales_report
+from .search import ranked_products, search_ids
+from .tasks import SEND_INVOICE
+from .utils import get_invoice_storage
 
 
 def log_in(request):
-    args = {'csrf': csrf.get_token(request)}
+    args = {}
     if request.method == 'POST':
         form = LoginForm(request.POST)
         args['form'] = form
@@ -37,27 +51,54 @@ def log_out(request):
     return HttpResponseRedirect('/')
 
 
+def catalog_filters(request):
+    return request.GET.get('producer') or None, parse_price_from(request.GET.get('price'))
+
+
+def catalog_paginator(products, count=None):
+    return CursorPaginator(products, 12, ordering=('name', 'id'), count=count)
+
+
+# A list page is stored per filter and cursor position; a forged cursor shows the first page and shares its copy
+def catalog_page_parameters(request):
+    producer, price_from = catalog_filters(request)
+    if producer and not known_producer(catalog_generation(), producer):
+        return None
+    cursor = request.GET.get('cursor')
+    try:
+        position = catalog_paginator(Product.objects.all()).parse_cursor(cursor) if cursor else None
+    except InvalidCursor:
+        position = None
+    return [producer, price_from, position]
+
+
+@thread_pooled
+@cached_catalog_page(catalog_page_parameters)
 def products_list(request):
-    all_products = Product.objects.all().order_by('name')
-    paginator = Paginator(all_products, 12)
-    page = request.GET.get('page')
-    products = paginator.get_page(page)
-    return render(request, "categories.html", {'products': products})
+    args = catalog_context()
+    producer, price_from = catalog_filters(request)
+    facets = catalog_facets(args['catalog_generation'], producer, price_from)
+    # the count comes from the facet summary, so no request counts or groups the catalog
+    products = filter_products(Product.objects.all(), producer, price_from)
+    args['products'] = catalog_paginator(products, count=facets['total']).get_page(request.GET.get('cursor'))
+    args['facets'] = facets
+    args['filter_query'] = facet_query(producer, price_from)
+    return render(request, "categories.html", args)
 
 
+@thread_pooled
+@conditional_anonymous_page
 def search(request):
-    args = {'csrf': csrf.get_token(request)}
-    if request.method == 'POST':
-        form = Search(request.POST)
+    args = {}
+    if request.method == 'POST' or (request.method == 'GET' and 'phrase' in request.GET):
+        form = Search(request.POST if request.method == 'POST' else request.GET)
         args['form'] = form
         search_phrase = form['phrase'].value()
         if search_phrase is not None:
-            found_products = Product.objects.filter(name__icontains=search_phrase).order_by('name') \
-                       | Product.objects.filter(producer__icontains=search_phrase).order_by('name')
-            paginator = Paginator(found_products, 12)
-            page = request.GET.get('page')
-            products = paginator.get_page(page)
-            args['products'] = products
+            ids, args['truncated'] = search_ids(search_phrase)
+            paginator = CursorPaginator(ranked_products(ids), 12, ordering=('search_rank', 'id'))
+            args['products'] = paginator.get_page(request.GET.get('cursor'))
+            args['phrase'] = search_phrase
     elif request.method == 'GET':
         args['form'] = Search
     else:
@@ -65,14 +106,17 @@ def search(request):
     return render(request, 'search.html', args)
 
 
+@thread_pooled
+@cached_catalog_page()
 def product_detail(request, slug):
     product = get_object_or_404(Product, slug=slug)
-    return render(request, "single.html", {'product': product})
+    args = {'product': product, 'same_producer': same_producer(product), 'bought_together': bought_together(product)}
+    return render(request, "single.html", args)
 
 
 @login_required
 def add_product(request):
-    args = {'csrf': csrf.get_token(request)}
+    args = {}
     if request.user.is_staff and request.method == 'POST':
         form = AddProduct(request.POST, request.FILES)
         args['form'] = form
@@ -109,7 +153,7 @@ def confirm_product_deletion(request, slug):
 
 @login_required
 def edit_product(request, slug):
-    args = {'csrf': csrf.get_token(request)}
+    args = {}
     product = get_object_or_404(Product, slug=slug)
     args['product'] = product
     if request.user.is_staff and request.method == 'POST':
@@ -137,28 +181,13 @@ def edit_product(request, slug):
 def add_product_to_cart(request, slug):
     if request.user and not request.user.is_staff:
         product = get_object_or_404(Product, slug=slug)
-        order_product, created = OrderProduct.objects.get_or_create(product=product, user=request.user, ordered=False)
-        current_order = Order.objects.filter(user=request.user, ordered=False)
-        if current_order.exists():
-            order = current_order[0]
-            if order.products.filter(product__slug=product.slug).exists():
-                order_product.quantity += 1
-                order_product.save()
-            else:
-                order.products.add(order_product)
-            order.value += product.price
-            order.save()
-        else:
-            ordered_time = timezone.now()
-            order = Order.objects.create(user=request.user, ordered_time=ordered_time, ordered=False)
-            order.products.add(order_product)
-            order.value += product.price
-            order.save()
+        add_to_cart(request.user, product)
         return HttpResponseRedirect('/products/cart')  # wypelnic
     else:
         return HttpResponseForbidden()
 
 
+@thread_pooled
 @login_required
 def cart(request):
     args = {}
@@ -166,11 +195,9 @@ def cart(request):
         if request.user.is_staff:
             HttpResponseForbidden()
         else:
-            current_order = Order.objects.filter(user=request.user, ordered=False)
-            if current_order.exists():
-                args['value'] = current_order[0].value
-                ordered_products = current_order[0].products.all()
-                args['products'] = ordered_products
+            summary = get_cart_summary(request.user)
+            args['value'] = summary['value']
+            args['products'] = summary['items']
     else:
         HttpResponseForbidden()
     return render(request, "cart.html", args)
@@ -179,22 +206,8 @@ def cart(request):
 @login_required
 def remove_product_from_cart(request, slug):
     product = get_object_or_404(Product, slug=slug)
-    current_order = Order.objects.filter(user=request.user, ordered=False)
-    if current_order.exists():
-        order = current_order[0]
-        if order.products.filter(product__slug=product.slug).exists():
-            order_product = OrderProduct.objects.filter(product=product, user=request.user, ordered=False)[0]
-            if order_product.quantity > 1:
-                order_product.quantity -= 1
-                order.value -= order_product.product.price
-                order_product.save()
-                order.save()
-            else:
-                order.value -= order_product.product.price
-                order.products.remove(order_product)
-                order.save()
-            return HttpResponseRedirect('/products/cart')
-        return HttpResponseRedirect('/products/cart')
+    remove_from_cart(request.user, product)
+    return HttpResponseRedirect('/products/cart')
 
 
 @login_required
@@ -203,17 +216,79 @@ def confirm_order(request):
         if request.user.is_staff:
             HttpResponseForbidden()
         else:
-            current_order = Order.objects.filter(user=request.user, ordered=False)
-            if current_order.exists():
-                order = current_order[0]
-                order.ordered_time = timezone.now()
-                order.payment_time = order.ordered_time + datetime.timedelta(days=14)
-                order.ordered = True
-                client = get_object_or_404(ClientAdress, client=order.user)
-                create_invoice(template_src='pdf/invoice.html', order=order, client=client)
-                order.save()
-                send_email_with_invoice(order)
-                return render(request, "order_confirmed.html")
+            get_object_or_404(ClientAdress, client=request.user)
+            checkout(request.user)
     else:
         HttpResponseForbidden()
     return render(request, "order_confirmed.html")
+
+
+@login_required
+def download_invoice(request, order_id):
+    order = get_object_or_404(Order, pk=order_id, ordered=True)
+    if order.user != request.user and not request.user.is_staff:
+        return HttpResponseForbidden()
+    if not order.invoice_file:
+        raise Http404('Invoice is not ready yet')
+    storage = get_invoice_storage()
+    if not storage.exists(order.invoice_file):
+        raise Http404('Invoice is not ready yet')
+    return FileResponse(storage.open(order.invoice_file, 'rb'), as_attachment=True,
+                        filename='invoice_{}.pdf'.format(order.id), content_type='application/pdf')
+
+
+# POST only, so prefetched links, crawlers and reloads do not send the email again
+@login_required
+@require_POST
+def resend_invoice(request, order_id):
+    order = get_object_or_404(Order, pk=order_id, ordered=True)
+    if order.user != request.user and not request.user.is_staff:
+        return HttpResponseForbidden()
+    enqueue(SEND_INVOICE, order.id)
+    messages.success(request, 'The invoice for order #{} will be sent to your email again.'.format(order.id))
+    return redirect('order_history')
+
+
+@login_required
+def order_history(request):
+    orders = Order.objects.filter(user=request.user, ordered=True).order_by('-ordered_time', '-id') \
+        .prefetch_related('products__product')
+    return render(request, 'orders.html', {'orders': Paginator(orders, 10).get_page(request.GET.get('page'))})
+
+
+@login_required
+def sales_dashboard(request):
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    try:
+        days = min(max(int(request.GET.get('days', 30)), 1), 366)
+    except ValueError:
+        days = 30
+    return render(request, 'sales.html', dict(sales_report(days), export_formats=EXPORT_FORMATS))
+
+
+@login_required
+def orders_export(request):
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    form = OrderExport(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+    since, until = form.cleaned_data['since'], form.cleaned_data['until']
+    file_format = form.cleaned_data['format'] or 'csv'
+    filename = 'orders_{}_{}.{}'.format(since or 'start', until or 'now', file_format)
+    rows = order_rows(since, until)
+    # under ASGI a streamed body is sent from the event loop, where the database cannot be read
+    if file_format == 'csv' and not isinstance(request, ASGIRequest):
+        # the rows are read while the body is sent
+        response = StreamingHttpResponse(csv_chunks(rows), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+        return response
+    file = tempfile.TemporaryFile()
+    if file_format == 'xlsx':
+        write_xlsx(file, rows)
+    else:
+        for chunk in csv_chunks(rows):
+            file.write(chunk.encode())
+    file.seek(0)
+    return FileResponse(file, as_attachment=True, filename=filename)
@@ -9,8 +9,16 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shop.settings')
 
 application = get_asgi_application()
+
+if settings.AUTOCOMPLETE_PRELOAD:
+    from products.autocomplete import autocomplete_index
+
+    autocomplete_index.preload()
+
+from . import db  # noqa: E402,F401  connection health checks
@@ -0,0 +1,189 @@
+import gzip
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+from wsgiref.util import FileWrapper
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.files.base import ContentFile
+from django.utils.http import http_date, parse_http_date_safe
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+logger = logging.getLogger(__name__)
+
+BUNDLES_DIR = 'bundles'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.xml', '.ttf', '.eot', '.otf')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+CSS_TOKENS = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|/\*(?!!).*?\*/|(\s+)''', re.S)
+CSS_PUNCTUATION = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|\s*([{};,])\s*|(:)\s+''')
+CSS_IMPORT = re.compile(r'''@import\s+(?:url\([^)]*\)|"[^"]*"|'[^']*')[^;]*;''')
+CSS_CHARSET = re.compile(r'''@charset\s+"[^"]*";''')
+CSS_URL = re.compile(r'''url\(\s*(['"]?)(.*?)\1\s*\)''')
+
+accepts_brotli = re.compile(r'\bbr\b')
+accepts_gzip = re.compile(r'\bgzip\b')
+
+
+def bundle_path(name):
+    return posixpath.join(BUNDLES_DIR, name)
+
+
+# Comments and runs of whitespace go, strings and /*! license */ comments stay
+def minify_css(css):
+    css = CSS_TOKENS.sub(lambda match: match.group(1) or (' ' if match.group(2) else ''), css)
+    # a space before a colon can be a descendant selector (a :hover), after one it never matters
+    css = CSS_PUNCTUATION.sub(lambda match: match.group(1) or match.group(2) or match.group(3), css)
+    return css.strip()
+
+
+# Only with rjsmin installed, otherwise the files are joined as they are; most of them ship minified anyway
+def minify_js(js):
+    return rjsmin.jsmin(js) if rjsmin is not None else js
+
+
+# url() references are relative to the source file, in the bundle they have to be relative to bundles/
+def rebase_css_urls(css, source, bundle):
+    def rebase(match):
+        quote, url = match.groups()
+        if not url or url.startswith(('/', '#', 'data:')) or '://' in url:
+            return match.group(0)
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(source), path))
+        return 'url({0}{1}{2}{0})'.format(quote, posixpath.relpath(target, posixpath.dirname(bundle)), suffix)
+    return CSS_URL.sub(rebase, css)
+
+
+def build_css_bundle(name, sources, read):
+    parts = [minify_css(rebase_css_urls(read(source), source, bundle_path(name))) for source in sources]
+    css = CSS_CHARSET.sub('', '\n'.join(parts))
+    # @import is ignored anywhere but at the top of a stylesheet
+    imports = CSS_IMPORT.findall(css)
+    return '\n'.join(imports + [CSS_IMPORT.sub('', css)])
+
+
+def build_js_bundle(name, sources, read):
+    # a file without a trailing semicolon must not run into the next one
+    return '\n;\n'.join(minify_js(read(source)) for source in sources)
+
+
+COMPRESSORS = [('.gz', lambda data: gzip.compress(data, 9, mtime=0))]
+if brotli is not None:
+    COMPRESSORS.append(('.br', lambda data: brotli.compress(data, quality=11)))
+
+
+def compress(storage, name):
+    with storage.open(name) as file:
+        content = file.read()
+    written = []
+    for suffix, compressor in COMPRESSORS:
+        compressed = compressor(content)
+        # not worth a second request path for a few bytes
+        if len(compressed) < len(content) * 0.95:
+            if storage.exists(name + suffix):
+                storage.delete(name + suffix)
+            storage._save(name + suffix, ContentFile(compressed))
+            written.append(name + suffix)
+    return written
+
+
+# collectstatic builds the STATIC_BUNDLES, fingerprints every file through the manifest
+# and stores .gz (and with brotli installed .br) siblings of the text files
+class BundledManifestStorage(ManifestStaticFilesStorage):
+
+    # jquery-ui's theme refers to icon images that are not shipped, such references are left as they are
+    def hashed_name(self, name, content=None, filename=None):
+        try:
+            return super().hashed_name(name, content, filename)
+        except ValueError:
+            if content is not None or self.exists(name.split('?')[0].split('#')[0]):
+                raise
+            logger.warning('Static file %s is referenced but missing', name)
+            return name
+
+    # Until collectstatic wrote a manifest (development, tests) files are served under their own names
+    def stored_name(self, name):
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def read(self, name):
+        with self.open(name) as file:
+            return file.read().decode('utf-8')
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            return
+        for name, sources in settings.STATIC_BUNDLES.items():
+            build = build_css_bundle if name.endswith('.css') else build_js_bundle
+            path = bundle_path(name)
+            if self.exists(path):
+                self.delete(path)
+            self._save(path, ContentFile(build(name, sources, self.read).encode('utf-8')))
+            paths[path] = (self, path)
+        yield from super().post_process(paths, dry_run, **options)
+        for name in set(self.hashed_files.values()):
+            if name.endswith(COMPRESSIBLE):
+                compress(self, name)
+
+
+def is_collected(name):
+    return name in getattr(staticfiles_storage, 'hashed_files', {})
+
+
+# Serves STATIC_ROOT in front of Django for deployments without a web server doing it.
+# Fingerprinted names never change, so they are cached for a year; precompressed siblings are preferred.
+class StaticFilesApplication:
+
+    def __init__(self, application, root=None, prefix=None):
+        self.application = application
+        self.root = os.path.realpath(root or settings.STATIC_ROOT)
+        self.prefix = prefix or settings.STATIC_URL
+        self.immutable = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(self.prefix):
+            return self.application(environ, start_response)
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            start_response('405 Method Not Allowed', [('Allow', 'GET, HEAD'), ('Content-Length', '0')])
+            return [b'']
+        name = path[len(self.prefix):]
+        file_path = os.path.realpath(os.path.join(self.root, name))
+        if not file_path.startswith(self.root + os.sep) or not os.path.isfile(file_path):
+            start_response('404 Not Found', [('Content-Type', 'text/plain'), ('Content-Length', '9')])
+            return [b'Not Found']
+        content_type, encoding = mimetypes.guess_type(name)
+        headers = [('Content-Type', content_type or 'application/octet-stream'), ('Vary', 'Accept-Encoding')]
+        accept_encoding = environ.get('HTTP_ACCEPT_ENCODING', '')
+        for content_encoding, suffix, accepts in (('br', '.br', accepts_brotli), ('gzip', '.gz', accepts_gzip)):
+            if encoding is None and accepts.search(accept_encoding) and os.path.isfile(file_path + suffix):
+                file_path += suffix
+                headers.append(('Content-Encoding', content_encoding))
+                break
+        stat = os.stat(file_path)
+        if name in self.immutable:
+            cache_control = 'public, max-age={}, immutable'.format(IMMUTABLE_MAX_AGE)
+        else:
+            cache_control = 'public, max-age={}'.format(settings.STATIC_MAX_AGE)
+        headers += [('Last-Modified', http_date(stat.st_mtime)), ('Cache-Control', cache_control)]
+        modified_since = parse_http_date_safe(environ.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if modified_since is not None and int(stat.st_mtime) <= modified_since:
+            start_response('304 Not Modified', [header for header in headers if header[0] != 'Content-Type'])
+            return [b'']
+        start_response('200 OK', headers + [('Content-Length', str(stat.st_size))])
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return [b'']
+        return environ.get('wsgi.file_wrapper', FileWrapper)(open(file_path, 'rb'), 64 * 1024)
@@ -0,0 +1,25 @@
+from django.db.backends.sqlite3 import base
+
+# Settings only this backend understands, they are not passed on to sqlite3.connect()
+CUSTOM_OPTIONS = ('pragmas', 'transaction_mode')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        for option in CUSTOM_OPTIONS:
+            params.pop(option, None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict['OPTIONS'].get('pragmas', {}).items():
+            connection.execute('PRAGMA {} = {}'.format(name, value))
+        return connection
+
+    # A deferred BEGIN fails at once with "database is locked" when a reading transaction tries to write
+    # while another one holds the write lock; BEGIN IMMEDIATE takes the lock up front and waits for it
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        self.cursor().execute('BEGIN {}'.format(mode) if mode else 'BEGIN')
@@ -0,0 +1,19 @@
+from django.core.signals import request_started
+from django.db import close_old_connections, connections
+
+
+# Backport of Django 4.1 CONN_HEALTH_CHECKS: a persistent connection the database server dropped
+# while it was idle is replaced before the request runs, instead of failing the request's first query
+def check_connections(**kwargs):
+    for connection in connections.all():
+        if connection.settings_dict.get('CONN_HEALTH_CHECKS') and connection.connection is not None \
+                and not connection.is_usable():
+            connection.close()
+
+
+def close_stale_connections():
+    close_old_connections()
+    check_connections()
+
+
+request_started.connect(check_connections)
@@ -0,0 +1,28 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+
+from .db import close_stale_connections
+
+
+# Under ASGI Django runs every sync view on one shared thread, so a slow request holds up all others.
+# Views wrapped here keep no per-thread state; as async views they run on the executor's pool instead.
+# WSGI servers give every request a thread of its own, there the view runs on it as a sync view would.
+def thread_pooled(view):
+
+    def run(request, *args, **kwargs):
+        # request_started/finished only clean up the shared thread, pool threads do it themselves
+        close_stale_connections()
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            close_old_connections()
+
+    @wraps(view)
+    async def pooled(request, *args, **kwargs):
+        if not isinstance(request, ASGIRequest):
+            return await sync_to_async(view)(request, *args, **kwargs)
+        return await sync_to_async(run, thread_sensitive=False)(request, *args, **kwargs)
+    return pooled
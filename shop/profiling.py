@@ -0,0 +1,228 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.template.base import Template
+
+logger = logging.getLogger(__name__)
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+_current_profile = contextvars.ContextVar('current_profile', default=None)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class ViewStats:
+
+    def __init__(self):
+        self.duration = Histogram(TIME_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.sql_time = 0
+        self.template_time = 0
+        self.response_bytes = 0
+
+
+class StatsRegistry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view, profile, duration, response_bytes):
+        with self.lock:
+            stats = self.views.setdefault(view, ViewStats())
+            stats.duration.observe(duration)
+            stats.queries.observe(profile.query_count)
+            stats.sql_time += profile.sql_time
+            stats.template_time += profile.template_time
+            stats.response_bytes += response_bytes
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+    def as_json(self):
+        with self.lock:
+            return {view: {
+                'requests': stats.duration.count,
+                'mean_ms': stats.duration.sum / stats.duration.count * 1000,
+                'mean_queries': stats.queries.sum / stats.queries.count,
+                'sql_ms': stats.sql_time * 1000,
+                'template_ms': stats.template_time * 1000,
+                'response_bytes': stats.response_bytes,
+            } for view, stats in self.views.items()}
+
+    def as_prometheus(self):
+        lines = []
+        with self.lock:
+            for name, kind, help_text, attribute in (
+                    ('shop_view_duration_seconds', 'histogram', 'Wall time per view.', 'duration'),
+                    ('shop_view_queries', 'histogram', 'Database queries per request.', 'queries')):
+                lines += ['# HELP {} {}'.format(name, help_text), '# TYPE {} {}'.format(name, kind)]
+                for view, stats in sorted(self.views.items()):
+                    histogram = getattr(stats, attribute)
+                    for bound, count in histogram.cumulative():
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append('{}_bucket{{view="{}",le="{}"}} {}'.format(name, view, le, count))
+                    lines.append('{}_sum{{view="{}"}} {}'.format(name, view, histogram.sum))
+                    lines.append('{}_count{{view="{}"}} {}'.format(name, view, histogram.count))
+            for name, help_text, attribute in (
+                    ('shop_view_sql_seconds_total', 'Time spent in SQL.', 'sql_time'),
+                    ('shop_view_template_seconds_total', 'Time spent rendering templates.', 'template_time'),
+                    ('shop_view_response_bytes_total', 'Response body size.', 'response_bytes')):
+                lines += ['# HELP {} {}'.format(name, help_text), '# TYPE {} counter'.format(name)]
+                for view, stats in sorted(self.views.items()):
+                    lines.append('{}{{view="{}"}} {}'.format(name, view, getattr(stats, attribute)))
+        return '\n'.join(lines) + '\n'
+
+
+registry = StatsRegistry()
+
+
+class RequestProfile:
+
+    def __init__(self):
+        self.query_count = 0
+        self.sql_time = 0
+        self.template_time = 0
+        self.template_depth = 0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.query_count += 1
+            # the SQL still holds placeholders, so equal statements share the same shape
+            self.statements[sql] += 1
+
+    def repeated_statements(self, threshold):
+        return [(sql, count) for sql, count in self.statements.most_common() if count >= threshold]
+
+
+# One permanent wrapper per connection, it finds the current request through the context variable,
+# so concurrent requests sharing a connection object never see each other's queries
+def record_query(execute, sql, params, many, context):
+    profile = _current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+def instrument_connection(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def instrument_templates():
+    # Only the outermost render is timed, included templates are part of it
+    if getattr(Template.render, 'profiled', False):
+        return
+    original = Template.render
+
+    @wraps(original)
+    def render(self, context):
+        profile = _current_profile.get()
+        if profile is None or profile.template_depth:
+            return original(self, context)
+        profile.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return original(self, context)
+        finally:
+            profile.template_time += time.perf_counter() - started
+            profile.template_depth -= 1
+
+    render.profiled = True
+    Template.render = render
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        instrument_templates()
+        connection_created.connect(instrument_connection)
+        for connection in connections.all():
+            instrument_connection(connection)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        return self.record(request, response, profile, started)
+
+    # Views run in threads under ASGI, they see the profile through the context copied by sync_to_async
+    async def __acall__(self, request):
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        return self.record(request, response, profile, started)
+
+    def record(self, request, response, profile, started):
+        duration = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        response_bytes = 0 if response.streaming else len(response.content)
+        registry.record(view, profile, duration, response_bytes)
+        for sql, count in profile.repeated_statements(settings.PROFILING_N_PLUS_ONE_THRESHOLD):
+            logger.warning('Possible N+1 in %s: %d x %s', view, count, sql)
+        return response
+
+
+def metrics(request):
+    token = settings.PROFILING_METRICS_TOKEN
+    authorized = token and request.META.get('HTTP_AUTHORIZATION') == 'Bearer {}'.format(token)
+    if not authorized and not request.user.is_staff:
+        return HttpResponseForbidden()
+    if request.GET.get('format') == 'json':
+        return JsonResponse(registry.as_json())
+    return HttpResponse(registry.as_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
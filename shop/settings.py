@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 from pathlib import Path
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -43,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shop.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -65,6 +68,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'products.context_processors.cart_summary',
             ],
         },
     },
@@ -76,12 +80,81 @@ WSGI_APPLICATION = 'shop.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
-DATABASES = {
+# DATABASE_ENGINE selects the backend: sqlite3 (default, for development), postgresql, mysql or a dotted path
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite3')
+
+if DATABASE_ENGINE == 'sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'shop.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'timeout': 20,  # seconds a writer waits for the lock
+                'transaction_mode': 'IMMEDIATE',
+                'pragmas': {
+                    'journal_mode': 'wal',  # readers no longer block the writer and the other way round
+                    'synchronous': 'normal',
+                    'cache_size': -32000,  # KiB
+                    'mmap_size': 256 * 1024 * 1024,
+                    'temp_store': 'memory',
+                },
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': DATABASE_ENGINE if '.' in DATABASE_ENGINE else 'django.db.backends.' + DATABASE_ENGINE,
+            'NAME': os.environ.get('DATABASE_NAME', 'shop'),
+            'USER': os.environ.get('DATABASE_USER', ''),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', ''),
+            'PORT': os.environ.get('DATABASE_PORT', ''),
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': os.environ.get('DATABASE_CONN_HEALTH_CHECKS', '1') == '1',  # see shop/db.py
+        }
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'shop'),
     }
 }
+# The locmem default is a separate cache in every process, fit for a single development server only
+SHARED_CACHE = CACHE_BACKEND.rsplit('.', 1)[-1] not in ('LocMemCache', 'DummyCache')
+# Server processes, the variable gunicorn and uvicorn read their worker count from. Catalog pages, their ETags,
+# facet counts and cart summaries are invalidated by bumping the catalog generation in the cache, which the
+# other workers only see in a shared one. Management commands and run_jobs change the catalog from processes
+# of their own as well, so their changes reach a locmem server only after CATALOG_CACHE_TIMEOUT.
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+if WEB_CONCURRENCY > 1 and not SHARED_CACHE:
+    raise ImproperlyConfigured('WEB_CONCURRENCY={} needs a shared CACHE_BACKEND, such as memcached or redis'
+                               .format(WEB_CONCURRENCY))
+
+# Sessions: 'db' reads django_session on every request, 'cached_db' reads them from the cache above and writes
+# through to the table, 'signed_cookies' keeps them in the client's cookie only. Expired database sessions are
+# removed by the purge_sessions command.
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'db')
+SESSION_ENGINE = SESSION_BACKEND if '.' in SESSION_BACKEND else 'django.contrib.sessions.backends.' + SESSION_BACKEND
+# with several workers a logout would only evict one process's copy, the others would keep accepting the cookie;
+# a single process can keep them in its local cache
+if SESSION_ENGINE.rsplit('.', 1)[-1] in ('cache', 'cached_db') and WEB_CONCURRENCY > 1 and not SHARED_CACHE:
+    raise ImproperlyConfigured('SESSION_BACKEND={} with WEB_CONCURRENCY={} needs a shared CACHE_BACKEND, such as '
+                               'memcached or redis'.format(SESSION_BACKEND, WEB_CONCURRENCY))
+
+CART_CACHE_TIMEOUT = 300
+CATALOG_CACHE_TIMEOUT = 3600
+CATALOG_BROWSER_MAX_AGE = 0  # browsers and proxies revalidate with ETag / Last-Modified
+# Lower bounds of the catalog's price filter ranges, the last one is open ended; run refresh_facets after a change
+CATALOG_PRICE_BUCKETS = (0, 25, 50, 100, 250, 500, 1000)
+# Products in the "from this producer" and "bought together" blocks of a product page
+RELATED_PRODUCTS = 4
 
 
 # Password validation
@@ -119,7 +192,31 @@ USE_TZ = True
 
 STATICFILES_DIRS = [(os.path.join(PROJECT_PATH, 'static'))]
 STATIC_URL = '/static/'
-STATIC_ROOT = '/all/static/'
+STATIC_ROOT = os.environ.get('STATIC_ROOT', '/all/static/')
+STATICFILES_STORAGE = 'shop.assets.BundledManifestStorage'
+# Serve STATIC_ROOT from the WSGI application itself, for deployments without a web server in front
+SERVE_STATIC = os.environ.get('SERVE_STATIC', '0') == '1'
+STATIC_MAX_AGE = 60 * 60  # seconds, for files without a content hash in their name
+
+# Per-page bundles, built into STATIC_ROOT/bundles/ by collectstatic and used by the {% bundle %} tag
+_common_css = ['styles/bootstrap4/bootstrap.min.css', 'plugins/font-awesome-4.7.0/css/font-awesome.min.css',
+               'plugins/OwlCarousel2-2.2.1/owl.carousel.css', 'plugins/OwlCarousel2-2.2.1/owl.theme.default.css',
+               'plugins/OwlCarousel2-2.2.1/animate.css']
+_common_js = ['js/jquery-3.2.1.min.js', 'styles/bootstrap4/popper.js', 'styles/bootstrap4/bootstrap.min.js',
+              'plugins/Isotope/isotope.pkgd.min.js', 'plugins/OwlCarousel2-2.2.1/owl.carousel.js',
+              'plugins/easing/easing.js']
+STATIC_BUNDLES = {
+    'main.css': _common_css + ['styles/main_styles.css', 'styles/responsive.css'],
+    'catalog.css': _common_css + ['plugins/jquery-ui-1.12.1.custom/jquery-ui.css', 'styles/categories_styles.css',
+                                  'styles/categories_responsive.css'],
+    'single.css': _common_css + ['plugins/themify-icons/themify-icons.css',
+                                 'plugins/jquery-ui-1.12.1.custom/jquery-ui.css', 'styles/single_styles.css',
+                                 'styles/single_responsive.css'],
+    'main.js': _common_js + ['js/custom.js'],
+    'catalog.js': _common_js + ['plugins/jquery-ui-1.12.1.custom/jquery-ui.js', 'js/categories_custom.js',
+                                'js/search_autocomplete.js'],
+    'single.js': _common_js + ['plugins/jquery-ui-1.12.1.custom/jquery-ui.js', 'js/single_custom.js'],
+}
 # Basic auth urls
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth
 LOGIN_REDIRECT_URL = '/'
@@ -128,6 +225,9 @@ LOGOUT_REDIRECT_URL = '/'
 
 MEDIA_ROOT = os.path.join(PROJECT_PATH)
 MEDIA_URL = '/'
+PRODUCT_IMAGE_DERIVATIVES_DIR = 'media/derivatives'
+PRODUCT_IMAGE_WIDTHS = (100, 300, 600)
+PRODUCT_IMAGE_QUALITY = 80
 # Email configuration
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_HOST_USER = ''  # write gmail address here
@@ -136,6 +236,43 @@ EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 DEFAULT_FROM_EMAIL = ''  # write gmail address here
 
+# Invoice PDFs, any Django storage class may be used
+INVOICES_DIR = os.path.join(PROJECT_PATH, 'temp/invoices')
+INVOICE_STORAGE = 'django.core.files.storage.FileSystemStorage'
+INVOICE_STORAGE_OPTIONS = {'location': INVOICES_DIR}
+
+# Background jobs (run with `manage.py run_jobs`)
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BACKOFF = 30  # seconds, doubled after every failed attempt
+JOB_RETRY_MAX_DELAY = 3600
+JOB_LEASE_TIME = 300  # seconds before a job claimed by a dead worker is retried
+
+# Product search lists the best SEARCH_MAX_RESULTS matches and says so when more products matched.
+# Without FTS5 every server process searches an index of its own, read again at most every
+# SEARCH_REBUILD_INTERVAL seconds after another process changed the catalog.
+SEARCH_MAX_RESULTS = 240
+SEARCH_REBUILD_INTERVAL = int(os.environ.get('SEARCH_REBUILD_INTERVAL', 30))
+
+# Search-as-you-type (/products/api/autocomplete/) from a prefix index in every server process, built at startup.
+# Past the memory limit (bytes) words inside names are not indexed, then the index is dropped for the search.
+AUTOCOMPLETE_MAX_RESULTS = 10
+AUTOCOMPLETE_MEMORY_LIMIT = int(os.environ.get('AUTOCOMPLETE_MEMORY_LIMIT', 768 * 1024 * 1024))
+AUTOCOMPLETE_PRELOAD = os.environ.get('AUTOCOMPLETE_PRELOAD', '1') == '1'
+# Seconds between background rebuilds after other processes changed the catalog, a million products take ~30 s
+AUTOCOMPLETE_REBUILD_INTERVAL = int(os.environ.get('AUTOCOMPLETE_REBUILD_INTERVAL', 30))
+
+# JSON catalog API (/products/api/), brotli compression is used when the brotli package is installed
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+
+# Admin change lists of tables at least this big show an estimated row count
+ADMIN_COUNT_ESTIMATE_THRESHOLD = 100000
+
+# Request profiling, stats are served on /metrics/ to staff or with the bearer token. It wraps every query and
+# template render, so it is off unless PROFILING_ENABLED=1 is set in the environment.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'
+PROFILING_METRICS_TOKEN = os.environ.get('PROFILING_METRICS_TOKEN', '')
+PROFILING_N_PLUS_ONE_THRESHOLD = 5
 
 DEFAULT_VENDOR = {
     'company': 'Bartlomiej Strzyga', 'address1': 'First Avenue', 'address2': 'WF1 2HS, Wakefield',
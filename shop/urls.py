@@ -17,10 +17,12 @@ from django.contrib import admin
 from django.urls import include, path
 from django.conf.urls.static import static
 from django.conf import settings
+from .profiling import metrics
 from .views import main
 
 urlpatterns = [
     path('', main),
     path('admin/', admin.site.urls),
+    path('metrics/', metrics, name='metrics'),
     path('products/', include('products.urls')),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -9,8 +9,21 @@ https://docs.djangoproject.com/en/2.1/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shop.settings')
 
 application = get_wsgi_application()
+
+if settings.AUTOCOMPLETE_PRELOAD:
+    from products.autocomplete import autocomplete_index
+
+    autocomplete_index.preload()
+
+if settings.SERVE_STATIC:
+    from .assets import StaticFilesApplication
+
+    application = StaticFilesApplication(application)
+
+from . import db  # noqa: E402,F401  connection health checks
@@ -0,0 +1,46 @@
+/* Search-as-you-type: fills the search field's datalist from /products/api/autocomplete/ */
+
+jQuery(document).ready(function($)
+{
+	"use strict";
+
+	var input = $('input[data-autocomplete]');
+	if(!input.length)
+	{
+		return;
+	}
+	var list = $('#' + input.attr('list'));
+	var url = input.data('autocomplete');
+	var timer = null;
+	var request = null;
+
+	input.on('input', function()
+	{
+		var prefix = $.trim(input.val());
+		clearTimeout(timer);
+		if(prefix.length < 2)
+		{
+			list.empty();
+			return;
+		}
+		timer = setTimeout(function()
+		{
+			if(request)
+			{
+				request.abort();
+			}
+			request = $.getJSON(url, {q: prefix}, function(data)
+			{
+				list.empty();
+				$.each(data.products, function(index, product)
+				{
+					list.append($('<option>').attr('value', product.name).text(product.producer));
+				});
+				$.each(data.producers, function(index, producer)
+				{
+					list.append($('<option>').attr('value', producer));
+				});
+			});
+		}, 100);
+	});
+});